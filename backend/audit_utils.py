@@ -5,6 +5,7 @@ Utilidades para el registro de logs de auditoría
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import LogAuditoria
+from database import persistir, unidad_de
 from schemas import LogAuditoriaCreate
 from typing import Optional, Dict, Any
 from datetime import datetime
@@ -56,7 +57,8 @@ async def log_audit_action(
         log.fecha = datetime.utcnow()
         
         session.add(log)
-        await session.commit()
+        # Dentro de una unidad de trabajo se guarda en el mismo commit que el cambio auditado
+        await persistir(session)
         return {"status": "success", "log_id": log.id}
         
     except Exception as e:
@@ -64,7 +66,8 @@ async def log_audit_action(
         error_details = traceback.format_exc()
         error_msg = f"Error al registrar log de auditoría: {str(e)}\n{error_details}"
         print(error_msg)
-        await session.rollback()
+        if unidad_de(session) is None:
+            await session.rollback()
         return {"status": "error", "error": str(e), "details": error_details}
 
 async def log_activity(
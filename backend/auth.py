@@ -2,18 +2,20 @@
 # Endpoints de autenticación y gestión de usuarios
 
 import secrets
+import json
+import base64
 import string
 import os
 from datetime import datetime, timedelta
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from typing import List, Optional, Literal
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
 from fastapi.security import HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_
+from sqlalchemy import or_, tuple_, literal_column, func, DateTime
 from sqlalchemy.exc import IntegrityError
 
-from models import Usuario, PasswordReset, LogAcceso
+from models import Usuario, PasswordReset, LogAcceso, ORDEN_FECHA_CREACION, ORDEN_ULTIMO_ACCESO
 from schemas import (
     UserLogin, UserCreate, UserUpdate, UserResponse, Token, 
     PasswordChange, PasswordResetRequest, PasswordResetConfirm,
@@ -26,9 +28,17 @@ from security import (
     verify_token, get_current_user, check_permission, ROLES
 )
 from email_service import email_service
+from email_outbox import encolar_email
 
 # Importar get_session desde database.py
-from database import get_session
+from database import get_session, get_read_session, get_unidad_trabajo, UnidadDeTrabajo, persistir
+from repositorio_usuarios import (
+    usuario_por_username, usuario_por_id, usuario_por_email, reset_vigente_por_token
+)
+from usuario_actual import get_usuario_actual, cargar_usuario
+from cache_bus import bus_invalidacion
+from busqueda_usuarios import autocompletar_usuarios, TEXTO_BUSQUEDA
+from etags import etag_contenido, coincide_etag, no_modificado, agregar_etag
 from audit_utils import log_audit_action, get_client_ip, get_user_agent
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
@@ -44,20 +54,18 @@ async def log_access(session: AsyncSession, log_data: LogAccesoCreate):
     """Registra un log de acceso"""
     log = LogAcceso(**log_data.dict())
     session.add(log)
-    await session.commit()
+    await persistir(session)
 
 @router.post("/login", response_model=Token)
 async def login(
     user_credentials: UserLogin, 
     request: Request,
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Inicio de sesión de usuario"""
+    session = unidad.session
     # Buscar usuario
-    result = await session.execute(
-        select(Usuario).where(Usuario.username == user_credentials.username)
-    )
-    user = result.scalar_one_or_none()
+    user = await usuario_por_username(session, user_credentials.username)
     
     if not user or not verify_password(user_credentials.password, user.hashed_password):
         raise HTTPException(
@@ -73,7 +81,6 @@ async def login(
     
     # Actualizar último acceso
     user.ultimo_acceso = datetime.utcnow()
-    await session.commit()
     
     # Crear token
     access_token = create_access_token(
@@ -88,6 +95,8 @@ async def login(
         ip_address=request.client.host,
         user_agent=request.headers.get("user-agent")
     ))
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    await unidad.confirmar()
     
     return Token(
         access_token=access_token,
@@ -99,9 +108,10 @@ async def login(
 async def google_login(
     data: GoogleLogin,
     request: Request,
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Inicio de sesión con Google OAuth2"""
+    session = unidad.session
     try:
         # Verificar el token de Google
         id_info = id_token.verify_oauth2_token(
@@ -114,10 +124,7 @@ async def google_login(
         full_name = id_info.get('name', '')
         
         # Buscar usuario por email
-        result = await session.execute(
-            select(Usuario).where(Usuario.email == email)
-        )
-        user = result.scalar_one_or_none()
+        user = await usuario_por_email(session, email)
         
         if not user:
             # Si el usuario no existe, lo creamos automáticamente
@@ -125,10 +132,7 @@ async def google_login(
             username = email.split('@')[0]
             
             # Verificar si el username ya existe
-            username_check = await session.execute(
-                select(Usuario).where(Usuario.username == username)
-            )
-            if username_check.scalar_one_or_none():
+            if await usuario_por_username(session, username):
                 username = f"{username}_{secrets.token_hex(2)}"
             
             new_user = Usuario(
@@ -140,19 +144,15 @@ async def google_login(
                 activo=False # El usuario se crea inactivo por defecto
             )
             session.add(new_user)
-            await session.commit()
+            await session.flush()
             await session.refresh(new_user)
             user = new_user
 
-            # Enviar notificación al administrador
+            # Notificación al administrador en la bandeja de salida (misma transacción)
             # Usaremos el email configurado en el .env como remitente para recibir también la notificación
             admin_email = os.getenv("EMAIL_FROM")
             if admin_email:
-                email_service.send_admin_notification_email(
-                    admin_email=admin_email,
-                    new_user_email=email,
-                    new_user_name=full_name
-                )
+                encolar_email(session, admin_email, *email_service.admin_notification_content(email, full_name))
             
             # Registrar auditoría de creación
             await log_audit_action(
@@ -167,6 +167,8 @@ async def google_login(
             )
 
         if not user.activo:
+            # La cuenta recién creada queda guardada a la espera de aprobación
+            await unidad.confirmar()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Su cuenta está pendiente de aprobación por un administrador"
@@ -174,7 +176,6 @@ async def google_login(
         
         # Actualizar último acceso
         user.ultimo_acceso = datetime.utcnow()
-        await session.commit()
         
         # Crear token del sistema
         access_token = create_access_token(
@@ -189,6 +190,8 @@ async def google_login(
             ip_address=request.client.host,
             user_agent=request.headers.get("user-agent")
         ))
+        await bus_invalidacion.publicar(session, "usuarios", user.id)
+        await unidad.confirmar()
         
         return Token(
             access_token=access_token,
@@ -234,9 +237,10 @@ async def logout(
 async def create_user(
     user_data: UserCreate,
     current_user: dict = Depends(check_permission("manage_users")),
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Crear nuevo usuario (solo administradores)"""
+    session = unidad.session
     # Verificar si el usuario ya existe
     result = await session.execute(
         select(Usuario).where(
@@ -264,15 +268,14 @@ async def create_user(
     )
     
     session.add(new_user)
-    await session.commit()
+    await session.flush()
     await session.refresh(new_user)
     
-    # Enviar email con credenciales
-    email_service.send_welcome_email(
-        user_data.email, 
-        user_data.username, 
-        password, 
-        user_data.rol
+    # Email con credenciales en la bandeja de salida (solo se envía si la creación se confirma)
+    encolar_email(
+        session,
+        user_data.email,
+        *email_service.welcome_content(user_data.username, password, user_data.rol)
     )
     
     # Registrar log de acceso
@@ -298,30 +301,160 @@ async def create_user(
         },
         details=f"Usuario creado: {new_user.username}"
     )
+    await unidad.confirmar()
     
     return UserResponse.from_orm(new_user)
 
+# Órdenes del listado de usuarios: expresión indexada junto con el id (ver models.py)
+ORDENES_USUARIOS = {
+    "id": None,
+    "username": Usuario.username,
+    "nombre": Usuario.nombre_completo,
+    "creacion": literal_column(ORDEN_FECHA_CREACION, DateTime),
+    "ultimo_acceso": literal_column(ORDEN_ULTIMO_ACCESO, DateTime),
+}
+# Órdenes cuyo valor en el cursor es una fecha
+ORDENES_FECHA = ("creacion", "ultimo_acceso")
+
+def _codificar_cursor(orden: str, direccion: str, valor, user_id: int) -> str:
+    if orden in ORDENES_FECHA:
+        # asyncpg envía datetime.min como '-infinity', igual que el coalesce del índice
+        valor = (valor or datetime.min).isoformat()
+    datos = json.dumps([orden, direccion, valor, user_id]).encode()
+    return base64.urlsafe_b64encode(datos).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str, orden: str, direccion: str):
+    """Valor de orden e id de la última fila de la página anterior"""
+    try:
+        datos = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        orden_cursor, direccion_cursor, valor, user_id = json.loads(datos)
+        if (orden_cursor, direccion_cursor) != (orden, direccion):
+            raise ValueError("el cursor corresponde a otro orden")
+        if orden in ORDENES_FECHA:
+            valor = datetime.fromisoformat(valor)
+        return valor, int(user_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {e}")
+
+def _patrones_busqueda(busqueda: str, modo: str) -> List[str]:
+    """Patrones ILIKE con los comodines del texto buscado escapados"""
+    escapado = busqueda.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    if modo == "prefijo":
+        # Inicio del username o de cualquier palabra siguiente (email, nombre o apellidos)
+        return [f"{escapado}%", f"% {escapado}%"]
+    return [f"%{escapado}%"]
+
+def condiciones_usuarios(
+    rol: Optional[str] = None,
+    activo: Optional[bool] = None,
+    busqueda: Optional[str] = None,
+    modo: str = "contiene"
+) -> list:
+    """Condiciones WHERE de los filtros del listado (también las usan las operaciones masivas)"""
+    condiciones = []
+    if rol:
+        condiciones.append(Usuario.rol == rol)
+    if activo is not None:
+        condiciones.append(Usuario.activo == activo)
+    if busqueda:
+        # Sobre el mismo texto sin acentos que el autocompletado, para usar su índice GiST de trigramas
+        texto = literal_column(f"({TEXTO_BUSQUEDA})")
+        condiciones.append(or_(*(
+            texto.ilike(func.sistema.f_unaccent(func.lower(patron)))
+            for patron in _patrones_busqueda(busqueda, modo)
+        )))
+    return condiciones
+
 @router.get("/users", response_model=List[UserResponse])
 async def list_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    limite: int = Query(50, ge=1, le=200),
+    orden: Literal["id", "username", "nombre", "creacion", "ultimo_acceso"] = "id",
+    direccion: Literal["asc", "desc"] = "asc",
+    rol: Optional[str] = None,
+    activo: Optional[bool] = None,
+    busqueda: Optional[str] = Query(None, min_length=1, max_length=100),
+    modo: Literal["contiene", "prefijo"] = "contiene",
     current_user: dict = Depends(check_permission("manage_users")),
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
-    """Listar usuarios (solo administradores)"""
-    result = await session.execute(select(Usuario))
+    """
+    Listar usuarios (solo administradores), una página por llamada.
+    Se puede ordenar, filtrar por rol y estado y buscar en username, email y
+    nombre completo sin distinguir acentos. Si hay más resultados, la cabecera X-Next-Cursor trae el
+    cursor de la página siguiente (mismos parámetros más `cursor`).
+    """
+    expresion = ORDENES_USUARIOS[orden]
+    query = select(Usuario).where(*condiciones_usuarios(rol, activo, busqueda, modo))
+
+    # Paginación por cursor: continuar después de la última fila entregada
+    if cursor:
+        valor, ultimo_id = _decodificar_cursor(cursor, orden, direccion)
+        if expresion is None:
+            clave, limite_cursor = Usuario.id, ultimo_id
+        else:
+            clave, limite_cursor = tuple_(expresion, Usuario.id), tuple_(valor, ultimo_id)
+        query = query.where(clave > limite_cursor if direccion == "asc" else clave < limite_cursor)
+
+    columnas_orden = [Usuario.id] if expresion is None else [expresion, Usuario.id]
+    if direccion == "desc":
+        columnas_orden = [columna.desc() for columna in columnas_orden]
+    # Una fila de más indica si hay página siguiente
+    result = await session.execute(query.order_by(*columnas_orden).limit(limite + 1))
     users = result.scalars().all()
+
+    if len(users) > limite:
+        users = users[:limite]
+        ultimo = users[-1]
+        valor = {
+            "id": None,
+            "username": ultimo.username,
+            "nombre": ultimo.nombre_completo,
+            "creacion": ultimo.fecha_creacion,
+            "ultimo_acceso": ultimo.ultimo_acceso,
+        }[orden]
+        response.headers["X-Next-Cursor"] = _codificar_cursor(orden, direccion, valor, ultimo.id)
     return [UserResponse.from_orm(user) for user in users]
 
+@router.get("/users/buscar", response_model=List[UserResponse])
+async def buscar_usuarios(
+    q: str = Query(..., min_length=2, max_length=100),
+    limite: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(check_permission("manage_users")),
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Autocompletado de usuarios por username, email o nombre completo,
+    ordenado por parecido. Tolera errores de tipeo y acentos ("jose" encuentra
+    "José"). Solo administradores.
+    """
+    users = await autocompletar_usuarios(session, q, limite)
+    return [UserResponse.from_orm(user) for user in users]
+
+def _etag_usuario(user: Usuario) -> str:
+    """ETag de un usuario a partir de los campos que expone UserResponse"""
+    return etag_contenido({campo: getattr(user, campo) for campo in UserResponse.model_fields})
+
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: int,
+    request: Request,
+    response: Response,
     current_user: dict = Depends(check_permission("manage_users")),
     session: AsyncSession = Depends(get_session)
 ):
-    """Obtener usuario por ID"""
-    result = await session.execute(select(Usuario).where(Usuario.id == user_id))
-    user = result.scalar_one_or_none()
+    """
+    Obtener usuario por ID. Responde 304 si coincide con If-None-Match; el
+    usuario sale de la caché de usuarios cuando está vigente (sin consulta).
+    """
+    user = await cargar_usuario(session, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    etag = _etag_usuario(user)
+    if coincide_etag(request, etag):
+        return no_modificado(etag)
+    agregar_etag(response, etag)
     return UserResponse.from_orm(user)
 
 @router.put("/users/{user_id}", response_model=UserResponse)
@@ -329,11 +462,11 @@ async def update_user(
     user_id: int,
     user_data: UserUpdate,
     current_user: dict = Depends(check_permission("manage_users")),
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Actualizar usuario"""
-    result = await session.execute(select(Usuario).where(Usuario.id == user_id))
-    user = result.scalar_one_or_none()
+    session = unidad.session
+    user = await usuario_por_id(session, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
@@ -342,8 +475,8 @@ async def update_user(
     for field, value in update_data.items():
         setattr(user, field, value)
     try:
-        await session.commit()
-        await session.refresh(user)
+        # flush para detectar duplicados antes de registrar los logs; el commit es al final
+        await session.flush()
     except IntegrityError as e:
         await session.rollback()
         if 'email' in str(e.orig):
@@ -367,17 +500,19 @@ async def update_user(
         new_data={k: v for k, v in update_data.items() if k != "hashed_password"},
         details=f"Usuario actualizado: {user.username}"
     )
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    await unidad.confirmar()
     return UserResponse.from_orm(user)
 
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: int,
     current_user: dict = Depends(check_permission("manage_users")),
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Eliminar usuario (desactivar)"""
-    result = await session.execute(select(Usuario).where(Usuario.id == user_id))
-    user = result.scalar_one_or_none()
+    session = unidad.session
+    user = await usuario_por_id(session, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     # Proteger admin
@@ -385,7 +520,6 @@ async def delete_user(
         raise HTTPException(status_code=403, detail="No se puede eliminar el usuario admin")
     # Desactivar usuario en lugar de eliminarlo
     user.activo = False
-    await session.commit()
     # Registrar log de acceso
     await log_access(session, LogAccesoCreate(
         usuario_id=current_user["user_id"],
@@ -408,19 +542,22 @@ async def delete_user(
         },
         details=f"Usuario desactivado: {user.username}"
     )
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    await unidad.confirmar()
     return {"message": "Usuario desactivado exitosamente"}
 
 @router.post("/change-password")
 async def change_password(
     password_data: PasswordChange,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Cambiar contraseña del usuario actual"""
-    result = await session.execute(
-        select(Usuario).where(Usuario.id == current_user["user_id"])
-    )
-    user = result.scalar_one_or_none()
+    session = unidad.session
+    # Credenciales siempre desde la base: la caché de usuarios puede tener un hash anterior
+    user = await usuario_por_id(session, current_user["user_id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     if not verify_password(password_data.current_password, user.hashed_password):
         raise HTTPException(
@@ -429,7 +566,6 @@ async def change_password(
         )
     
     user.hashed_password = get_password_hash(password_data.new_password)
-    await session.commit()
     
     # Registrar log
     await log_access(session, LogAccesoCreate(
@@ -437,19 +573,19 @@ async def change_password(
         username=current_user["sub"],
         accion="change_password"
     ))
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    await unidad.confirmar()
     
     return {"message": "Contraseña cambiada exitosamente"}
 
 @router.post("/reset-password-request")
 async def request_password_reset(
     reset_request: PasswordResetRequest,
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Solicitar restablecimiento de contraseña"""
-    result = await session.execute(
-        select(Usuario).where(Usuario.email == reset_request.email)
-    )
-    user = result.scalar_one_or_none()
+    session = unidad.session
+    user = await usuario_por_email(session, reset_request.email)
     
     if not user:
         # No revelar si el email existe o no
@@ -466,33 +602,25 @@ async def request_password_reset(
         expira_en=expires
     )
     session.add(reset_record)
-    await session.commit()
     
-    # Enviar email
-    email_service.send_password_reset_email(
-        reset_request.email, 
-        user.username, 
-        token
+    # Email con el enlace en la bandeja de salida, junto con el token
+    encolar_email(
+        session,
+        reset_request.email,
+        *email_service.password_reset_content(user.username, token)
     )
+    await unidad.confirmar()
     
     return {"message": "Si el email existe, se enviará un enlace de restablecimiento"}
 
 @router.post("/reset-password-confirm")
 async def confirm_password_reset(
     reset_confirm: PasswordResetConfirm,
-    session: AsyncSession = Depends(get_session)
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
 ):
     """Confirmar restablecimiento de contraseña"""
-    result = await session.execute(
-        select(PasswordReset).where(
-            and_(
-                PasswordReset.token == reset_confirm.token,
-                PasswordReset.usado == False,
-                PasswordReset.expira_en > datetime.utcnow()
-            )
-        )
-    )
-    reset_record = result.scalar_one_or_none()
+    session = unidad.session
+    reset_record = await reset_vigente_por_token(session, reset_confirm.token)
     
     if not reset_record:
         raise HTTPException(
@@ -501,10 +629,7 @@ async def confirm_password_reset(
         )
     
     # Buscar usuario
-    result = await session.execute(
-        select(Usuario).where(Usuario.email == reset_record.email)
-    )
-    user = result.scalar_one_or_none()
+    user = await usuario_por_email(session, reset_record.email)
     
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -512,34 +637,42 @@ async def confirm_password_reset(
     # Actualizar contraseña
     user.hashed_password = get_password_hash(reset_confirm.new_password)
     reset_record.usado = True
-    await session.commit()
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    await unidad.confirmar()
     
     return {"message": "Contraseña restablecida exitosamente"}
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
-    current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session)
+    request: Request,
+    response: Response,
+    usuario: Usuario = Depends(get_usuario_actual)
 ):
-    """Obtener información del usuario actual"""
-    result = await session.execute(
-        select(Usuario).where(Usuario.id == current_user["user_id"])
-    )
-    user = result.scalar_one_or_none()
-    return UserResponse.from_orm(user)
+    """Obtener información del usuario actual (304 si no cambió desde el ETag enviado)"""
+    etag = _etag_usuario(usuario)
+    if coincide_etag(request, etag):
+        return no_modificado(etag)
+    agregar_etag(response, etag)
+    return UserResponse.from_orm(usuario)
+
+# Los roles están definidos en el código: su ETag no cambia mientras el proceso vive
+ETAG_ROLES = etag_contenido(ROLES)
 
 @router.get("/roles", response_model=List[RoleInfo])
-async def get_roles():
+async def get_roles(request: Request, response: Response):
     """Obtener información de roles disponibles"""
+    if coincide_etag(request, ETAG_ROLES):
+        return no_modificado(ETAG_ROLES)
+    agregar_etag(response, ETAG_ROLES)
     return [
-        RoleInfo(name=role, **info) 
+        RoleInfo(role=role, permissions=info["permissions"])
         for role, info in ROLES.items()
     ]
 
 @router.get("/logs", response_model=List[LogAccesoResponse])
 async def get_logs(
     current_user: dict = Depends(check_permission("manage_users")),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     limit: int = 100
 ):
     """Obtener logs de acceso (solo administradores)"""
@@ -0,0 +1,150 @@
+# backup_compresion.py
+# Códecs de compresión para los archivos de backup
+
+import os
+import tarfile
+import zipfile
+from typing import Optional, Dict, Any, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# zstd requiere el paquete 'zstandard' (en requirements.txt); sin él no se ofrece
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Códec y nivel por defecto (el nivel vacío usa el predeterminado de cada códec)
+BACKUP_COMPRESION = os.getenv("BACKUP_COMPRESION", "deflate")
+BACKUP_NIVEL_COMPRESION = os.getenv("BACKUP_NIVEL_COMPRESION", "")
+# Hilos de compresión de zstd: el backup corre en el mismo host que la base y la API
+BACKUP_ZSTD_HILOS = max(1, int(os.getenv("BACKUP_ZSTD_HILOS", "1")))
+
+# Contenedor, extensión, tipo MIME y rango de niveles de cada códec
+CODECS: Dict[str, Dict[str, Any]] = {
+    "store": {"extension": "zip", "media_type": "application/zip", "niveles": None, "defecto": None},
+    "deflate": {"extension": "zip", "media_type": "application/zip", "niveles": (0, 9), "defecto": 6},
+    "xz": {"extension": "tar.xz", "media_type": "application/x-xz", "niveles": (0, 9), "defecto": 6},
+    "zstd": {"extension": "tar.zst", "media_type": "application/zstd", "niveles": (1, 22), "defecto": 3},
+}
+
+# Firmas para reconocer el códec de un archivo sin depender de su nombre
+_FIRMAS = (
+    (b"PK\x03\x04", "zip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+
+
+def codecs_disponibles() -> List[str]:
+    """Códecs utilizables en esta instalación"""
+    return [codec for codec in CODECS if codec != "zstd" or zstandard is not None]
+
+
+def resolver_compresion(codec: Optional[str] = None, nivel: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Valida el códec y el nivel pedidos y completa los valores por defecto.
+
+    Raises:
+        ValueError: si el códec no existe, no está instalado o el nivel está fuera de rango
+    """
+    codec = codec or BACKUP_COMPRESION
+    if codec not in CODECS:
+        raise ValueError(f"Códec de compresión '{codec}' no válido. Opciones: {', '.join(CODECS)}")
+    if codec not in codecs_disponibles():
+        raise ValueError(f"El códec '{codec}' requiere instalar el paquete 'zstandard'")
+
+    info = CODECS[codec]
+    if nivel is None and BACKUP_NIVEL_COMPRESION and codec == BACKUP_COMPRESION:
+        nivel = int(BACKUP_NIVEL_COMPRESION)
+    if info["niveles"] is None:
+        nivel = None
+    elif nivel is None:
+        nivel = info["defecto"]
+    elif not info["niveles"][0] <= nivel <= info["niveles"][1]:
+        minimo, maximo = info["niveles"]
+        raise ValueError(f"Nivel de compresión para '{codec}' debe estar entre {minimo} y {maximo}")
+
+    return {"codec": codec, "nivel": nivel, "extension": info["extension"], "media_type": info["media_type"]}
+
+
+def _archivos_ordenados(origen_dir: str, archivos: List[str]) -> List[str]:
+    """metadata.json primero, para poder leerlo sin recorrer todo el archivo"""
+    return sorted(archivos, key=lambda nombre: (nombre != "metadata.json", nombre))
+
+
+def crear_archivo(origen_dir: str, archivos: List[str], destino: str, codec: str, nivel: Optional[int]) -> int:
+    """
+    Empaqueta y comprime los archivos indicados. Es bloqueante: desde código
+    async debe ejecutarse con asyncio.to_thread (zlib, lzma y zstd liberan el
+    GIL mientras comprimen, por lo que el event loop sigue atendiendo).
+
+    Returns:
+        int: tamaño del archivo generado en bytes
+    """
+    archivos = _archivos_ordenados(origen_dir, archivos)
+
+    if codec in ("store", "deflate"):
+        compression = zipfile.ZIP_STORED if codec == "store" else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(destino, 'w', compression, compresslevel=nivel) as zipf:
+            for nombre in archivos:
+                zipf.write(os.path.join(origen_dir, nombre), nombre)
+
+    elif codec == "xz":
+        with tarfile.open(destino, "w:xz", preset=nivel) as tar:
+            for nombre in archivos:
+                tar.add(os.path.join(origen_dir, nombre), arcname=nombre)
+
+    elif codec == "zstd":
+        compresor = zstandard.ZstdCompressor(level=nivel, threads=BACKUP_ZSTD_HILOS)
+        with open(destino, 'wb') as f, compresor.stream_writer(f) as escritor:
+            with tarfile.open(fileobj=escritor, mode="w|") as tar:
+                for nombre in archivos:
+                    tar.add(os.path.join(origen_dir, nombre), arcname=nombre)
+
+    else:
+        raise ValueError(f"Códec de compresión no soportado: {codec}")
+
+    return os.path.getsize(destino)
+
+
+def detectar_codec(path: str) -> str:
+    """Reconoce el contenedor de un archivo de backup por su firma (zip, xz o zstd)"""
+    with open(path, 'rb') as f:
+        cabecera = f.read(8)
+    for firma, contenedor in _FIRMAS:
+        if cabecera.startswith(firma):
+            return contenedor
+    raise ValueError("Formato de archivo de backup no reconocido")
+
+
+def extraer_archivo(path: str, dest_dir: str) -> List[str]:
+    """
+    Extrae un archivo de backup de cualquier códec soportado.
+
+    Returns:
+        list: nombres de los archivos extraídos
+    """
+    contenedor = detectar_codec(path)
+
+    if contenedor == "zip":
+        with zipfile.ZipFile(path) as zipf:
+            zipf.extractall(dest_dir)
+            return zipf.namelist()
+
+    if contenedor == "xz":
+        with tarfile.open(path, "r:xz") as tar:
+            tar.extractall(dest_dir, filter="data")
+            return tar.getnames()
+
+    if zstandard is None:
+        raise ValueError("El backup está comprimido con zstd y falta el paquete 'zstandard'")
+    nombres = []
+    with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as lector:
+        with tarfile.open(fileobj=lector, mode="r|") as tar:
+            for miembro in tar:
+                tar.extract(miembro, dest_dir, filter="data")
+                nombres.append(miembro.name)
+    return nombres
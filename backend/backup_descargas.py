@@ -0,0 +1,208 @@
+# backup_descargas.py
+# Listado y descarga reanudable (HTTP Range) de los backups guardados
+
+import os
+import re
+import asyncio
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import BackupSistema
+from security import check_permission
+from database import get_session
+from backup_service import ruta_artefacto, regenerar_artefacto
+from etags import coincide_etag
+
+router = APIRouter(prefix="/system", tags=["Backups"])
+
+# Bytes leídos del disco por cada bloque enviado
+BLOQUE_DESCARGA = 1024 * 1024
+
+
+def _etag(registro: BackupSistema, path: str) -> str:
+    """ETag fuerte a partir del sha256; los backups antiguos usan tamaño y fecha (débil)"""
+    sha256 = (registro.detalles or {}).get("sha256")
+    if sha256:
+        return f'"{sha256}"'
+    info = os.stat(path)
+    return f'W/"{info.st_size:x}-{int(info.st_mtime):x}"'
+
+
+# Un solo rango de bytes: 'a-b', 'a-' o '-n'
+_RANGO_BYTES = re.compile(r"bytes=(\d*)-(\d*)", re.ASCII)
+
+
+def _rango_solicitado(cabecera: Optional[str], tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta una cabecera Range de un solo rango ('bytes=a-b', 'bytes=a-'
+    o 'bytes=-n'). Devuelve None si no hay rango, tiene varios o no es
+    válido (RFC 9110: se ignora y se envía el archivo completo).
+
+    Raises:
+        HTTPException: 416 si el rango es válido pero no satisfacible
+    """
+    if not cabecera:
+        return None
+    coincidencia = _RANGO_BYTES.fullmatch(cabecera.strip())
+    if not coincidencia:
+        return None
+    inicio_texto, fin_texto = coincidencia.groups()
+
+    if inicio_texto:
+        inicio = int(inicio_texto)
+        if fin_texto and int(fin_texto) < inicio:
+            return None
+        fin = min(int(fin_texto), tamano - 1) if fin_texto else tamano - 1
+        satisfacible = inicio < tamano
+    elif fin_texto:
+        sufijo = int(fin_texto)
+        inicio, fin = max(tamano - sufijo, 0), tamano - 1
+        satisfacible = sufijo > 0 and tamano > 0
+    else:
+        # 'bytes=-' no es un rango válido
+        return None
+
+    if not satisfacible:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Rango no satisfacible",
+            headers={"Content-Range": f"bytes */{tamano}"}
+        )
+    return inicio, fin
+
+
+async def _leer_archivo(path: str, inicio: int, fin: int):
+    """Envía los bytes [inicio, fin] del archivo leyendo en un hilo para no bloquear el event loop"""
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, inicio)
+        pendiente = fin - inicio + 1
+        while pendiente > 0:
+            bloque = await asyncio.to_thread(f.read, min(BLOQUE_DESCARGA, pendiente))
+            if not bloque:
+                break
+            pendiente -= len(bloque)
+            yield bloque
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def respuesta_archivo_backup(request: Request, registro: BackupSistema) -> Response:
+    """
+    Respuesta de descarga de un backup con ETag, Content-Length y soporte de
+    Range/If-Range (206) e If-None-Match (304), para reanudar descargas cortadas.
+    """
+    path = ruta_artefacto(registro)
+    tamano = os.path.getsize(path)
+    etag = _etag(registro, path)
+    cabeceras = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={registro.nombre}",
+        "X-Backup-Id": str(registro.id),
+    }
+    media_type = (registro.detalles or {}).get("media_type", "application/octet-stream")
+
+    if coincide_etag(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabeceras)
+
+    # Con If-Range solo se respeta el rango si el archivo no cambió desde la primera descarga
+    if_range = request.headers.get("if-range")
+    rango = None
+    if not if_range or (if_range == etag and not etag.startswith("W/")):
+        rango = _rango_solicitado(request.headers.get("range"), tamano)
+
+    if request.method == "HEAD":
+        return Response(headers={**cabeceras, "Content-Length": str(tamano)}, media_type=media_type)
+
+    if rango is None:
+        return StreamingResponse(
+            _leer_archivo(path, 0, tamano - 1),
+            media_type=media_type,
+            headers={**cabeceras, "Content-Length": str(tamano)}
+        )
+
+    inicio, fin = rango
+    return StreamingResponse(
+        _leer_archivo(path, inicio, fin),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={
+            **cabeceras,
+            "Content-Length": str(fin - inicio + 1),
+            "Content-Range": f"bytes {inicio}-{fin}/{tamano}",
+        }
+    )
+
+
+@router.get("/backups", summary="Listar backups del sistema")
+async def listar_backups(
+    skip: int = 0,
+    limit: int = 50,
+    current_user: dict = Depends(check_permission("sistema_backup")),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Lista los backups registrados, indicando si su archivo está disponible
+    para descargar.
+    """
+    result = await session.execute(
+        select(BackupSistema)
+        .where(BackupSistema.tipo != "retencion")
+        .order_by(desc(BackupSistema.fecha_inicio))
+        .offset(skip)
+        .limit(limit)
+    )
+    backups = []
+    for b in result.scalars().all():
+        detalles = b.detalles or {}
+        backups.append({
+            "id": b.id,
+            "nombre": b.nombre,
+            "tipo": b.tipo,
+            "estado": b.estado,
+            "tamano_bytes": b.tamano_bytes,
+            "fecha_inicio": b.fecha_inicio,
+            "fecha_fin": b.fecha_fin,
+            "formato": detalles.get("formato"),
+            "compresion": detalles.get("compresion"),
+            "base_id": detalles.get("base_id"),
+            "disponible": b.estado == "completado" and os.path.exists(ruta_artefacto(b)),
+            "regenerable": b.estado == "completado" and bool(detalles.get("manifiesto")),
+        })
+    return backups
+
+
+@router.api_route("/backups/{backup_id}/descargar", methods=["GET", "HEAD"], summary="Descargar un backup")
+async def descargar_backup(
+    backup_id: int,
+    request: Request,
+    current_user: dict = Depends(check_permission("sistema_backup")),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Descarga el archivo de un backup completado. Admite Range e If-Range
+    para reanudar descargas interrumpidas. Si el archivo ya no está en disco
+    se regenera desde el repositorio deduplicado.
+    """
+    registro = await session.get(BackupSistema, backup_id)
+    if not registro or registro.tipo == "retencion":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Backup no encontrado")
+    if registro.estado != "completado":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"El backup está en estado '{registro.estado}'"
+        )
+
+    ruta = ruta_artefacto(registro)
+    if os.path.exists(ruta):
+        # Marca de uso para la caché de BACKUP_DIR (se conservan los usados más recientemente)
+        os.utime(ruta)
+    else:
+        await regenerar_artefacto(session, registro)
+
+    return respuesta_archivo_backup(request, registro)
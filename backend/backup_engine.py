@@ -0,0 +1,506 @@
+# backup_engine.py
+# Motor de backups: volcado consistente y en paralelo de los esquemas del sistema
+
+import os
+import json
+import asyncio
+from datetime import datetime, date
+from typing import List, Tuple, Dict, Any, Optional, AsyncIterator
+
+from sqlalchemy import text, select, Table, MetaData
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+from dotenv import load_dotenv
+
+from backup_throttle import control_backup
+
+load_dotenv()
+
+# Esquemas incluidos en el backup completo
+ESQUEMAS_BACKUP = ("public", "sistema")
+
+# Número de conexiones paralelas (0 = automático según CPUs y tamaño del pool)
+BACKUP_WORKERS = int(os.getenv("BACKUP_WORKERS", "0"))
+
+# Tabla donde los triggers registran las filas eliminadas
+TABLA_ELIMINACIONES = "sistema.registros_eliminados"
+
+# Formatos de volcado: json convierte cada celda en Python (compatibilidad);
+# csv y binary usan COPY ... TO STDOUT y la conversión la hace PostgreSQL
+FORMATOS_BACKUP = {
+    "json": "json",
+    "csv": "csv",
+    "binary": "bin",
+}
+
+# Tipos de backup soportados
+TIPOS_BACKUP = ("completo", "incremental", "diferencial")
+
+# Tablas exportables con el backup por tabla ("esquema.tabla" separadas por comas,
+# * = todas). Por defecto, las que ya permitía el backup por tabla original.
+TABLAS_EXPORTABLES_DEFECTO = (
+    "sistema.usuarios,sistema.logs_auditoria,sistema.parametros_sistema,sistema.roles,sistema.permisos"
+)
+BACKUP_TABLAS_EXPORTABLES = os.getenv("BACKUP_TABLAS_EXPORTABLES") or TABLAS_EXPORTABLES_DEFECTO
+
+# Columnas que el backup por tabla nunca exporta (contraseñas y tokens)
+COLUMNAS_SENSIBLES = {
+    "sistema.usuarios": ("hashed_password",),
+    "sistema.sesiones_usuarios": ("token",),
+    "sistema.password_resets": ("token",),
+    "sistema.configuracion_email": ("password",),
+    "sistema.email_outbox": ("cuerpo",),
+}
+
+# Columnas que ningún backup (completo, incremental ni diferencial, en ningún
+# formato) guarda: se vuelcan con la expresión indicada para que la columna
+# siga existiendo y cumpla su NOT NULL al restaurar. El cuerpo de los emails
+# puede llevar contraseñas temporales o tokens.
+COLUMNAS_VACIADAS_BACKUP = {
+    "sistema.email_outbox": {"cuerpo": "''"},
+}
+
+# Bytes del COPY que se acumulan antes de escribirlos al archivo (en un hilo)
+BACKUP_BUFFER_ESCRITURA = int(os.getenv("BACKUP_BUFFER_ESCRITURA", str(1024 * 1024)))
+
+# Filas que trae cada lote del cursor de servidor en el backup por tabla
+BACKUP_LOTE_EXPORTACION = int(os.getenv("BACKUP_LOTE_EXPORTACION", "5000"))
+
+
+async def listar_tablas(conn: AsyncConnection) -> List[Tuple[str, str]]:
+    """Obtiene todas las tablas base de los esquemas respaldados"""
+    result = await conn.execute(
+        text("""
+            SELECT table_schema, table_name
+            FROM information_schema.tables
+            WHERE table_schema = ANY(:esquemas)
+            AND table_type = 'BASE TABLE'
+            ORDER BY table_schema, table_name
+        """),
+        {"esquemas": list(ESQUEMAS_BACKUP)}
+    )
+    return [(schema, tabla) for schema, tabla in result.fetchall()]
+
+
+async def claves_primarias(conn: AsyncConnection) -> Dict[str, List[str]]:
+    """Obtiene las columnas de la clave primaria de cada tabla respaldada"""
+    result = await conn.execute(
+        text("""
+            SELECT n.nspname, c.relname, array_agg(a.attname::text ORDER BY a.attnum)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = ANY(i.indkey)
+            WHERE i.indisprimary AND n.nspname = ANY(:esquemas)
+            GROUP BY n.nspname, c.relname
+        """),
+        {"esquemas": list(ESQUEMAS_BACKUP)}
+    )
+    return {f"{schema}.{tabla}": list(columnas) for schema, tabla, columnas in result.fetchall()}
+
+
+async def columnas_tablas(conn: AsyncConnection) -> Dict[str, List[str]]:
+    """Obtiene las columnas de cada tabla en orden, necesarias para cargar volcados COPY"""
+    result = await conn.execute(
+        text("""
+            SELECT table_schema, table_name, array_agg(column_name::text ORDER BY ordinal_position)
+            FROM information_schema.columns
+            WHERE table_schema = ANY(:esquemas)
+            GROUP BY table_schema, table_name
+        """),
+        {"esquemas": list(ESQUEMAS_BACKUP)}
+    )
+    return {f"{schema}.{tabla}": list(columnas) for schema, tabla, columnas in result.fetchall()}
+
+
+async def instalar_seguimiento_eliminaciones(conn: AsyncConnection) -> int:
+    """
+    Crea los triggers que registran en sistema.registros_eliminados la clave
+    primaria de cada fila eliminada (y cada TRUNCATE), para que los backups
+    incrementales puedan propagar los borrados. Es idempotente.
+
+    Returns:
+        int: número de tablas con seguimiento instalado
+    """
+    await conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION sistema.registrar_eliminacion() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                INSERT INTO {TABLA_ELIMINACIONES} (esquema, tabla, clave, txid, fecha)
+                VALUES (TG_TABLE_SCHEMA, TG_TABLE_NAME, NULL, txid_current(), now());
+                RETURN NULL;
+            END IF;
+            INSERT INTO {TABLA_ELIMINACIONES} (esquema, tabla, clave, txid, fecha)
+            SELECT TG_TABLE_SCHEMA, TG_TABLE_NAME, jsonb_object_agg(key, value)::json, txid_current(), now()
+            FROM jsonb_each(to_jsonb(OLD))
+            WHERE key = ANY(TG_ARGV);
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+
+    instaladas = 0
+    for nombre, columnas in (await claves_primarias(conn)).items():
+        if nombre == TABLA_ELIMINACIONES:
+            continue
+        schema, tabla = nombre.split(".", 1)
+        argumentos = ", ".join(f"'{columna}'" for columna in columnas)
+        await conn.execute(text(f'DROP TRIGGER IF EXISTS trg_backup_eliminacion ON "{schema}"."{tabla}"'))
+        await conn.execute(text(f'DROP TRIGGER IF EXISTS trg_backup_truncate ON "{schema}"."{tabla}"'))
+        await conn.execute(text(
+            f'CREATE TRIGGER trg_backup_eliminacion AFTER DELETE ON "{schema}"."{tabla}" '
+            f'FOR EACH ROW EXECUTE FUNCTION sistema.registrar_eliminacion({argumentos})'
+        ))
+        await conn.execute(text(
+            f'CREATE TRIGGER trg_backup_truncate AFTER TRUNCATE ON "{schema}"."{tabla}" '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION sistema.registrar_eliminacion()'
+        ))
+        instaladas += 1
+    return instaladas
+
+
+def _filtro_cambios(nombre: str, base: Optional[Dict[str, Any]]) -> str:
+    """
+    Construye el WHERE que selecciona solo las filas insertadas o modificadas
+    desde el backup base. Sin base se exporta la tabla completa.
+
+    Los valores son enteros propios del registro del backup, por lo que se
+    incluyen como literales: COPY no admite parámetros.
+    """
+    if not base:
+        return ""
+    # Filas cuyo xmin es igual o más reciente que el xmin del snapshot base.
+    # Comparar edades con age() es seguro frente al wraparound de los xid de 32 bits.
+    # También en las tablas de solo inserción: un id tomado antes del snapshot
+    # base por una transacción confirmada después queda por debajo del máximo
+    # id de la base, y solo el xmin lo detecta.
+    return f" WHERE age(xmin) <= age(({int(base['xmin'])} % 4294967296)::text::xid)"
+
+
+def _serializar_valor(value: Any) -> Any:
+    """Convierte un valor de la base de datos a un tipo serializable en JSON"""
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if not isinstance(value, (int, float, bool, str, list, dict)):
+        return str(value)
+    return value
+
+
+def _escribir_json(path: str, keys: List[str], rows: List[Any]) -> int:
+    """Convierte las filas a diccionarios y las guarda en un archivo JSON"""
+    data = [
+        {column: _serializar_valor(row[i]) for i, column in enumerate(keys)}
+        for row in rows
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    return len(data)
+
+
+def _resolver_workers(engine: AsyncEngine, total_tablas: int, workers: Optional[int]) -> int:
+    """Calcula cuántas conexiones paralelas usar sin agotar el pool"""
+    if not workers:
+        workers = BACKUP_WORKERS or (os.cpu_count() or 1)
+        pool = engine.sync_engine.pool
+        if hasattr(pool, "size"):
+            # Reservar una conexión para el exportador del snapshot
+            capacidad = pool.size() + max(getattr(pool, "_max_overflow", 0), 0) - 1
+            workers = min(workers, max(capacidad, 1))
+    # No tiene sentido abrir más workers que conexiones permite el limitador
+    limite = control_backup.limite_conexiones()
+    if limite:
+        workers = min(workers, limite)
+    return max(1, min(workers, total_tablas))
+
+
+async def _abrir_transaccion_snapshot(conn: AsyncConnection) -> AsyncConnection:
+    """Configura la conexión para leer en una transacción REPEATABLE READ de solo lectura"""
+    return await conn.execution_options(
+        isolation_level="REPEATABLE READ",
+        postgresql_readonly=True
+    )
+
+
+async def _copiar_tabla(conn: AsyncConnection, query: str, path: str, formato: str) -> int:
+    """
+    Vuelca el resultado de la consulta con COPY ... TO STDOUT, escribiendo los
+    bloques que envía PostgreSQL al archivo sin decodificar filas. Los bloques
+    se acumulan hasta BACKUP_BUFFER_ESCRITURA y se escriben en un hilo para
+    que un disco lento no bloquee el event loop.
+    """
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+
+    f = await asyncio.to_thread(open, path, 'wb')
+    try:
+        pendientes: List[bytes] = []
+        acumulado = 0
+
+        async def vaciar():
+            nonlocal pendientes, acumulado
+            if pendientes:
+                datos, pendientes, acumulado = b"".join(pendientes), [], 0
+                await asyncio.to_thread(f.write, datos)
+
+        async def escribir(bloque: bytes):
+            nonlocal acumulado
+            pendientes.append(bloque)
+            acumulado += len(bloque)
+            if acumulado >= BACKUP_BUFFER_ESCRITURA:
+                await vaciar()
+            # Esperar aquí frena la lectura del COPY y, por TCP, al servidor
+            await control_backup.consumir_bytes(len(bloque))
+            if formato == "csv":
+                await control_backup.consumir_filas(bloque.count(b"\n"))
+
+        estado = await driver.copy_from_query(
+            query,
+            output=escribir,
+            format=formato,
+            header=(formato == "csv")
+        )
+        await vaciar()
+    finally:
+        await asyncio.to_thread(f.close)
+    # asyncpg devuelve la etiqueta del comando, p. ej. "COPY 1500"
+    return int(estado.split()[-1])
+
+
+def _lista_columnas(nombre: str, columnas: Optional[List[str]]) -> str:
+    """Columnas del SELECT del volcado, con las de COLUMNAS_VACIADAS_BACKUP reemplazadas"""
+    vaciadas = COLUMNAS_VACIADAS_BACKUP.get(nombre)
+    if not vaciadas:
+        return "*"
+    if not columnas:
+        raise ValueError(f"No se conocen las columnas de {nombre}")
+    return ", ".join(f'{vaciadas[c]} AS "{c}"' if c in vaciadas else f'"{c}"' for c in columnas)
+
+
+async def _volcar_tabla(
+    conn: AsyncConnection,
+    schema: str,
+    tabla: str,
+    dest_dir: str,
+    base: Optional[Dict[str, Any]] = None,
+    formato: str = "json",
+    columnas: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Vuelca una tabla (o sus cambios desde la base) en el formato indicado"""
+    lista = _lista_columnas(f"{schema}.{tabla}", columnas)
+    query = f'SELECT {lista} FROM "{schema}"."{tabla}"{_filtro_cambios(f"{schema}.{tabla}", base)}'
+    filename = f"{schema}_{tabla}.{FORMATOS_BACKUP[formato]}"
+    path = os.path.join(dest_dir, filename)
+
+    if formato == "json":
+        # Lectura por lotes con cursor de servidor para poder limitar el ritmo
+        result = await conn.stream(text(query).execution_options(yield_per=BACKUP_LOTE_EXPORTACION))
+        keys = list(result.keys())
+        rows = []
+        async for filas in result.partitions():
+            await control_backup.consumir_filas(len(filas))
+            rows.extend(filas)
+        # La conversión y escritura se hacen fuera del event loop
+        total = await asyncio.to_thread(_escribir_json, path, keys, rows)
+        await control_backup.consumir_bytes(os.path.getsize(path))
+    else:
+        total = await _copiar_tabla(conn, query, path, formato)
+
+    return {"archivo": filename, "registros": total, "bytes": os.path.getsize(path)}
+
+
+async def _worker(
+    engine: AsyncEngine,
+    snapshot_id: str,
+    cola: "asyncio.Queue[Tuple[str, str]]",
+    dest_dir: str,
+    resultados: Dict[str, Any],
+    errores: Dict[str, str],
+    base: Optional[Dict[str, Any]] = None,
+    formato: str = "json",
+    columnas: Optional[Dict[str, List[str]]] = None
+):
+    """Toma tablas de la cola y las vuelca usando el snapshot exportado"""
+    async with control_backup.conexion(), engine.connect() as conn:
+        conn = await _abrir_transaccion_snapshot(conn)
+        # Debe ser la primera sentencia de la transacción
+        await conn.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'"))
+
+        while True:
+            try:
+                schema, tabla = cola.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+            nombre = f"{schema}.{tabla}"
+            try:
+                # Un savepoint por tabla para que un error no aborte la transacción
+                async with conn.begin_nested():
+                    resultados[nombre] = await _volcar_tabla(
+                        conn, schema, tabla, dest_dir, base, formato, (columnas or {}).get(nombre)
+                    )
+                print(f"✅ Tabla {nombre} procesada: {resultados[nombre]['registros']} registros")
+            except Exception as e:
+                print(f"❌ Error procesando tabla {nombre}: {e}")
+                errores[nombre] = str(e)
+
+        await conn.rollback()
+
+
+async def _exportar_eliminaciones(conn: AsyncConnection, dest_dir: str, base: Dict[str, Any]) -> int:
+    """Guarda en eliminaciones.json las filas borradas desde el snapshot base"""
+    result = await conn.execute(
+        text(f"""
+            SELECT esquema, tabla, clave, txid FROM {TABLA_ELIMINACIONES}
+            WHERE txid >= :xmin_base ORDER BY id
+        """),
+        {"xmin_base": base["xmin"]}
+    )
+    eliminaciones = [dict(row._mapping) for row in result.fetchall()]
+    await asyncio.to_thread(
+        _escribir_json,
+        os.path.join(dest_dir, "eliminaciones.json"),
+        ["esquema", "tabla", "clave", "txid"],
+        [(e["esquema"], e["tabla"], e["clave"], e["txid"]) for e in eliminaciones]
+    )
+    return len(eliminaciones)
+
+
+async def backup_consistente(
+    engine: AsyncEngine,
+    dest_dir: str,
+    workers: Optional[int] = None,
+    base: Optional[Dict[str, Any]] = None,
+    formato: str = "json"
+) -> Dict[str, Any]:
+    """
+    Vuelca todas las tablas de los esquemas respaldados en paralelo.
+
+    Una conexión exporta un snapshot de PostgreSQL (pg_export_snapshot) y lo
+    mantiene abierto mientras N conexiones del pool lo importan, de modo que
+    todas las tablas reflejan el mismo instante aunque se lean en paralelo.
+
+    Si se indica `base` (detalles de un backup anterior con su "xmin"), solo se exportan las filas insertadas o modificadas desde
+    entonces, junto con las eliminaciones registradas por los triggers.
+
+    `formato` elige la codificación de cada tabla (ver FORMATOS_BACKUP).
+
+    El ritmo de lectura (filas/s, bytes/s) y las conexiones de los workers
+    los limita `control_backup` según la latencia del tráfico interactivo.
+
+    Returns:
+        dict: snapshot usado, xmin para encadenar el próximo backup,
+        tablas procesadas (en orden) y errores por tabla
+    """
+    if formato not in FORMATOS_BACKUP:
+        raise ValueError(f"Formato de backup no soportado: {formato}")
+
+    async with engine.connect() as exportador:
+        exportador = await _abrir_transaccion_snapshot(exportador)
+        snapshot_id = (await exportador.execute(text("SELECT pg_export_snapshot()"))).scalar_one()
+        xmin = (await exportador.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())"))).scalar_one()
+        tablas = await listar_tablas(exportador)
+        claves = await claves_primarias(exportador)
+        columnas = await columnas_tablas(exportador)
+
+        eliminaciones = 0
+        if base and TABLA_ELIMINACIONES in [f"{s}.{t}" for s, t in tablas]:
+            eliminaciones = await _exportar_eliminaciones(exportador, dest_dir, base)
+            # Las eliminaciones ya viajan en eliminaciones.json
+            tablas = [(s, t) for s, t in tablas if f"{s}.{t}" != TABLA_ELIMINACIONES]
+
+        total_workers = _resolver_workers(engine, len(tablas), workers)
+        print(f"Snapshot {snapshot_id}: {len(tablas)} tablas con {total_workers} conexiones")
+
+        cola: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue()
+        for tabla in tablas:
+            cola.put_nowait(tabla)
+
+        resultados: Dict[str, Any] = {}
+        errores: Dict[str, str] = {}
+        await asyncio.gather(*[
+            _worker(engine, snapshot_id, cola, dest_dir, resultados, errores, base, formato, columnas)
+            for _ in range(total_workers)
+        ])
+
+        # El snapshot deja de ser válido al cerrar la transacción exportadora
+        await exportador.rollback()
+
+    procesadas = [f"{s}.{t}" for s, t in tablas if f"{s}.{t}" in resultados]
+    return {
+        "snapshot": snapshot_id,
+        "xmin": int(xmin),
+        "claves": {nombre: claves[nombre] for nombre in procesadas if nombre in claves},
+        "columnas": {nombre: columnas[nombre] for nombre in procesadas if nombre in columnas},
+        "formato": formato,
+        "eliminaciones": eliminaciones,
+        "workers": total_workers,
+        "tablas": procesadas,
+        "detalle": {nombre: resultados[nombre] for nombre in procesadas},
+        "errores": errores,
+    }
+
+
+async def reflejar_tabla_exportable(conn: AsyncConnection, nombre: str) -> Table:
+    """
+    Refleja una tabla permitida para el backup por tabla. Acepta 'esquema.tabla'
+    o solo el nombre si no es ambiguo entre los esquemas respaldados.
+
+    Raises:
+        ValueError: si la tabla no existe, no está permitida o el nombre es ambiguo
+    """
+    permitidas = [f"{schema}.{tabla}" for schema, tabla in await listar_tablas(conn)]
+    if BACKUP_TABLAS_EXPORTABLES.strip() != "*":
+        lista = {t.strip() for t in BACKUP_TABLAS_EXPORTABLES.split(",") if t.strip()}
+        permitidas = [t for t in permitidas if t in lista]
+
+    if "." in nombre:
+        candidatas = [t for t in permitidas if t == nombre]
+    else:
+        candidatas = [t for t in permitidas if t.split(".", 1)[1] == nombre]
+    if not candidatas:
+        raise ValueError(f"Tabla '{nombre}' no permitida para backup")
+    if len(candidatas) > 1:
+        raise ValueError(f"Tabla '{nombre}' ambigua, indique el esquema: {', '.join(candidatas)}")
+
+    schema, tabla = candidatas[0].split(".", 1)
+    return await conn.run_sync(
+        lambda sync_conn: Table(tabla, MetaData(), schema=schema, autoload_with=sync_conn)
+    )
+
+
+async def exportar_tabla_ndjson(
+    engine: AsyncEngine,
+    tabla: Table,
+    resumen: Dict[str, Any],
+    lote: int = BACKUP_LOTE_EXPORTACION
+) -> AsyncIterator[bytes]:
+    """
+    Genera las filas de la tabla como NDJSON (un objeto JSON por línea) leyendo
+    con un cursor de servidor en lotes de `lote` filas, con memoria constante
+    sin importar el tamaño de la tabla. Usa su propia conexión de solo lectura
+    y acumula en `resumen["registros"]` el total de filas enviadas.
+    """
+    excluidas = COLUMNAS_SENSIBLES.get(f"{tabla.schema}.{tabla.name}", ())
+    columnas = [c for c in tabla.columns if c.name not in excluidas]
+    nombres = [c.name for c in columnas]
+    resumen.setdefault("registros", 0)
+    resumen["columnas"] = nombres
+
+    async with control_backup.conexion(), engine.connect() as conn:
+        conn = await _abrir_transaccion_snapshot(conn)
+        result = await conn.stream(select(*columnas).execution_options(yield_per=lote))
+        async for filas in result.partitions():
+            await control_backup.consumir_filas(len(filas))
+            bloque = "".join(
+                json.dumps(
+                    {columna: _serializar_valor(fila[i]) for i, columna in enumerate(nombres)},
+                    ensure_ascii=False,
+                    default=str
+                ) + "\n"
+                for fila in filas
+            )
+            resumen["registros"] += len(filas)
+            datos = bloque.encode("utf-8")
+            await control_backup.consumir_bytes(len(datos))
+            yield datos
@@ -0,0 +1,223 @@
+# backup_repositorio.py
+# Repositorio local de backups con deduplicación por contenido y retención
+
+import os
+import zlib
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Set, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from fastcdc import fastcdc
+
+from models import BackupSistema
+from backup_engine import TIPOS_BACKUP
+from parametros_utils import get_parametro
+
+load_dotenv()
+
+# Directorio del repositorio de fragmentos
+BACKUP_REPO_DIR = os.getenv("BACKUP_REPO_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "backups", "repositorio"
+)
+
+# Horas durante las que un fragmento escrito o reutilizado no se elimina, para
+# no borrar fragmentos de un backup en curso que aún no registró su manifiesto
+BACKUP_GC_GRACIA_HORAS = int(os.getenv("BACKUP_GC_GRACIA_HORAS", "24"))
+
+# Tamaños de los fragmentos: mínimo, medio buscado y máximo (corte forzado)
+TAMANO_MINIMO = 64 * 1024
+TAMANO_MEDIO = 128 * 1024
+TAMANO_MAXIMO = 4 * 1024 * 1024
+
+
+def fragmentar(path: str):
+    """
+    Divide un archivo en fragmentos definidos por su contenido (FastCDC).
+
+    El chunker de `fastcdc` es código nativo (Cython) que recorre el archivo
+    mapeado en memoria con un gear hash y corta donde el hash cumple la
+    máscara, entre TAMANO_MINIMO y TAMANO_MAXIMO. Como las fronteras dependen
+    del contenido y no de la posición, insertar o eliminar filas solo cambia
+    los fragmentos cercanos y el resto se reutiliza entre backups. Sirve igual
+    para archivos de texto y binarios (COPY binary).
+    """
+    # mmap no admite archivos vacíos
+    if os.path.getsize(path) == 0:
+        return
+    for chunk in fastcdc(path, TAMANO_MINIMO, TAMANO_MEDIO, TAMANO_MAXIMO, fat=True):
+        yield chunk.data
+
+
+class RepositorioBackups:
+    def __init__(self, directorio: str = BACKUP_REPO_DIR):
+        self.directorio = directorio
+        self.chunks_dir = os.path.join(directorio, "chunks")
+
+    def _ruta_chunk(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def guardar_archivos(self, origen_dir: str, archivos: List[str]) -> Dict[str, Any]:
+        """
+        Guarda los archivos en el repositorio, escribiendo solo los fragmentos
+        que no existían. Es bloqueante: usar asyncio.to_thread desde código async.
+
+        Returns:
+            dict: manifiesto {"archivos": {nombre: {"tamano", "chunks"}}} y estadísticas
+        """
+        manifiesto = {}
+        bytes_nuevos = bytes_reutilizados = 0
+
+        for nombre in archivos:
+            path = os.path.join(origen_dir, nombre)
+            chunks = []
+            for fragmento in fragmentar(path):
+                digest = hashlib.sha256(fragmento).hexdigest()
+                ruta = self._ruta_chunk(digest)
+                if os.path.exists(ruta):
+                    # Renovar la fecha para protegerlo de la limpieza durante la gracia
+                    os.utime(ruta)
+                    bytes_reutilizados += len(fragmento)
+                else:
+                    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                    temporal = f"{ruta}.{os.getpid()}.tmp"
+                    with open(temporal, 'wb') as f:
+                        f.write(zlib.compress(fragmento, 6))
+                    os.replace(temporal, ruta)
+                    bytes_nuevos += len(fragmento)
+                chunks.append(digest)
+            manifiesto[nombre] = {"tamano": os.path.getsize(path), "chunks": chunks}
+
+        return {
+            "archivos": manifiesto,
+            "bytes_nuevos": bytes_nuevos,
+            "bytes_reutilizados": bytes_reutilizados,
+        }
+
+    def reconstruir_archivos(self, manifiesto: Dict[str, Any], dest_dir: str) -> List[str]:
+        """Reconstruye en dest_dir los archivos de un manifiesto a partir de sus fragmentos"""
+        for nombre, info in manifiesto["archivos"].items():
+            with open(os.path.join(dest_dir, nombre), 'wb') as salida:
+                for digest in info["chunks"]:
+                    with open(self._ruta_chunk(digest), 'rb') as f:
+                        fragmento = zlib.decompress(f.read())
+                    if hashlib.sha256(fragmento).hexdigest() != digest:
+                        raise ValueError(f"Fragmento corrupto en el repositorio: {digest}")
+                    salida.write(fragmento)
+        return list(manifiesto["archivos"])
+
+    def eliminar_no_referenciados(self, referenciados: Set[str]) -> Dict[str, int]:
+        """Elimina los fragmentos que ningún manifiesto retenido referencia"""
+        limite = datetime.now().timestamp() - BACKUP_GC_GRACIA_HORAS * 3600
+        eliminados = bytes_liberados = 0
+        if not os.path.isdir(self.chunks_dir):
+            return {"chunks_eliminados": 0, "bytes_liberados": 0}
+
+        for prefijo in os.listdir(self.chunks_dir):
+            carpeta = os.path.join(self.chunks_dir, prefijo)
+            for digest in os.listdir(carpeta):
+                ruta = os.path.join(carpeta, digest)
+                if digest in referenciados or os.path.getmtime(ruta) > limite:
+                    continue
+                bytes_liberados += os.path.getsize(ruta)
+                os.remove(ruta)
+                eliminados += 1
+        return {"chunks_eliminados": eliminados, "bytes_liberados": bytes_liberados}
+
+    def estadisticas(self) -> Dict[str, int]:
+        """Número de fragmentos y bytes ocupados en disco"""
+        total = tamano = 0
+        if os.path.isdir(self.chunks_dir):
+            for prefijo in os.listdir(self.chunks_dir):
+                carpeta = os.path.join(self.chunks_dir, prefijo)
+                for digest in os.listdir(carpeta):
+                    total += 1
+                    tamano += os.path.getsize(os.path.join(carpeta, digest))
+        return {"chunks": total, "bytes_en_disco": tamano}
+
+
+def _con_bases(retenidos: Dict[int, BackupSistema], todos: Dict[int, BackupSistema]) -> Dict[int, BackupSistema]:
+    """Agrega a los backups retenidos las bases de las que dependen sus cadenas"""
+    pendientes = list(retenidos.values())
+    while pendientes:
+        backup = pendientes.pop()
+        base_id = (backup.detalles or {}).get("base_id")
+        if base_id and base_id in todos and base_id not in retenidos:
+            retenidos[base_id] = todos[base_id]
+            pendientes.append(todos[base_id])
+    return retenidos
+
+
+def _eliminar_archivos(rutas: List[str]) -> int:
+    """Elimina los archivos de backup expirados que sigan en disco"""
+    eliminados = 0
+    for ruta in rutas:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+            eliminados += 1
+    return eliminados
+
+
+async def aplicar_retencion(session: AsyncSession, repositorio: Optional["RepositorioBackups"] = None) -> Dict[str, Any]:
+    """
+    Expira los backups más antiguos que BACKUP_RETENTION_DAYS (salvo los que
+    son base de un backup retenido), elimina sus archivos y los fragmentos no
+    referenciados y depura las eliminaciones registradas que ya ningún backup necesita.
+    """
+    repositorio = repositorio or repositorio_backups
+    dias = await get_parametro(session, "BACKUP_RETENTION_DAYS", 30)
+    limite = datetime.utcnow() - timedelta(days=dias)
+
+    result = await session.execute(
+        select(BackupSistema).where(
+            BackupSistema.estado == "completado",
+            BackupSistema.tipo.in_(TIPOS_BACKUP)
+        )
+    )
+    todos = {b.id: b for b in result.scalars().all()}
+    retenidos = _con_bases(
+        {i: b for i, b in todos.items() if b.fecha_inicio and b.fecha_inicio >= limite},
+        todos
+    )
+
+    expirados = [b for i, b in todos.items() if i not in retenidos]
+    for backup in expirados:
+        detalles = dict(backup.detalles or {})
+        detalles.pop("manifiesto", None)
+        backup.detalles = detalles
+        backup.estado = "expirado"
+
+    referenciados: Set[str] = set()
+    for backup in retenidos.values():
+        for info in ((backup.detalles or {}).get("manifiesto") or {}).get("archivos", {}).values():
+            referenciados.update(info["chunks"])
+
+    # Las eliminaciones anteriores al backup retenido más antiguo ya no se usan
+    xmins = [b.detalles["xmin"] for b in retenidos.values() if (b.detalles or {}).get("xmin")]
+    eliminaciones_depuradas = 0
+    if xmins:
+        result = await session.execute(
+            text("DELETE FROM sistema.registros_eliminados WHERE txid < :xmin"),
+            {"xmin": min(xmins)}
+        )
+        eliminaciones_depuradas = result.rowcount
+
+    await session.commit()
+
+    limpieza = await asyncio.to_thread(repositorio.eliminar_no_referenciados, referenciados)
+    rutas = [b.ruta_archivo for b in expirados if b.ruta_archivo and os.path.isabs(b.ruta_archivo)]
+    limpieza["archivos_eliminados"] = await asyncio.to_thread(_eliminar_archivos, rutas)
+    return {
+        "dias_retencion": dias,
+        "backups_expirados": [b.id for b in expirados],
+        "backups_retenidos": len(retenidos),
+        "eliminaciones_depuradas": eliminaciones_depuradas,
+        **limpieza,
+    }
+
+
+# Instancia global del repositorio de backups
+repositorio_backups = RepositorioBackups()
@@ -0,0 +1,319 @@
+# backup_service.py
+# Orquestación de backups: cadena de bases, registro en BackupSistema y archivo comprimido
+
+import os
+import json
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, desc, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import BackupSistema
+from database import engine, motor_lectura
+from backup_engine import backup_consistente, FORMATOS_BACKUP, TIPOS_BACKUP
+from backup_compresion import resolver_compresion, crear_archivo
+from backup_repositorio import repositorio_backups
+
+load_dotenv()
+
+# Directorio donde se guardan los archivos de backup completados
+BACKUP_DIR = os.getenv("BACKUP_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "backups", "archivos"
+)
+
+# Archivos comprimidos que se conservan en BACKUP_DIR. Es una caché: los
+# backups guardados en el repositorio se regeneran al descargarlos, así que
+# solo se conservan los N usados más recientemente (nunca menos de uno)
+BACKUP_CACHE_ARCHIVOS = int(os.getenv("BACKUP_CACHE_ARCHIVOS", "3"))
+
+# Leer los datos del backup desde una réplica si hay alguna configurada
+BACKUP_DESDE_REPLICA = os.getenv("BACKUP_DESDE_REPLICA", "true").lower() == "true"
+
+
+async def obtener_backup_base(session: AsyncSession, tipo: str) -> Optional[BackupSistema]:
+    """
+    Obtiene el backup sobre el que se encadena uno nuevo:
+    - incremental: el último backup completado de cualquier tipo
+    - diferencial: el último backup completo completado
+    """
+    if tipo == "completo":
+        return None
+
+    query = select(BackupSistema).where(
+        BackupSistema.estado == "completado",
+        BackupSistema.tipo.in_(TIPOS_BACKUP)
+    )
+    if tipo == "diferencial":
+        query = query.where(BackupSistema.tipo == "completo")
+
+    result = await session.execute(query.order_by(desc(BackupSistema.fecha_inicio)).limit(1))
+    return result.scalar_one_or_none()
+
+
+def _archivos_backup(origen_dir: str):
+    """Volcados y metadatos que forman parte del archivo de backup"""
+    extensiones = tuple(f".{ext}" for ext in FORMATOS_BACKUP.values())
+    return [nombre for nombre in os.listdir(origen_dir) if nombre.endswith(extensiones)]
+
+
+def ruta_artefacto(registro: BackupSistema) -> str:
+    """Ruta en disco del archivo de un backup (los registros antiguos guardaban solo el nombre)"""
+    if os.path.isabs(registro.ruta_archivo):
+        return registro.ruta_archivo
+    return os.path.join(BACKUP_DIR, registro.ruta_archivo)
+
+
+def _hash_archivo(path: str) -> str:
+    """SHA-256 del archivo, usado como ETag de las descargas"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def _guardar_artefacto(
+    origen_dir: str, destino: str, codec: str, nivel: Optional[int]
+) -> Tuple[int, str]:
+    """
+    Comprime los volcados directamente en BACKUP_DIR mediante un archivo
+    temporal, de modo que nunca se sirva un archivo a medio escribir.
+
+    Returns:
+        tuple: (tamaño en bytes, sha256)
+    """
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = f"{destino}.tmp"
+    try:
+        tamano = crear_archivo(origen_dir, _archivos_backup(origen_dir), temporal, codec, nivel)
+        sha256 = _hash_archivo(temporal)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return tamano, sha256
+
+
+def _eliminar_menos_recientes(rutas, conservar: int) -> int:
+    """Elimina los archivos salvo los `conservar` modificados o usados más recientemente"""
+    existentes = []
+    for ruta in rutas:
+        try:
+            existentes.append((os.path.getmtime(ruta), ruta))
+        except OSError:
+            continue
+    existentes.sort(reverse=True)
+    eliminados = 0
+    for _, ruta in existentes[max(1, conservar):]:
+        try:
+            os.remove(ruta)
+            eliminados += 1
+        except OSError:
+            pass
+    return eliminados
+
+
+async def podar_cache_artefactos(session: AsyncSession, conservar: int = BACKUP_CACHE_ARCHIVOS) -> int:
+    """
+    Limita BACKUP_DIR a los `conservar` archivos usados más recientemente.
+    Solo se eliminan archivos de backups con manifiesto en el repositorio,
+    que pueden regenerarse con regenerar_artefacto.
+    """
+    result = await session.execute(
+        select(BackupSistema.ruta_archivo).where(
+            BackupSistema.estado == "completado",
+            BackupSistema.tipo.in_(TIPOS_BACKUP),
+            func.json_typeof(BackupSistema.detalles["manifiesto"]) == "object"
+        )
+    )
+    rutas = [ruta_artefacto(BackupSistema(ruta_archivo=ruta)) for ruta in result.scalars().all()]
+    eliminados = await asyncio.to_thread(_eliminar_menos_recientes, rutas, conservar)
+    if eliminados:
+        print(f"Caché de backups: {eliminados} archivos eliminados (se regeneran al descargarlos)")
+    return eliminados
+
+
+async def regenerar_artefacto(session: AsyncSession, registro: BackupSistema) -> str:
+    """
+    Vuelve a generar el archivo de un backup completado a partir de su
+    manifiesto en el repositorio deduplicado, sin volcar la base de datos.
+    El contenido es el mismo pero el archivo comprimido cambia, así que se
+    actualizan el tamaño y el sha256.
+
+    Raises:
+        HTTPException: 404 si el backup no tiene manifiesto en el repositorio
+    """
+    detalles = registro.detalles or {}
+    if registro.estado != "completado" or not detalles.get("manifiesto"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="El archivo del backup no está disponible y no puede regenerarse"
+        )
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        destino = ruta_artefacto(registro)
+        await asyncio.to_thread(repositorio_backups.reconstruir_archivos, detalles["manifiesto"], temp_dir)
+        tamano, sha256 = await asyncio.to_thread(
+            _guardar_artefacto, temp_dir, destino, detalles["compresion"], detalles.get("nivel_compresion")
+        )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    registro.ruta_archivo = destino
+    registro.tamano_bytes = tamano
+    registro.detalles = {**detalles, "sha256": sha256}
+    await session.commit()
+    print(f"✅ Archivo del backup {registro.id} regenerado desde el repositorio")
+    await podar_cache_artefactos(session)
+    return destino
+
+
+async def ejecutar_backup(
+    session: AsyncSession,
+    username: str,
+    user_id: Optional[int],
+    dest_dir: str,
+    tipo: str = "completo",
+    formato: str = "json",
+    compresion: Optional[str] = None,
+    nivel: Optional[int] = None,
+    detalles_extra: Optional[Dict[str, Any]] = None
+) -> Tuple[BackupSistema, str, Dict[str, Any]]:
+    """
+    Ejecuta un backup del tipo, formato y compresión indicados usando
+    `dest_dir` como directorio de trabajo, guarda el archivo en BACKUP_DIR
+    (caché de los últimos BACKUP_CACHE_ARCHIVOS) y lo registra en
+    sistema.backups_sistema. `detalles_extra` se
+    agrega a los detalles del registro (p. ej. la tarea programada que lo lanzó).
+
+    Returns:
+        tuple: (registro BackupSistema, ruta del archivo, metadatos del backup)
+    """
+    if tipo not in TIPOS_BACKUP:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Tipo de backup '{tipo}' no válido. Opciones: {', '.join(TIPOS_BACKUP)}"
+        )
+    if formato not in FORMATOS_BACKUP:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Formato de backup '{formato}' no válido. Opciones: {', '.join(FORMATOS_BACKUP)}"
+        )
+    try:
+        compresion_info = resolver_compresion(compresion, nivel)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    base = await obtener_backup_base(session, tipo)
+    # Tras un rollback la sesión expira `base`; leer base.id dispararía una carga perezosa
+    base_id = base.id if base else None
+    base_detalles = base.detalles if base else None
+    if tipo != "completo" and (not base or not (base_detalles or {}).get("xmin")):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"No existe un backup base para el backup {tipo}. Realice primero un backup completo"
+        )
+
+    fecha = datetime.now()
+    filename = f"backup_{tipo}_{fecha.strftime('%Y%m%d_%H%M%S')}.{compresion_info['extension']}"
+    registro = BackupSistema(
+        nombre=filename,
+        descripcion=f"Backup {tipo} de esquemas public y sistema",
+        ruta_archivo=os.path.join(BACKUP_DIR, filename),
+        tipo=tipo,
+        estado="en_proceso",
+        fecha_inicio=datetime.utcnow(),
+        creado_por=user_id,
+        detalles={"base_id": base_id, **(detalles_extra or {})}
+    )
+    session.add(registro)
+    await session.commit()
+
+    try:
+        # El volcado puede leerse de una réplica: el registro se sigue escribiendo en el primario
+        motor = await motor_lectura() if BACKUP_DESDE_REPLICA else engine
+        resultado = await backup_consistente(
+            motor, dest_dir, base=base_detalles, formato=formato
+        )
+
+        metadata = {
+            "fecha_backup": datetime.utcnow().isoformat(),
+            "usuario_backup": username,
+            "sistema": "Sistema de Gestión de Información",
+            "version": "1.0.0",
+            "tipo": tipo,
+            "formato": formato,
+            "compresion": {"codec": compresion_info["codec"], "nivel": compresion_info["nivel"]},
+            "backup_id": registro.id,
+            "base_id": base_id,
+            "tablas_incluidas": resultado["tablas"],
+            "total_tablas": len(resultado["tablas"]),
+            "claves_primarias": resultado["claves"],
+            "columnas": resultado["columnas"],
+            "archivos": resultado["detalle"],
+            "eliminaciones": resultado["eliminaciones"],
+            "snapshot": resultado["snapshot"],
+            "tablas_con_error": resultado["errores"],
+            "notas": f"Backup {tipo} de esquemas public y sistema"
+        }
+        with open(os.path.join(dest_dir, "metadata.json"), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+
+        # La compresión se ejecuta en un hilo para no bloquear el event loop
+        archivo_path = registro.ruta_archivo
+        tamano, sha256 = await asyncio.to_thread(
+            _guardar_artefacto,
+            dest_dir,
+            archivo_path,
+            compresion_info["codec"],
+            compresion_info["nivel"]
+        )
+
+        # Copia deduplicada en el repositorio local: solo se escriben los fragmentos nuevos
+        manifiesto = await asyncio.to_thread(
+            repositorio_backups.guardar_archivos, dest_dir, _archivos_backup(dest_dir)
+        )
+
+        registro.estado = "completado"
+        registro.fecha_fin = datetime.utcnow()
+        registro.tamano_bytes = tamano
+        registro.detalles = {
+            **(detalles_extra or {}),
+            "base_id": base_id,
+            "snapshot": resultado["snapshot"],
+            "origen": "primario" if motor is engine else "replica",
+            "formato": formato,
+            "compresion": compresion_info["codec"],
+            "nivel_compresion": compresion_info["nivel"],
+            "media_type": compresion_info["media_type"],
+            "sha256": sha256,
+            "xmin": resultado["xmin"],
+            "tablas": {nombre: d["registros"] for nombre, d in resultado["detalle"].items()},
+            "eliminaciones": resultado["eliminaciones"],
+            "errores": resultado["errores"],
+            "manifiesto": {"archivos": manifiesto["archivos"]},
+            "repositorio": {
+                "bytes_nuevos": manifiesto["bytes_nuevos"],
+                "bytes_reutilizados": manifiesto["bytes_reutilizados"],
+            },
+        }
+        await session.commit()
+        await podar_cache_artefactos(session)
+        return registro, archivo_path, metadata
+
+    except Exception as e:
+        await session.rollback()
+        registro.estado = "fallido"
+        registro.fecha_fin = datetime.utcnow()
+        registro.detalles = {**(detalles_extra or {}), "base_id": base_id, "error": str(e)}
+        session.add(registro)
+        await session.commit()
+        raise
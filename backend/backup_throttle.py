@@ -0,0 +1,170 @@
+# backup_throttle.py
+# Limitación de recursos de los backups para proteger el tráfico interactivo
+
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+from dotenv import load_dotenv
+
+from database import DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+load_dotenv()
+
+# Límites base de ritmo (0 = sin límite, el valor por defecto: son opcionales
+# porque dependen del hardware; sin límite no hay adaptación para ese recurso)
+BACKUP_MAX_FILAS_S = int(os.getenv("BACKUP_MAX_FILAS_S", "0"))
+BACKUP_MAX_BYTES_S = int(os.getenv("BACKUP_MAX_BYTES_S", "0"))
+
+# Conexiones simultáneas que pueden usar todos los backups juntos, reducidas
+# por el factor AIMD (0 = sin límite; vacío = la mitad del pool)
+BACKUP_MAX_CONEXIONES = int(os.getenv("BACKUP_MAX_CONEXIONES") or max(1, (DB_POOL_SIZE + DB_MAX_OVERFLOW) // 2))
+
+# p95 objetivo de las peticiones interactivas y ventana en que se mide
+BACKUP_LATENCIA_OBJETIVO_MS = float(os.getenv("BACKUP_LATENCIA_OBJETIVO_MS", "300"))
+BACKUP_LATENCIA_VENTANA_S = float(os.getenv("BACKUP_LATENCIA_VENTANA_S", "30"))
+
+# Factor mínimo al que puede bajar el ritmo del backup y ajuste por revisión
+FACTOR_MINIMO = 0.05
+INCREMENTO_FACTOR = 0.1
+INTERVALO_AJUSTE_S = 1.0
+
+# Muestras mínimas para que el p95 sea representativo
+MUESTRAS_MINIMAS = 20
+
+
+class LimitadorTasa:
+    """
+    Token bucket asíncrono. Permite ráfagas de hasta un segundo de tasa y,
+    si se pide más de lo disponible, espera el tiempo necesario para pagar
+    la deuda, de modo que la tasa media no supera el límite.
+    """
+
+    def __init__(self, tasa: float):
+        self.tasa_base = tasa
+        self.factor = 1.0
+        self._tokens = tasa
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def tasa(self) -> float:
+        return self.tasa_base * self.factor
+
+    async def consumir(self, cantidad: float):
+        if self.tasa_base <= 0 or cantidad <= 0:
+            return
+        async with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.tasa, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._tokens -= cantidad
+            espera = -self._tokens / self.tasa if self._tokens < 0 else 0
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class MonitorLatencia:
+    """Guarda la duración de las peticiones interactivas recientes para calcular su p95"""
+
+    def __init__(self, ventana_s: float = BACKUP_LATENCIA_VENTANA_S, maximo: int = 5000):
+        self.ventana_s = ventana_s
+        self._muestras: "deque[tuple]" = deque(maxlen=maximo)
+
+    def registrar(self, duracion_ms: float):
+        self._muestras.append((time.monotonic(), duracion_ms))
+
+    def p95(self) -> Optional[float]:
+        limite = time.monotonic() - self.ventana_s
+        recientes = sorted(d for t, d in self._muestras if t >= limite)
+        if len(recientes) < MUESTRAS_MINIMAS:
+            return None
+        return recientes[int(len(recientes) * 0.95) - 1]
+
+
+class ControlBackup:
+    """
+    Límites compartidos por todos los backups del proceso: filas/s, bytes/s y
+    conexiones simultáneas. El ritmo y las conexiones de un backup nuevo se
+    adaptan con AIMD según el p95 de las peticiones interactivas: se reducen a
+    la mitad si supera el objetivo y se recuperan de a poco mientras se
+    mantiene por debajo. Sin tráfico interactivo reciente (p. ej. el backup
+    nocturno) no se aplica ningún límite.
+    """
+
+    def __init__(self):
+        self.filas = LimitadorTasa(BACKUP_MAX_FILAS_S)
+        self.bytes = LimitadorTasa(BACKUP_MAX_BYTES_S)
+        self.monitor = MonitorLatencia()
+        self.max_conexiones = max(BACKUP_MAX_CONEXIONES, 0)
+        self._conexiones: Optional[asyncio.Semaphore] = None
+        self._ultimo_ajuste = 0.0
+        self.factor = 1.0
+        self.sin_trafico = True
+
+    def _ajustar(self):
+        ahora = time.monotonic()
+        if ahora - self._ultimo_ajuste < INTERVALO_AJUSTE_S:
+            return
+        self._ultimo_ajuste = ahora
+
+        p95 = self.monitor.p95()
+        self.sin_trafico = p95 is None
+        if p95 is None:
+            self.factor = self.filas.factor = self.bytes.factor = 1.0
+            return
+        if p95 > BACKUP_LATENCIA_OBJETIVO_MS:
+            factor = max(self.factor / 2, FACTOR_MINIMO)
+        else:
+            factor = min(self.factor + INCREMENTO_FACTOR, 1.0)
+        if factor != self.factor:
+            print(f"Backup: p95 interactivo {p95:.0f} ms, ritmo al {factor:.0%}")
+        self.factor = self.filas.factor = self.bytes.factor = factor
+
+    async def consumir_filas(self, cantidad: int):
+        self._ajustar()
+        if not self.sin_trafico:
+            await self.filas.consumir(cantidad)
+
+    async def consumir_bytes(self, cantidad: int):
+        self._ajustar()
+        if not self.sin_trafico:
+            await self.bytes.consumir(cantidad)
+
+    def limite_conexiones(self) -> Optional[int]:
+        """Conexiones máximas para un backup que empieza ahora (None = sin límite)"""
+        self._ajustar()
+        if not self.max_conexiones or self.sin_trafico:
+            return None
+        return max(1, int(self.max_conexiones * self.factor))
+
+    @asynccontextmanager
+    async def conexion(self):
+        """Reserva una de las conexiones permitidas para backups mientras dure el bloque"""
+        if self.limite_conexiones() is None:
+            yield
+            return
+        if self._conexiones is None:
+            # Se crea en el event loop que la usa
+            self._conexiones = asyncio.Semaphore(self.max_conexiones)
+        async with self._conexiones:
+            yield
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "factor": self.factor,
+            "sin_trafico_interactivo": self.sin_trafico,
+            "p95_interactivo_ms": self.monitor.p95(),
+            "latencia_objetivo_ms": BACKUP_LATENCIA_OBJETIVO_MS,
+            "filas_s": self.filas.tasa or None,
+            "bytes_s": self.bytes.tasa or None,
+            "max_conexiones": self.max_conexiones or None,
+            "conexiones_backup_nuevo": self.limite_conexiones(),
+        }
+
+
+# Instancia global compartida por el motor de backups y el middleware de latencia
+control_backup = ControlBackup()
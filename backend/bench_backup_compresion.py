@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_backup_compresion.py [formato]
+"""
+Benchmark de los códecs de compresión del backup sobre los datos reales.
+
+Vuelca las tablas de 'public' y 'sistema' (formato json por defecto) y
+comprime el resultado con cada códec y nivel, mostrando el ratio de
+compresión y el rendimiento en MB/s.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import shutil
+import tempfile
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backup_engine import backup_consistente
+from backup_compresion import codecs_disponibles, crear_archivo
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de la base de datos
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL no está configurada en el archivo .env")
+
+# Niveles a medir por códec
+NIVELES = {
+    "store": [None],
+    "deflate": [1, 6, 9],
+    "xz": [0, 3, 6],
+    "zstd": [1, 3, 9, 19],
+}
+
+
+async def main():
+    formato = sys.argv[1] if len(sys.argv) > 1 else "json"
+    engine = create_async_engine(DATABASE_URL, echo=False)
+    origen_dir = tempfile.mkdtemp()
+    salida_dir = tempfile.mkdtemp()
+
+    try:
+        print(f"Volcando tablas en formato {formato}...")
+        resultado = await backup_consistente(engine, origen_dir, formato=formato)
+        archivos = os.listdir(origen_dir)
+        tamano_original = sum(os.path.getsize(os.path.join(origen_dir, a)) for a in archivos)
+        megabytes = tamano_original / (1024 * 1024)
+        print(f"{len(resultado['tablas'])} tablas, {megabytes:.1f} MB sin comprimir\n")
+
+        print(f"{'Códec':<10}{'Nivel':>7}{'MB':>10}{'Ratio':>9}{'Segundos':>10}{'MB/s':>10}")
+        for codec in codecs_disponibles():
+            for nivel in NIVELES[codec]:
+                destino = os.path.join(salida_dir, f"bench_{codec}_{nivel}")
+                inicio = time.perf_counter()
+                tamano = crear_archivo(origen_dir, archivos, destino, codec, nivel)
+                segundos = time.perf_counter() - inicio
+                os.remove(destino)
+                print(
+                    f"{codec:<10}{str(nivel if nivel is not None else '-'):>7}"
+                    f"{tamano / (1024 * 1024):>10.1f}{tamano_original / tamano:>9.2f}"
+                    f"{segundos:>10.2f}{megabytes / segundos:>10.1f}"
+                )
+    finally:
+        shutil.rmtree(origen_dir, ignore_errors=True)
+        shutil.rmtree(salida_dir, ignore_errors=True)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
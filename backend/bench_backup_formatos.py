@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_backup_formatos.py [filas]
+"""
+Benchmark de los formatos de volcado del backup (json vs COPY csv/binary).
+
+Crea una tabla de prueba en el schema 'bench_backup' con N filas (por defecto
+2.000.000) y mide, para cada formato, el tiempo de volcado, MB/s y filas/s.
+El schema se elimina al terminar.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import shutil
+import tempfile
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backup_engine import FORMATOS_BACKUP, _volcar_tabla
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de la base de datos
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL no está configurada en el archivo .env")
+
+SCHEMA = "bench_backup"
+TABLA = "filas"
+
+
+async def sembrar_tabla(engine, filas: int):
+    """Crea y llena la tabla de prueba con tipos similares a logs_auditoria"""
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.execute(text(f"""
+            CREATE TABLE {SCHEMA}.{TABLA} (
+                id integer PRIMARY KEY,
+                username varchar(50) NOT NULL,
+                accion varchar(50) NOT NULL,
+                datos json,
+                ip_address varchar(45),
+                fecha timestamp NOT NULL,
+                exitoso boolean
+            )
+        """))
+        await conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.{TABLA}
+            SELECT g,
+                   'usuario_' || (g % 500),
+                   (ARRAY['create', 'update', 'delete', 'export'])[1 + g % 4],
+                   json_build_object('registro', g, 'campo', md5(g::text)),
+                   '192.168.' || (g % 255) || '.' || (g % 253),
+                   now() - (g || ' seconds')::interval,
+                   g % 7 <> 0
+            FROM generate_series(1, :filas) AS g
+        """), {"filas": filas})
+        await conn.execute(text(f"ANALYZE {SCHEMA}.{TABLA}"))
+
+
+async def medir_formato(engine, formato: str) -> dict:
+    """Vuelca la tabla de prueba en el formato indicado y mide el rendimiento"""
+    dest_dir = tempfile.mkdtemp()
+    try:
+        async with engine.connect() as conn:
+            inicio = time.perf_counter()
+            resultado = await _volcar_tabla(conn, SCHEMA, TABLA, dest_dir, formato=formato)
+            segundos = time.perf_counter() - inicio
+            await conn.rollback()
+        megabytes = resultado["bytes"] / (1024 * 1024)
+        return {
+            "formato": formato,
+            "segundos": segundos,
+            "mb": megabytes,
+            "mb_s": megabytes / segundos,
+            "filas_s": resultado["registros"] / segundos,
+        }
+    finally:
+        shutil.rmtree(dest_dir, ignore_errors=True)
+
+
+async def main():
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    engine = create_async_engine(DATABASE_URL, echo=False)
+
+    try:
+        print(f"Sembrando {filas} filas en {SCHEMA}.{TABLA}...")
+        await sembrar_tabla(engine, filas)
+
+        print(f"\n{'Formato':<10}{'Segundos':>10}{'MB':>10}{'MB/s':>10}{'Filas/s':>14}")
+        for formato in FORMATOS_BACKUP:
+            r = await medir_formato(engine, formato)
+            print(f"{r['formato']:<10}{r['segundos']:>10.2f}{r['mb']:>10.1f}{r['mb_s']:>10.1f}{r['filas_s']:>14,.0f}")
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_backup_repositorio.py [megabytes]
+"""
+Benchmark de la fragmentación por contenido del repositorio de backups.
+
+Genera un archivo aleatorio (binario, como COPY binary) y otro de texto
+(como un volcado csv), mide el rendimiento de `fragmentar` en MB/s y
+cuántos fragmentos se reutilizan tras insertar unas filas en medio del
+archivo, que es lo que ahorra el repositorio entre backups.
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import tempfile
+
+from backup_repositorio import fragmentar
+
+
+def _datos_binarios(tamano: int) -> bytes:
+    return random.randbytes(tamano)
+
+
+def _datos_texto(tamano: int) -> bytes:
+    lineas = []
+    total = 0
+    i = 0
+    while total < tamano:
+        linea = f"{i},usuario{i},usuario{i}@ejemplo.com,{random.randint(1, 5)},2026-01-{i % 28 + 1:02d}\n".encode()
+        lineas.append(linea)
+        total += len(linea)
+        i += 1
+    return b"".join(lineas)
+
+
+def _medir(path: str):
+    inicio = time.perf_counter()
+    fragmentos = [hashlib.sha256(f).digest() for f in fragmentar(path)]
+    return fragmentos, time.perf_counter() - inicio
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    tamano = megabytes * 1024 * 1024
+    directorio = tempfile.mkdtemp()
+
+    print(f"{'Datos':<10}{'MB':>6}{'Segundos':>10}{'MB/s':>10}{'Fragmentos':>12}{'Reutilizados':>14}")
+    for nombre, generar in (("binario", _datos_binarios), ("texto", _datos_texto)):
+        datos = generar(tamano)
+        original = os.path.join(directorio, f"{nombre}.dat")
+        modificado = os.path.join(directorio, f"{nombre}_modificado.dat")
+        with open(original, 'wb') as f:
+            f.write(datos)
+        # Unas filas nuevas en medio del archivo
+        medio = len(datos) // 2
+        with open(modificado, 'wb') as f:
+            f.write(datos[:medio] + _datos_texto(4096) + datos[medio:])
+
+        fragmentos, segundos = _medir(original)
+        nuevos, _ = _medir(modificado)
+        existentes = set(fragmentos)
+        reutilizados = sum(1 for f in nuevos if f in existentes)
+        print(
+            f"{nombre:<10}{megabytes:>6}{segundos:>10.2f}{megabytes / segundos:>10.0f}"
+            f"{len(fragmentos):>12}{f'{reutilizados}/{len(nuevos)}':>14}"
+        )
+        os.remove(original)
+        os.remove(modificado)
+    os.rmdir(directorio)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_busqueda_usuarios.py [usuarios] [repeticiones]
+"""
+Benchmark del autocompletado de usuarios (busqueda_usuarios).
+
+Crea una tabla temporal con N usuarios de nombres en español con acentos
+(por defecto 100.000), el mismo índice GiST de trigramas que sistema.usuarios,
+y mide la latencia de búsquedas con errores de tipeo y sin acentos. No
+modifica las tablas reales (requiere pg_trgm y unaccent).
+"""
+
+import asyncio
+import os
+import sys
+import time
+import statistics
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from busqueda_usuarios import instalar_busqueda_usuarios, sql_autocompletar, fijar_umbral
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de la base de datos
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL no está configurada en el archivo .env")
+
+TABLA = "usuarios_bench"
+NOMBRES = ["José", "María", "Jesús", "Ramón", "Inés", "Andrés", "Sofía", "Martín", "Lucía", "Raúl", "Begoña", "Álvaro", "Íñigo", "Ángela", "Nicolás"]
+APELLIDOS = ["García", "López", "Martínez", "González", "Rodríguez", "Fernández", "Pérez", "Sánchez", "Gómez", "Díaz", "Núñez", "Muñoz", "Jiménez", "Álvarez", "Peña", "Ibáñez", "Cortés", "Marín"]
+
+# Búsquedas como las teclea un administrador: sin acentos, incompletas o con errores
+BUSQUEDAS = ["jose garcia", "maria lopez", "gonzales", "fernandz", "ramon", "nunez", "alvaro peña", "ibanes", "sofia mart", "inigo"]
+
+
+def _arreglo(valores):
+    return "ARRAY[" + ", ".join(f"'{v}'" for v in valores) + "]"
+
+
+async def crear_tabla(conn, total: int):
+    n, a = len(NOMBRES), len(APELLIDOS)
+    await conn.execute(text(f"""
+        CREATE TEMP TABLE {TABLA} (LIKE sistema.usuarios) ON COMMIT PRESERVE ROWS
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {TABLA} (id, username, email, hashed_password, nombre_completo, rol, activo, fecha_creacion)
+        SELECT g,
+               lower(nombre) || g,
+               lower(nombre) || '.' || lower(apellido1) || g || '@ejemplo.com',
+               'x',
+               nombre || ' ' || apellido1 || ' ' || apellido2,
+               'user', true, now()
+        FROM generate_series(1, :total) AS g,
+        LATERAL (SELECT
+            ({_arreglo(NOMBRES)})[1 + (g * 7) % {n}] AS nombre,
+            ({_arreglo(APELLIDOS)})[1 + (g * 13) % {a}] AS apellido1,
+            ({_arreglo(APELLIDOS)})[1 + (g / 17) % {a}] AS apellido2
+        ) AS datos
+    """), {"total": total})
+    await instalar_busqueda_usuarios(conn, tabla=TABLA, indice=f"ix_{TABLA}_busqueda_trgm")
+    await conn.execute(text(f"ANALYZE {TABLA}"))
+
+
+async def medir(conn, sql: str, texto: str, repeticiones: int):
+    """Milisegundos de cada ejecución y las filas de la última"""
+    tiempos = []
+    filas = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        result = await conn.execute(text(sql), {"texto": texto, "limite": 10})
+        filas = result.all()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos, filas
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    engine = create_async_engine(DATABASE_URL, echo=False)
+
+    try:
+        async with engine.connect() as conn:
+            print(f"Creando {total} usuarios de prueba en la tabla temporal {TABLA}...")
+            inicio = time.perf_counter()
+            await crear_tabla(conn, total)
+            await conn.commit()
+            print(f"✅ Tabla e índice creados en {time.perf_counter() - inicio:.1f}s\n")
+
+            await fijar_umbral(conn)
+            sql = sql_autocompletar(TABLA)
+            # Calentar caché de planes y páginas del índice
+            await medir(conn, sql, BUSQUEDAS[0], 3)
+
+            print(f"{'Búsqueda':<15}{'p50 ms':>9}{'p95 ms':>9}{'máx ms':>9}  Primer resultado")
+            todos = []
+            for texto in BUSQUEDAS:
+                tiempos, filas = await medir(conn, sql, texto, repeticiones)
+                todos.extend(tiempos)
+                p95 = statistics.quantiles(tiempos, n=20)[-1] if len(tiempos) > 1 else tiempos[0]
+                primero = filas[0].nombre_completo if filas else "-"
+                print(f"{texto:<15}{statistics.median(tiempos):>9.2f}{p95:>9.2f}{max(tiempos):>9.2f}  {primero}")
+
+            p95_total = statistics.quantiles(todos, n=20)[-1]
+            print(f"\nGlobal: p50 {statistics.median(todos):.2f} ms, p95 {p95_total:.2f} ms (objetivo < 20 ms)")
+            print("✅ Dentro del objetivo" if p95_total < 20 else "⚠️ Fuera del objetivo")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_repositorio_usuarios.py [iteraciones]
+"""
+Microbenchmark del costo por llamada de las búsquedas de usuarios.
+
+Compara la forma anterior (construir un select() nuevo en cada llamada) con
+las lambda_stmt de repositorio_usuarios:
+- solo Python: construir la sentencia y obtener su forma compilada de la caché
+- ida y vuelta completa contra la base de datos (usuario 'admin')
+"""
+
+import asyncio
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from sqlalchemy import select, lambda_stmt
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from models import Usuario
+from repositorio_usuarios import usuario_por_username
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de la base de datos
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL no está configurada en el archivo .env")
+
+USERNAME = "admin"
+
+
+def _select_nuevo(username: str):
+    return select(Usuario).where(Usuario.username == username)
+
+
+def _select_lambda(username: str):
+    return lambda_stmt(lambda: select(Usuario).where(Usuario.username == username))
+
+
+def medir_compilacion(constructor, iteraciones: int) -> float:
+    """Microsegundos por llamada para construir la sentencia y resolverla en la caché de compilación"""
+    dialecto = postgresql.asyncpg.dialect()
+    cache = {}
+    inicio = time.perf_counter()
+    for i in range(iteraciones):
+        stmt = constructor(f"usuario{i % 10}")
+        clave = stmt._generate_cache_key()
+        if clave not in cache:
+            cache[clave] = stmt.compile(dialect=dialecto)
+    return (time.perf_counter() - inicio) / iteraciones * 1_000_000
+
+
+async def medir_consulta(session: AsyncSession, consulta, iteraciones: int) -> float:
+    """Microsegundos por llamada de una búsqueda completa contra la base de datos"""
+    await consulta(session)  # calentar cachés y prepared statements
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        await consulta(session)
+    return (time.perf_counter() - inicio) / iteraciones * 1_000_000
+
+
+async def main():
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    engine = create_async_engine(DATABASE_URL, echo=False)
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    try:
+        print(f"{iteraciones} iteraciones por caso\n")
+        print(f"{'Caso':<45}{'µs/llamada':>12}")
+
+        antes = medir_compilacion(_select_nuevo, iteraciones)
+        despues = medir_compilacion(_select_lambda, iteraciones)
+        print(f"{'Construcción + caché, select() nuevo':<45}{antes:>12.1f}")
+        print(f"{'Construcción + caché, lambda_stmt':<45}{despues:>12.1f}")
+
+        async with async_session() as session:
+            async def anterior(s):
+                result = await s.execute(_select_nuevo(USERNAME))
+                return result.scalar_one_or_none()
+
+            async def repositorio(s):
+                return await usuario_por_username(s, USERNAME)
+
+            antes_db = await medir_consulta(session, anterior, iteraciones)
+            despues_db = await medir_consulta(session, repositorio, iteraciones)
+        print(f"{'Consulta completa, select() nuevo':<45}{antes_db:>12.1f}")
+        print(f"{'Consulta completa, repositorio_usuarios':<45}{despues_db:>12.1f}")
+
+        print(f"\nAhorro por llamada: {antes - despues:.1f} µs en Python, {antes_db - despues_db:.1f} µs de extremo a extremo")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python bench_smtp_pool.py [mensajes] [latencia_ms]
+"""
+Benchmark del pool de conexiones SMTP (smtp_pool) contra un servidor SMTP
+local de prueba (aiosmtpd, pip install aiosmtpd) que descarta los mensajes.
+
+Compara mensajes/segundo de una conexión nueva por mensaje (como enviaba
+antes email_service con smtplib) con el pool de 1 y de varias conexiones.
+`latencia_ms` simula la ida y vuelta de red en cada comando SMTP; con un
+servidor real, STARTTLS y el login agregan varias idas y vueltas más por
+conexión, así que la diferencia es mayor que la medida aquí.
+"""
+
+import asyncio
+import smtplib
+import socket
+import sys
+import time
+from email.mime.text import MIMEText
+
+from aiosmtpd.controller import Controller
+
+from smtp_pool import PoolSMTP
+
+REMITENTE = "bench@ejemplo.com"
+TAMANOS_POOL = [1, 4, 8]
+
+
+class ServidorDescarte:
+    """Handler de aiosmtpd que cuenta los mensajes y espera `latencia` por comando"""
+
+    def __init__(self, latencia: float):
+        self.latencia = latencia
+        self.recibidos = 0
+
+    async def _esperar(self):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await self._esperar()
+        session.host_name = hostname
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await self._esperar()
+        envelope.mail_from = address
+        return "250 OK"
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await self._esperar()
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await self._esperar()
+        self.recibidos += 1
+        return "250 Message accepted for delivery"
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _mensajes(total: int):
+    mensajes = []
+    for i in range(total):
+        destinatario = f"usuario{i}@ejemplo.com"
+        msg = MIMEText(f"<p>Mensaje de prueba {i}</p>", "html")
+        msg["From"] = REMITENTE
+        msg["To"] = destinatario
+        msg["Subject"] = f"Prueba {i}"
+        mensajes.append((destinatario, msg.as_string()))
+    return mensajes
+
+
+def enviar_sin_pool(puerto: int, mensajes) -> int:
+    """Una conexión por mensaje, como el antiguo send_email"""
+    enviados = 0
+    for destinatario, mensaje in mensajes:
+        server = smtplib.SMTP("127.0.0.1", puerto)
+        server.sendmail(REMITENTE, destinatario, mensaje)
+        server.quit()
+        enviados += 1
+    return enviados
+
+
+async def medir_pool(puerto: int, mensajes, tamano: int):
+    pool = PoolSMTP("127.0.0.1", puerto, starttls=False, tamano=tamano)
+    try:
+        inicio = time.perf_counter()
+        errores = await pool.enviar_lote(REMITENTE, mensajes)
+        segundos = time.perf_counter() - inicio
+    finally:
+        await pool.cerrar()
+    fallidos = sum(1 for error in errores if error)
+    return segundos, fallidos, pool.estado()
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latencia_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    puerto = _puerto_libre()
+    handler = ServidorDescarte(latencia_ms / 1000)
+    controller = Controller(handler, hostname="127.0.0.1", port=puerto)
+    controller.start()
+    mensajes = _mensajes(total)
+
+    try:
+        print(f"{total} mensajes, latencia simulada {latencia_ms:g} ms por comando\n")
+        print(f"{'Modo':<28}{'segundos':>10}{'msg/s':>10}{'conexiones':>12}{'errores':>9}")
+
+        inicio = time.perf_counter()
+        await asyncio.to_thread(enviar_sin_pool, puerto, mensajes)
+        base = time.perf_counter() - inicio
+        print(f"{'Conexión por mensaje':<28}{base:>10.2f}{total / base:>10.0f}{total:>12}{0:>9}")
+
+        for tamano in TAMANOS_POOL:
+            segundos, fallidos, estado = await medir_pool(puerto, mensajes, tamano)
+            print(
+                f"{f'Pool de {tamano} conexiones':<28}{segundos:>10.2f}{total / segundos:>10.0f}"
+                f"{estado['conexiones_abiertas']:>12}{fallidos:>9}  (x{base / segundos:.1f})"
+            )
+        print(f"\n✅ Mensajes recibidos por el servidor: {handler.recibidos}")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# busqueda_usuarios.py
+# Autocompletado de usuarios tolerante a errores y acentos (pg_trgm + unaccent)
+
+import os
+from typing import List
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from dotenv import load_dotenv
+
+from models import Usuario
+
+load_dotenv()
+
+# Similitud mínima (0-1) de la palabra buscada con el texto del usuario
+USUARIO_BUSQUEDA_UMBRAL = float(os.getenv("USUARIO_BUSQUEDA_UMBRAL", "0.3"))
+
+# Texto indexado: username, email y nombre en minúsculas y sin acentos.
+# unaccent() no es IMMUTABLE (depende de search_path), por eso el índice usa
+# el contenedor sistema.f_unaccent con el diccionario calificado.
+TEXTO_BUSQUEDA = "sistema.f_unaccent(lower(username || ' ' || email || ' ' || nombre_completo))"
+
+
+async def instalar_busqueda_usuarios(conn: AsyncConnection, tabla: str = "sistema.usuarios", indice: str = "ix_usuarios_busqueda_trgm"):
+    """Crea las extensiones, la función sistema.f_unaccent y el índice GiST de trigramas"""
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+    await conn.execute(text("""
+        CREATE OR REPLACE FUNCTION sistema.f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """))
+    # GiST (no GIN): permite ordenar por distancia con el índice y cortar en los primeros k
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {indice} ON {tabla} USING gist (({TEXTO_BUSQUEDA}) gist_trgm_ops)"
+    ))
+
+
+def sql_autocompletar(tabla: str = "sistema.usuarios") -> str:
+    """
+    Usuarios cuyo texto contiene una palabra parecida a :texto (operador <%),
+    del más al menos parecido (distancia <<->, resuelta por el índice GiST).
+    """
+    return f"""
+        SELECT * FROM {tabla}
+        WHERE sistema.f_unaccent(lower(:texto)) <% ({TEXTO_BUSQUEDA})
+        ORDER BY sistema.f_unaccent(lower(:texto)) <<-> ({TEXTO_BUSQUEDA}), username
+        LIMIT :limite
+    """
+
+
+SQL_AUTOCOMPLETAR = sql_autocompletar()
+
+
+async def fijar_umbral(session_o_conexion, umbral: float = USUARIO_BUSQUEDA_UMBRAL):
+    """Umbral de <% solo para la transacción en curso"""
+    await session_o_conexion.execute(
+        text("SELECT set_config('pg_trgm.word_similarity_threshold', :umbral, true)"),
+        {"umbral": str(umbral)}
+    )
+
+
+async def autocompletar_usuarios(session: AsyncSession, texto: str, limite: int = 10) -> List[Usuario]:
+    """Los `limite` usuarios más parecidos a `texto`"""
+    await fijar_umbral(session)
+    result = await session.execute(
+        select(Usuario).from_statement(text(SQL_AUTOCOMPLETAR)),
+        {"texto": texto, "limite": limite}
+    )
+    return list(result.scalars().all())
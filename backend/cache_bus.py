@@ -0,0 +1,150 @@
+# cache_bus.py
+# Bus de invalidación de cachés entre procesos con LISTEN/NOTIFY de PostgreSQL
+
+import os
+import json
+import asyncio
+from typing import Callable, Dict, Any, Optional
+
+import asyncpg
+from sqlalchemy import text, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from database import DATABASE_URL
+
+load_dotenv()
+
+CACHE_BUS_HABILITADO = os.getenv("CACHE_BUS_HABILITADO", "true").lower() == "true"
+# Segundos entre reintentos de conexión y entre comprobaciones de la conexión de escucha
+CACHE_BUS_REINTENTO_S = float(os.getenv("CACHE_BUS_REINTENTO_S", "5"))
+CACHE_BUS_VERIFICAR_S = 30
+CANAL = "invalidacion_cache"
+
+
+class BusInvalidacion:
+    """
+    Cada proceso registra sus cachés con una función que descarta una clave
+    (o todo si la clave es None). Las escrituras publican el aviso con
+    pg_notify en su propia transacción, así que solo llega si el commit tiene
+    éxito, y todos los procesos (incluido el que escribe) lo reciben por una
+    conexión dedicada con LISTEN. Si esa conexión se pierde, al reconectar se
+    vacían todas las cachés porque pudieron perderse avisos mientras tanto.
+    """
+
+    def __init__(self):
+        self._caches: Dict[str, Callable[[Optional[Any]], None]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.conectado = False
+        self.recibidos = 0
+        self.reconexiones = 0
+
+    def registrar(self, cache: str, invalidar: Callable[[Optional[Any]], None]):
+        self._caches[cache] = invalidar
+
+    def invalidar_local(self, cache: str, clave: Optional[Any] = None):
+        invalidar = self._caches.get(cache)
+        if invalidar is None:
+            return
+        try:
+            invalidar(clave)
+        except Exception as e:
+            print(f"❌ Error invalidando la caché '{cache}': {e}")
+
+    def invalidar_todo(self):
+        for cache in self._caches:
+            self.invalidar_local(cache)
+
+    async def publicar(self, session: AsyncSession, cache: str, clave: Optional[Any] = None):
+        """
+        Publica la invalidación dentro de la transacción de `session`. El
+        proceso actual descarta la entrada en cuanto se confirma el commit,
+        sin esperar a recibir su propio aviso; si la transacción se deshace,
+        no se descarta nada.
+        """
+        payload = json.dumps({"cache": cache, "clave": clave})
+        await session.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": CANAL, "payload": payload})
+        self._escuchar_transaccion(session)
+        session.info.setdefault("invalidaciones_pendientes", []).append((cache, clave))
+
+    def _escuchar_transaccion(self, session: AsyncSession):
+        """Una sola pareja de listeners por sesión, que aplica o descarta las invalidaciones pendientes"""
+        if session.info.get("bus_invalidacion"):
+            return
+        session.info["bus_invalidacion"] = True
+
+        def _al_confirmar(_):
+            for cache, clave in session.info.pop("invalidaciones_pendientes", []):
+                self.invalidar_local(cache, clave)
+
+        def _al_deshacer(_):
+            session.info.pop("invalidaciones_pendientes", None)
+
+        event.listen(session.sync_session, "after_commit", _al_confirmar)
+        event.listen(session.sync_session, "after_rollback", _al_deshacer)
+
+    def _recibir(self, conexion, pid, canal, payload):
+        self.recibidos += 1
+        try:
+            aviso = json.loads(payload)
+            self.invalidar_local(aviso["cache"], aviso.get("clave"))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Aviso de invalidación inválido: {payload!r} ({e})")
+
+    async def _escuchar(self):
+        # asyncpg usa la URL sin el sufijo del driver de SQLAlchemy
+        dsn = make_url(DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                conexion = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                print(f"❌ Bus de invalidación sin conexión, reintento en {CACHE_BUS_REINTENTO_S:.0f}s: {e}")
+                await asyncio.sleep(CACHE_BUS_REINTENTO_S)
+                continue
+
+            perdida = asyncio.Event()
+            conexion.add_termination_listener(lambda _: perdida.set())
+            try:
+                await conexion.add_listener(CANAL, self._recibir)
+                # Lo que estuviera en caché pudo cambiar sin aviso mientras no se escuchaba
+                self.invalidar_todo()
+                self.conectado = True
+                print("✅ Bus de invalidación de cachés escuchando")
+                while not perdida.is_set():
+                    try:
+                        await asyncio.wait_for(perdida.wait(), timeout=CACHE_BUS_VERIFICAR_S)
+                    except asyncio.TimeoutError:
+                        # Detecta conexiones caídas sin cierre (red, failover)
+                        await conexion.fetchval("SELECT 1", timeout=CACHE_BUS_REINTENTO_S)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as e:
+                print(f"❌ Conexión del bus de invalidación perdida: {e}")
+            finally:
+                self.conectado = False
+                if not conexion.is_closed():
+                    conexion.terminate()
+            self.reconexiones += 1
+            await asyncio.sleep(CACHE_BUS_REINTENTO_S)
+
+    def iniciar(self):
+        if CACHE_BUS_HABILITADO and self._task is None:
+            self._task = asyncio.create_task(self._escuchar())
+
+    async def detener(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "habilitado": CACHE_BUS_HABILITADO,
+            "conectado": self.conectado,
+            "caches": list(self._caches),
+            "avisos_recibidos": self.recibidos,
+            "reconexiones": self.reconexiones,
+        }
+
+
+# Instancia global
+bus_invalidacion = BusInvalidacion()
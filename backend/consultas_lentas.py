@@ -0,0 +1,148 @@
+# consultas_lentas.py
+# Registro de consultas lentas con su plan (EXPLAIN) en un buffer circular
+
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from dotenv import load_dotenv
+
+from sql_metricas import MetricasSQL, metricas_sql, observadores_sentencia, motores
+
+load_dotenv()
+
+# Duración a partir de la que una sentencia se registra como lenta
+SQL_UMBRAL_LENTA_MS = float(os.getenv("SQL_UMBRAL_LENTA_MS", "500"))
+# Consultas lentas que se conservan (las más antiguas se descartan)
+SQL_MAX_LENTAS = int(os.getenv("SQL_MAX_LENTAS", "200"))
+# Segundos durante los que se reutiliza el plan de una misma sentencia con los mismos parámetros
+SQL_EXPLAIN_REUTILIZAR_S = 60
+# EXPLAIN pendientes como máximo; si hay más, la consulta se registra sin plan
+SQL_EXPLAIN_PENDIENTES = 20
+
+# Sentencias que admiten EXPLAIN
+_EXPLICABLES = ("select", "with", "insert", "update", "delete")
+# Palabras que hacen ocultar los parámetros de la sentencia
+_SENSIBLES = ("password", "token", "email_outbox")
+
+
+def _parametros_seguros(statement: str, parameters: Any) -> Optional[List[str]]:
+    """Parámetros como texto recortado, ocultos si la sentencia toca contraseñas, tokens o emails"""
+    if parameters is None:
+        return None
+    if any(palabra in statement.lower() for palabra in _SENSIBLES):
+        return ["***"]
+    valores = parameters if isinstance(parameters, (list, tuple)) else [parameters]
+    return [repr(valor)[:100] for valor in valores]
+
+
+class RegistroConsultasLentas:
+    """
+    Guarda en memoria las últimas SQL_MAX_LENTAS sentencias que superaron el
+    umbral, con la ruta y el usuario de la petición. El plan se obtiene después,
+    en una tarea aparte, con EXPLAIN (FORMAT JSON) sin ANALYZE: no vuelve a
+    ejecutar la sentencia y no retrasa la respuesta. Los EXPLAIN usan un motor
+    propio de una sola conexión por base de datos, para no quitar conexiones
+    al pool de la aplicación justo cuando va lento.
+    """
+
+    def __init__(self, maximo: int = SQL_MAX_LENTAS):
+        self.consultas: "deque[Dict[str, Any]]" = deque(maxlen=maximo)
+        self._planes: Dict[tuple, tuple] = {}
+        self._motores_explain: Dict[AsyncEngine, AsyncEngine] = {}
+        self._pendientes = 0
+        self._siguiente_id = 1
+
+    def observar(self, conn, statement: str, parameters: Any, duracion_ms: float, metricas: MetricasSQL):
+        if SQL_UMBRAL_LENTA_MS <= 0 or duracion_ms < SQL_UMBRAL_LENTA_MS:
+            return
+
+        registro = {
+            "id": self._siguiente_id,
+            "fecha": datetime.utcnow().isoformat(),
+            "duracion_ms": round(duracion_ms, 1),
+            "metodo": metricas.metodo,
+            "ruta": metricas.ruta,
+            "usuario": metricas.usuario,
+            "sentencia": statement,
+            "parametros": _parametros_seguros(statement, parameters),
+            "plan": None,
+        }
+        self._siguiente_id += 1
+        self.consultas.append(registro)
+        print(f"⚠️ Consulta lenta ({registro['duracion_ms']} ms) en {metricas.metodo} {metricas.ruta}")
+
+        if not statement.lstrip().lower().startswith(_EXPLICABLES):
+            return
+        motor = motores.get(conn.engine)
+        if motor is None:
+            return
+        # executemany: no hay un único juego de parámetros con el que explicar la sentencia
+        if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return
+
+        # El plan depende de los valores: solo se reutiliza con los mismos parámetros
+        clave = (statement, repr(parameters))
+        plan_previo = self._planes.get(clave)
+        if plan_previo and time.monotonic() - plan_previo[0] < SQL_EXPLAIN_REUTILIZAR_S:
+            registro["plan"] = plan_previo[1]
+            return
+        if self._pendientes >= SQL_EXPLAIN_PENDIENTES:
+            registro["plan"] = {"error": "Demasiados EXPLAIN pendientes, plan omitido"}
+            return
+        self._pendientes += 1
+        # Este código corre dentro del event loop (greenlet de SQLAlchemy), así que se puede crear la tarea
+        asyncio.get_running_loop().create_task(self._explicar(motor, registro, clave, parameters))
+
+    def _motor_explain(self, motor: AsyncEngine) -> AsyncEngine:
+        """Motor de una sola conexión, sin instrumentar, para los EXPLAIN de esa base de datos"""
+        if motor not in self._motores_explain:
+            self._motores_explain[motor] = create_async_engine(
+                motor.url, pool_size=1, max_overflow=0, pool_timeout=10, pool_pre_ping=True
+            )
+        return self._motores_explain[motor]
+
+    async def _explicar(self, motor: AsyncEngine, registro: Dict[str, Any], clave: tuple, parameters: Any):
+        # La tarea hereda una copia del contexto de la petición: el EXPLAIN no debe contar en sus métricas
+        metricas_sql.set(None)
+        statement = clave[0]
+        try:
+            async with self._motor_explain(motor).connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection
+                argumentos = parameters if isinstance(parameters, (list, tuple)) else ()
+                # En una transacción que se descarta: EXPLAIN sin ANALYZE no ejecuta la sentencia
+                async with driver.transaction(readonly=True):
+                    plan = await driver.fetchval(f"EXPLAIN (FORMAT JSON) {statement}", *argumentos)
+                registro["plan"] = json.loads(plan) if isinstance(plan, str) else plan
+                if len(self._planes) >= self.consultas.maxlen:
+                    self._planes.clear()
+                self._planes[clave] = (time.monotonic(), registro["plan"])
+        except Exception as e:
+            registro["plan"] = {"error": str(e)}
+        finally:
+            self._pendientes -= 1
+
+    def listar(self, limite: int = 50, ruta: Optional[str] = None) -> List[Dict[str, Any]]:
+        consultas = [c for c in reversed(self.consultas) if not ruta or c["ruta"] == ruta]
+        return consultas[:limite]
+
+    def limpiar(self):
+        self.consultas.clear()
+        self._planes.clear()
+
+    async def cerrar(self):
+        """Cierra los motores de EXPLAIN (al apagar la aplicación)"""
+        motores_explain, self._motores_explain = self._motores_explain, {}
+        for motor in motores_explain.values():
+            await motor.dispose()
+
+
+# Instancia global registrada como observador de las sentencias de cada petición
+registro_consultas_lentas = RegistroConsultasLentas()
+observadores_sentencia.append(registro_consultas_lentas.observar)
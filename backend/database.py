@@ -1,9 +1,19 @@
 # database.py
 import os
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import time
+import asyncio
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from pool_metricas import PoolInstrumentado
+from sql_metricas import instalar_instrumentacion
+
 load_dotenv()
 
 # Configuración de las bases de datos
@@ -12,11 +22,76 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("No se encontró DATABASE_URL en el archivo .env")
 
+# Réplicas de solo lectura opcionales (URLs separadas por comas)
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+# Configuración del pool de conexiones
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Segundos tras los que se reemplaza una conexión (-1 = nunca)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Verifica cada conexión antes de usarla (detecta conexiones muertas tras un failover)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Segundos que una réplica con fallos queda fuera de la rotación
+DB_REPLICA_REINTENTO_S = float(os.getenv("DB_REPLICA_REINTENTO_S", "30"))
+# Segundos tras una escritura en que el cliente lee del primario (lee sus propias escrituras)
+DB_LEER_ESCRITURAS_S = int(os.getenv("DB_LEER_ESCRITURAS_S", "5"))
+# Cookie que marca a los clientes que acaban de escribir
+COOKIE_LEER_PRIMARIO = "leer_primario"
+
+
+def _crear_engine(url: str) -> AsyncEngine:
+    nuevo = create_async_engine(
+        url,
+        echo=False,
+        poolclass=PoolInstrumentado,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING
+    )
+    instalar_instrumentacion(nuevo)
+    return nuevo
+
+
 # Motores asíncronos
-engine = create_async_engine(DATABASE_URL, echo=False)  
+engine = _crear_engine(DATABASE_URL)
+replica_engines: List[AsyncEngine] = [_crear_engine(url) for url in DATABASE_REPLICA_URLS]
 
 # Fábricas de sesiones
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+ReplicaSessions = [
+    sessionmaker(bind=replica, class_=AsyncSession, expire_on_commit=False)
+    for replica in replica_engines
+]
+
+# Rotación round-robin y réplicas fuera de servicio (índice -> hasta cuándo)
+_siguiente_replica = 0
+_replicas_caidas = {}
+
+
+def _replicas_en_rotacion() -> List[int]:
+    """Índices de las réplicas a probar, empezando por la siguiente del round-robin"""
+    global _siguiente_replica
+    total = len(replica_engines)
+    if not total:
+        return []
+    inicio = _siguiente_replica % total
+    _siguiente_replica += 1
+    ahora = time.monotonic()
+    orden = [(inicio + i) % total for i in range(total)]
+    return [i for i in orden if _replicas_caidas.get(i, 0) <= ahora]
+
+
+def _marcar_caida(indice: int, error: Exception):
+    _replicas_caidas[indice] = time.monotonic() + DB_REPLICA_REINTENTO_S
+    print(f"❌ Réplica {indice} fuera de rotación por {DB_REPLICA_REINTENTO_S:.0f}s: {error}")
+
 
 async def get_session():
     """
@@ -24,3 +99,90 @@ async def get_session():
     """
     async with SessionLocal() as session:
         yield session
+
+
+class UnidadDeTrabajo:
+    """
+    Transacción de una petición de escritura. El handler hace sus cambios en
+    `session` y llama a `confirmar()` una sola vez al final; los registros de
+    acceso y auditoría (ver `persistir`) y los emails de la bandeja de salida
+    (ver email_outbox.encolar_email) se suman a ese mismo commit, así que o
+    se guarda todo o nada.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        session.info["unidad_trabajo"] = self
+
+    async def confirmar(self):
+        await self.session.commit()
+
+
+def unidad_de(session: AsyncSession) -> Optional[UnidadDeTrabajo]:
+    """Unidad de trabajo a la que pertenece la sesión, si la hay"""
+    return session.info.get("unidad_trabajo")
+
+
+async def persistir(session: AsyncSession):
+    """
+    Confirma los cambios de la sesión, salvo que pertenezca a una
+    UnidadDeTrabajo: entonces se guardan con su commit único al final.
+    """
+    if unidad_de(session) is None:
+        await session.commit()
+
+
+async def get_unidad_trabajo():
+    """
+    Proveedor de dependencia con una UnidadDeTrabajo sobre el primario. Si el
+    handler no llama a `confirmar()` (por ejemplo, porque lanzó una
+    HTTPException), los cambios se descartan al cerrar la sesión.
+    """
+    async with SessionLocal() as session:
+        yield UnidadDeTrabajo(session)
+
+
+async def get_read_session(request: Request):
+    """
+    Sesión para endpoints de solo lectura. Usa las réplicas en round-robin y
+    vuelve al primario si no hay réplicas, si todas fallan al conectar o si
+    el cliente escribió hace poco (cookie COOKIE_LEER_PRIMARIO), para que vea
+    sus propias escrituras aunque la réplica tenga retraso.
+    """
+    if request.cookies.get(COOKIE_LEER_PRIMARIO):
+        async with SessionLocal() as session:
+            yield session
+        return
+
+    for indice in _replicas_en_rotacion():
+        session = ReplicaSessions[indice]()
+        try:
+            # Conectar ya para detectar una réplica caída antes de usarla
+            await session.connection()
+        except (DBAPIError, PoolTimeoutError, OSError, asyncio.TimeoutError) as e:
+            await session.close()
+            _marcar_caida(indice, e)
+            continue
+        try:
+            yield session
+        finally:
+            await session.close()
+        return
+
+    async with SessionLocal() as session:
+        yield session
+
+
+async def motor_lectura() -> AsyncEngine:
+    """
+    Motor para lecturas largas (backups, exportaciones): la primera réplica
+    disponible del round-robin o el primario si no hay ninguna.
+    """
+    for indice in _replicas_en_rotacion():
+        try:
+            async with replica_engines[indice].connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return replica_engines[indice]
+        except (DBAPIError, PoolTimeoutError, OSError, asyncio.TimeoutError) as e:
+            _marcar_caida(indice, e)
+    return engine
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from models import Usuario, LogAcceso
 from schemas import LogAccesoCreate
 from database import get_session
+from repositorio_usuarios import usuario_por_id
+from cache_bus import bus_invalidacion
 from security import check_permission
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
@@ -15,13 +16,13 @@ async def delete_user_physical(
     session: AsyncSession = Depends(get_session)
 ):
     """Elimina físicamente un usuario (borrado real, solo admin no puede eliminarse)"""
-    result = await session.execute(select(Usuario).where(Usuario.id == user_id))
-    user = result.scalar_one_or_none()
+    user = await usuario_por_id(session, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     if user.username == 'admin' and user.rol == 'admin':
         raise HTTPException(status_code=403, detail="No se puede eliminar el usuario admin")
     await session.delete(user)
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
     await session.commit()
     # Registrar log
     await session.execute(
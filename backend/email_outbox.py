@@ -0,0 +1,298 @@
+# email_outbox.py
+# Bandeja de salida de emails: se guardan en la transacción de la petición y los envía un worker
+
+import os
+import base64
+import random
+import asyncio
+import hashlib
+from typing import List, Optional, Dict, Any, Tuple
+
+from sqlalchemy import text, event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from cryptography.fernet import Fernet, InvalidToken
+from dotenv import load_dotenv
+
+from models import EmailOutbox
+from security import SECRET_KEY
+from database import SessionLocal
+from email_service import email_service
+
+load_dotenv()
+
+EMAIL_OUTBOX_HABILITADO = os.getenv("EMAIL_OUTBOX_HABILITADO", "true").lower() == "true"
+# Segundos entre revisiones de la bandeja cuando no llegan avisos de emails nuevos
+EMAIL_OUTBOX_INTERVALO_S = float(os.getenv("EMAIL_OUTBOX_INTERVALO_S", "5"))
+# Emails tomados por vuelta (se envían en paralelo por el pool de conexiones SMTP)
+EMAIL_OUTBOX_LOTE = int(os.getenv("EMAIL_OUTBOX_LOTE", "20"))
+# Intentos antes de pasar a 'fallido' (dead letter)
+EMAIL_OUTBOX_MAX_INTENTOS = int(os.getenv("EMAIL_OUTBOX_MAX_INTENTOS", "6"))
+# Espera antes del primer reintento; se duplica en cada fallo hasta EMAIL_OUTBOX_ESPERA_MAX_S
+EMAIL_OUTBOX_ESPERA_S = float(os.getenv("EMAIL_OUTBOX_ESPERA_S", "30"))
+EMAIL_OUTBOX_ESPERA_MAX_S = 3600
+# Plazo de un worker para enviar lo que tomó; si se cae, otro lo retoma al vencer
+EMAIL_OUTBOX_PLAZO_S = 300
+
+# Toma un lote sin bloquear a otros workers (SKIP LOCKED). Los 'enviando' con el
+# plazo vencido son de un worker que se cayó y se vuelven a tomar, mientras les
+# queden intentos.
+SQL_TOMAR_LOTE = text("""
+    UPDATE sistema.email_outbox
+    SET estado = 'enviando', intentos = intentos + 1,
+        proximo_intento = now() + make_interval(secs => :plazo)
+    WHERE id IN (
+        SELECT id FROM sistema.email_outbox
+        WHERE estado IN ('pendiente', 'enviando') AND proximo_intento <= now()
+          AND intentos < :max_intentos
+        ORDER BY proximo_intento
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, destinatario, asunto, cuerpo, es_html, intentos
+""")
+
+# Los que agotaron los intentos sin que el worker registrara el resultado (se cayó
+# o se colgó enviándolos) pasan a 'fallido'; el cuerpo se cifra a continuación
+SQL_VENCIDOS = text("""
+    UPDATE sistema.email_outbox
+    SET estado = 'fallido', ultimo_error = 'Sin resultado del envío tras agotar los intentos'
+    WHERE id IN (
+        SELECT id FROM sistema.email_outbox
+        WHERE estado IN ('pendiente', 'enviando') AND proximo_intento <= now()
+          AND intentos >= :max_intentos
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, cuerpo
+""")
+
+SQL_CIFRAR_CUERPO = text("""
+    UPDATE sistema.email_outbox SET cuerpo = :cuerpo, cuerpo_cifrado = true WHERE id = :id
+""")
+
+# El cuerpo se borra al enviarse: puede contener contraseñas temporales o tokens
+SQL_ENVIADOS = text("""
+    UPDATE sistema.email_outbox
+    SET estado = 'enviado', fecha_envio = now(), cuerpo = '', ultimo_error = NULL
+    WHERE id = ANY(:ids)
+""")
+
+# Al pasar a 'fallido' el cuerpo se guarda cifrado (:cuerpo); si sigue pendiente, :cuerpo es NULL
+SQL_FALLO = text("""
+    UPDATE sistema.email_outbox
+    SET estado = :estado,
+        proximo_intento = now() + make_interval(secs => :espera),
+        ultimo_error = :error,
+        cuerpo = COALESCE(:cuerpo, cuerpo),
+        cuerpo_cifrado = cuerpo_cifrado OR :cifrado
+    WHERE id = :id
+""")
+
+# Clave de cifrado de los cuerpos en dead letter, derivada de SECRET_KEY
+_fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(f"email_outbox:{SECRET_KEY}".encode()).digest()))
+
+# Los backups no guardan el cuerpo (ver backup_engine.COLUMNAS_VACIADAS_BACKUP)
+ERROR_SIN_CUERPO = "El email no tiene cuerpo (p. ej. restaurado de un backup)"
+
+
+def _cifrar(cuerpo: str) -> str:
+    return _fernet.encrypt(cuerpo.encode()).decode()
+
+
+def _descifrar(cuerpo: str) -> str:
+    return _fernet.decrypt(cuerpo.encode()).decode()
+
+
+def _despertar_al_confirmar(session: AsyncSession):
+    """Tras el commit avisa al worker de este proceso para que no espere a la próxima revisión"""
+    if session.info.get("despertar_repartidor"):
+        return
+    session.info["despertar_repartidor"] = True
+
+    def _al_confirmar(_):
+        session.info.pop("despertar_repartidor", None)
+        repartidor_emails.despertar()
+
+    event.listen(session.sync_session, "after_commit", _al_confirmar, once=True)
+
+
+def encolar_email(session: AsyncSession, destinatario: str, asunto: str, cuerpo: str, es_html: bool = True):
+    """
+    Agrega un email a la bandeja de salida dentro de la transacción de
+    `session`: solo se enviará si la transacción se confirma.
+    """
+    session.add(EmailOutbox(destinatario=destinatario, asunto=asunto, cuerpo=cuerpo, es_html=es_html))
+    _despertar_al_confirmar(session)
+
+
+async def encolar_emails(session: AsyncSession, emails: List[Tuple[str, str, str, bool]]):
+    """Como encolar_email para muchos (destinatario, asunto, cuerpo, es_html) con un solo INSERT"""
+    if not emails:
+        return
+    await session.execute(insert(EmailOutbox), [
+        {"destinatario": destinatario, "asunto": asunto, "cuerpo": cuerpo, "es_html": es_html}
+        for destinatario, asunto, cuerpo, es_html in emails
+    ])
+    _despertar_al_confirmar(session)
+
+
+def _espera_reintento(intentos: int) -> float:
+    """Backoff exponencial con ±10% de variación para no reintentar todos a la vez"""
+    espera = min(EMAIL_OUTBOX_ESPERA_S * 2 ** (intentos - 1), EMAIL_OUTBOX_ESPERA_MAX_S)
+    return espera * random.uniform(0.9, 1.1)
+
+
+class RepartidorEmails:
+    """Worker que envía la bandeja de salida; puede correr en varios procesos a la vez"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._evento: Optional[asyncio.Event] = None
+        self.enviados = 0
+        self.fallos = 0
+
+    def despertar(self):
+        if self._evento is not None:
+            self._evento.set()
+
+    async def procesar_lote(self) -> int:
+        """Envía un lote de la bandeja y registra el resultado; retorna cuántos tomó"""
+        async with SessionLocal() as session:
+            vencidos = (await session.execute(SQL_VENCIDOS, {"max_intentos": EMAIL_OUTBOX_MAX_INTENTOS})).all()
+            cifrados = [{"id": id_email, "cuerpo": _cifrar(cuerpo)} for id_email, cuerpo in vencidos if cuerpo]
+            if cifrados:
+                await session.execute(SQL_CIFRAR_CUERPO, cifrados)
+            if vencidos:
+                print(f"⚠️ {len(vencidos)} emails pasan a fallido sin resultado del envío tras {EMAIL_OUTBOX_MAX_INTENTOS} intentos")
+            result = await session.execute(SQL_TOMAR_LOTE, {
+                "plazo": float(EMAIL_OUTBOX_PLAZO_S),
+                "lote": EMAIL_OUTBOX_LOTE,
+                "max_intentos": EMAIL_OUTBOX_MAX_INTENTOS,
+            })
+            filas = result.all()
+            await session.commit()
+        if not filas:
+            return 0
+
+        a_enviar = [f for f in filas if f.cuerpo]
+        errores = await email_service.send_batch(
+            [(f.destinatario, f.asunto, f.cuerpo, f.es_html) for f in a_enviar]
+        ) if a_enviar else []
+        resultados = list(zip(a_enviar, errores)) + [(f, ERROR_SIN_CUERPO) for f in filas if not f.cuerpo]
+
+        enviados = [f.id for f, error in resultados if error is None]
+        fallidos = []
+        for f, error in resultados:
+            if error is None:
+                continue
+            # Sin más intentos (o sin cuerpo que enviar): dead letter con el cuerpo cifrado
+            agotado = f.intentos >= EMAIL_OUTBOX_MAX_INTENTOS or not f.cuerpo
+            fallidos.append({
+                "id": f.id,
+                "error": error[:1000],
+                "espera": _espera_reintento(f.intentos),
+                "estado": "fallido" if agotado else "pendiente",
+                "cuerpo": _cifrar(f.cuerpo) if agotado and f.cuerpo else None,
+                "cifrado": agotado and bool(f.cuerpo),
+            })
+        async with SessionLocal() as session:
+            if enviados:
+                await session.execute(SQL_ENVIADOS, {"ids": enviados})
+            if fallidos:
+                await session.execute(SQL_FALLO, fallidos)
+            await session.commit()
+
+        self.enviados += len(enviados)
+        self.fallos += len(fallidos)
+        if fallidos:
+            muertos = sum(1 for f in fallidos if f["estado"] == "fallido")
+            print(
+                f"⚠️ {len(fallidos)} de {len(filas)} emails no se enviaron "
+                f"({muertos} pasan a fallido): {fallidos[0]['error']}"
+            )
+        return len(filas)
+
+    async def _ciclo(self):
+        self._evento = asyncio.Event()
+        while True:
+            self._evento.clear()
+            try:
+                tomados = await self.procesar_lote()
+            except Exception as e:
+                print(f"❌ Error en el repartidor de emails: {e}")
+                tomados = 0
+            # Lote completo: probablemente quedan más, seguir sin esperar
+            if tomados >= EMAIL_OUTBOX_LOTE:
+                continue
+            try:
+                await asyncio.wait_for(self._evento.wait(), timeout=EMAIL_OUTBOX_INTERVALO_S)
+            except asyncio.TimeoutError:
+                pass
+
+    def iniciar(self):
+        if EMAIL_OUTBOX_HABILITADO and self._task is None:
+            self._task = asyncio.create_task(self._ciclo())
+            print("✅ Repartidor de emails iniciado")
+
+    async def detener(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def estado(self, session: AsyncSession) -> Dict[str, Any]:
+        result = await session.execute(text(
+            "SELECT estado, count(*) FROM sistema.email_outbox GROUP BY estado"
+        ))
+        fallidos = await session.execute(text("""
+            SELECT id, destinatario, asunto, intentos, ultimo_error, fecha_creacion
+            FROM sistema.email_outbox WHERE estado = 'fallido'
+            ORDER BY fecha_creacion DESC LIMIT 20
+        """))
+        return {
+            "habilitado": EMAIL_OUTBOX_HABILITADO,
+            "activo": self._task is not None and not self._task.done(),
+            "por_estado": {estado: total for estado, total in result.all()},
+            "enviados_proceso": self.enviados,
+            "fallos_proceso": self.fallos,
+            "ultimos_fallidos": [dict(fila._mapping) for fila in fallidos.all()],
+            "smtp": email_service.pool.estado(),
+        }
+
+
+async def reintentar_fallidos(session: AsyncSession, ids: Optional[List[int]] = None) -> int:
+    """
+    Devuelve a 'pendiente' los emails fallidos (todos o los indicados) con los
+    intentos a cero, descifrando su cuerpo. Los que no tienen cuerpo o no se
+    pueden descifrar (SECRET_KEY cambiada) se quedan como fallidos.
+    """
+    filtro = "AND id = ANY(:ids)" if ids else ""
+    result = await session.execute(
+        text(f"""
+            SELECT id, cuerpo, cuerpo_cifrado FROM sistema.email_outbox
+            WHERE estado = 'fallido' {filtro}
+            FOR UPDATE
+        """),
+        {"ids": ids} if ids else {}
+    )
+    reintentos = []
+    for id_email, cuerpo, cifrado in result.all():
+        if not cuerpo:
+            continue
+        try:
+            reintentos.append({"id": id_email, "cuerpo": _descifrar(cuerpo) if cifrado else cuerpo})
+        except InvalidToken:
+            continue
+    if reintentos:
+        await session.execute(text("""
+            UPDATE sistema.email_outbox
+            SET estado = 'pendiente', intentos = 0, proximo_intento = now(),
+                cuerpo = :cuerpo, cuerpo_cifrado = false
+            WHERE id = :id
+        """), reintentos)
+    await session.commit()
+    repartidor_emails.despertar()
+    return len(reintentos)
+
+
+# Instancia global
+repartidor_emails = RepartidorEmails()
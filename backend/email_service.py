@@ -1,13 +1,14 @@
 # email_service.py
 # Servicio para envío de emails
 
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional
+from typing import Optional, List, Tuple
 import os
 from dotenv import load_dotenv
 
+from smtp_pool import PoolSMTP
+
 load_dotenv()
 
 class EmailService:
@@ -17,33 +18,43 @@ class EmailService:
         self.username = os.getenv("EMAIL_USERNAME", "")
         self.password = os.getenv("EMAIL_PASSWORD", "")
         self.from_email = os.getenv("EMAIL_FROM", "")
+        self.starttls = os.getenv("EMAIL_STARTTLS", "true").lower() == "true"
+        # Conexiones autenticadas que se reutilizan entre mensajes
+        self.pool = PoolSMTP(self.host, self.port, self.username, self.password, starttls=self.starttls)
 
-    def send_email(self, to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
-        """Envía un email"""
-        try:
-            msg = MIMEMultipart()
-            msg['From'] = self.from_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
+    def _build_message(self, to_email: str, subject: str, body: str, is_html: bool = False) -> str:
+        msg = MIMEMultipart()
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
 
-            if is_html:
-                msg.attach(MIMEText(body, 'html'))
-            else:
-                msg.attach(MIMEText(body, 'plain'))
+        if is_html:
+            msg.attach(MIMEText(body, 'html'))
+        else:
+            msg.attach(MIMEText(body, 'plain'))
+        return msg.as_string()
 
-            server = smtplib.SMTP(self.host, self.port)
-            server.starttls()
-            server.login(self.username, self.password)
-            text = msg.as_string()
-            server.sendmail(self.from_email, to_email, text)
-            server.quit()
-            return True
-        except Exception as e:
-            print(f"Error enviando email: {e}")
+    async def send_email(self, to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
+        """Envía un email por el pool de conexiones SMTP"""
+        error = await self.pool.enviar(self.from_email, to_email, self._build_message(to_email, subject, body, is_html))
+        if error:
+            print(f"Error enviando email: {error}")
             return False
+        return True
 
-    def send_welcome_email(self, to_email: str, username: str, password: str, role: str) -> bool:
-        """Envía email de bienvenida con credenciales"""
+    async def send_batch(self, emails: List[Tuple[str, str, str, bool]]) -> List[Optional[str]]:
+        """
+        Envía varios emails (destino, asunto, cuerpo, es_html) por las
+        conexiones del pool, hasta SMTP_POOL_TAMANO a la vez.
+        Retorna, por cada email, None si se envió o el texto del error.
+        """
+        return await self.pool.enviar_lote(self.from_email, [
+            (to_email, self._build_message(to_email, subject, body, is_html))
+            for to_email, subject, body, is_html in emails
+        ])
+
+    def welcome_content(self, username: str, password: str, role: str) -> Tuple[str, str]:
+        """Asunto y cuerpo HTML del email de bienvenida"""
         subject = "Bienvenido al Sistema"
         
         html_body = f"""
@@ -62,11 +73,15 @@ class EmailService:
         </body>
         </html>
         """
-        
-        return self.send_email(to_email, subject, html_body, is_html=True)
+        return subject, html_body
 
-    def send_password_reset_email(self, to_email: str, username: str, reset_token: str) -> bool:
-        """Envía email para restablecer contraseña"""
+    async def send_welcome_email(self, to_email: str, username: str, password: str, role: str) -> bool:
+        """Envía email de bienvenida con credenciales"""
+        subject, html_body = self.welcome_content(username, password, role)
+        return await self.send_email(to_email, subject, html_body, is_html=True)
+
+    def password_reset_content(self, username: str, reset_token: str) -> Tuple[str, str]:
+        """Asunto y cuerpo HTML del email de restablecimiento de contraseña"""
         subject = "Restablecimiento de Contraseña - Sistema"
         
         html_body = f"""
@@ -82,11 +97,15 @@ class EmailService:
         </body>
         </html>
         """
-        
-        return self.send_email(to_email, subject, html_body, is_html=True)
+        return subject, html_body
 
-    def send_admin_notification_email(self, admin_email: str, new_user_email: str, new_user_name: str) -> bool:
-        """Notifica al administrador de una nueva solicitud de acceso"""
+    async def send_password_reset_email(self, to_email: str, username: str, reset_token: str) -> bool:
+        """Envía email para restablecer contraseña"""
+        subject, html_body = self.password_reset_content(username, reset_token)
+        return await self.send_email(to_email, subject, html_body, is_html=True)
+
+    def admin_notification_content(self, new_user_email: str, new_user_name: str) -> Tuple[str, str]:
+        """Asunto y cuerpo HTML de la notificación al administrador de una nueva solicitud de acceso"""
         subject = "Nueva Solicitud de Acceso - Sistema"
         
         html_body = f"""
@@ -104,8 +123,12 @@ class EmailService:
         </body>
         </html>
         """
-        
-        return self.send_email(admin_email, subject, html_body, is_html=True)
+        return subject, html_body
+
+    async def send_admin_notification_email(self, admin_email: str, new_user_email: str, new_user_name: str) -> bool:
+        """Notifica al administrador de una nueva solicitud de acceso"""
+        subject, html_body = self.admin_notification_content(new_user_email, new_user_name)
+        return await self.send_email(admin_email, subject, html_body, is_html=True)
 
 # Instancia global del servicio de email
 email_service = EmailService() 
\ No newline at end of file
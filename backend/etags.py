@@ -0,0 +1,48 @@
+# etags.py
+# ETags y GET condicional (If-None-Match) para respuestas JSON
+
+import json
+import hashlib
+from typing import Any
+
+from fastapi import Request, Response, status
+
+# El cliente debe revalidar siempre, pero puede reutilizar su copia si recibe 304
+CACHE_CONTROL_REVALIDAR = "private, no-cache"
+
+
+def etag_contenido(datos: Any) -> str:
+    """ETag fuerte a partir del hash del contenido (serializado de forma estable)"""
+    serializado = json.dumps(datos, sort_keys=True, default=str, separators=(",", ":"))
+    return f'"{hashlib.sha256(serializado.encode()).hexdigest()[:32]}"'
+
+
+def coincide_etag(request: Request, etag: str) -> bool:
+    """
+    True si If-None-Match incluye el ETag. La comparación es débil, como pide
+    RFC 9110 para If-None-Match: se ignora el prefijo W/.
+    """
+    cabecera = request.headers.get("if-none-match")
+    if not cabecera:
+        return False
+    if cabecera.strip() == "*":
+        return True
+    propio = etag[2:] if etag.startswith("W/") else etag
+    for candidato in cabecera.split(","):
+        candidato = candidato.strip()
+        if (candidato[2:] if candidato.startswith("W/") else candidato) == propio:
+            return True
+    return False
+
+
+def no_modificado(etag: str) -> Response:
+    """Respuesta 304 sin cuerpo"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL_REVALIDAR}
+    )
+
+
+def agregar_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL_REVALIDAR
@@ -0,0 +1,224 @@
+# importar_usuarios.py
+# Alta masiva de usuarios desde un archivo CSV o JSON
+
+import os
+import io
+import csv
+import json
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from pydantic import ValidationError
+from sqlalchemy import select, insert, or_, func
+from dotenv import load_dotenv
+
+from models import Usuario
+from schemas import UserCreate, LogAccesoCreate
+from security import check_permission, get_password_hash, ROLES
+from database import get_unidad_trabajo, UnidadDeTrabajo
+from audit_utils import log_audit_action
+from email_service import email_service
+from email_outbox import encolar_emails
+from auth import generate_random_password, log_access
+
+load_dotenv()
+
+router = APIRouter(prefix="/auth", tags=["Autenticación"])
+
+# Filas máximas por archivo
+IMPORTACION_MAX_FILAS = int(os.getenv("IMPORTACION_MAX_FILAS", "5000"))
+# Usuarios por INSERT
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", "500"))
+# Procesos para calcular los hashes bcrypt (0 = uno por CPU)
+IMPORTACION_PROCESOS = int(os.getenv("IMPORTACION_PROCESOS", "0"))
+
+COLUMNAS_IMPORTACION = ("username", "email", "nombre_completo", "rol")
+
+# Pool de procesos creado al primer uso; bcrypt es CPU puro y en el event loop bloquearía el servidor
+_pool_hash: Optional[ProcessPoolExecutor] = None
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool_hash
+    if _pool_hash is None:
+        # spawn: no se hereda el estado (hilos, conexiones) del proceso del servidor
+        _pool_hash = ProcessPoolExecutor(
+            max_workers=IMPORTACION_PROCESOS or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool_hash
+
+
+def cerrar_pool_hash():
+    global _pool_hash
+    if _pool_hash is not None:
+        _pool_hash.shutdown(wait=False, cancel_futures=True)
+        _pool_hash = None
+
+
+async def calcular_hashes(passwords: List[str]) -> List[str]:
+    """Hashes bcrypt de las contraseñas, repartidos entre los procesos del pool"""
+    loop = asyncio.get_running_loop()
+    pool = _obtener_pool()
+    return await asyncio.gather(*[loop.run_in_executor(pool, get_password_hash, p) for p in passwords])
+
+
+def leer_filas(nombre: str, contenido: bytes) -> List[Dict[str, Any]]:
+    """Filas del archivo: CSV con encabezado o JSON con una lista de objetos"""
+    texto = contenido.decode("utf-8-sig")
+    if nombre.lower().endswith(".json"):
+        filas = json.loads(texto)
+        if not isinstance(filas, list) or not all(isinstance(f, dict) for f in filas):
+            raise ValueError("El JSON debe ser una lista de objetos")
+        return filas
+    if nombre.lower().endswith(".csv"):
+        return list(csv.DictReader(io.StringIO(texto)))
+    raise ValueError("Formato no soportado: use un archivo .csv o .json")
+
+
+def validar_filas(filas: List[Dict[str, Any]]):
+    """Valida todas las filas y retorna (usuarios válidos, errores por fila)"""
+    usuarios: List[UserCreate] = []
+    errores = []
+    usernames, emails = set(), set()
+    for numero, fila in enumerate(filas, start=1):
+        # En un JSON los valores pueden ser números, listas, etc.
+        no_texto = [
+            clave for clave in COLUMNAS_IMPORTACION
+            if fila.get(clave) is not None and not isinstance(fila[clave], str)
+        ]
+        if no_texto:
+            errores.append({"fila": numero, "error": f"Deben ser texto: {', '.join(no_texto)}"})
+            continue
+        datos = {clave: (fila.get(clave) or "").strip() for clave in COLUMNAS_IMPORTACION}
+        datos["rol"] = datos["rol"] or "user"
+        try:
+            usuario = UserCreate(**datos)
+        except ValidationError as e:
+            errores.append({"fila": numero, "error": "; ".join(err["msg"] for err in e.errors())})
+            continue
+        if usuario.rol not in ROLES:
+            errores.append({"fila": numero, "error": f"Rol inválido: {usuario.rol}"})
+        elif usuario.username.lower() in usernames:
+            errores.append({"fila": numero, "error": f"Usuario repetido en el archivo: {usuario.username}"})
+        elif usuario.email.lower() in emails:
+            errores.append({"fila": numero, "error": f"Email repetido en el archivo: {usuario.email}"})
+        else:
+            usernames.add(usuario.username.lower())
+            emails.add(usuario.email.lower())
+            usuarios.append(usuario)
+    return usuarios, errores
+
+
+@router.post("/users/importar")
+async def importar_usuarios(
+    archivo: UploadFile = File(...),
+    simular: bool = False,
+    current_user: dict = Depends(check_permission("manage_users")),
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
+):
+    """
+    Crea usuarios en bloque desde un CSV (username, email, nombre_completo,
+    rol) o un JSON con la misma estructura. Primero se validan todas las
+    filas y se buscan duplicados en una sola consulta; si hay algún error no
+    se crea ningún usuario. Con `simular=true` solo se valida.
+    Solo administradores (permiso 'manage_users') pueden acceder.
+    """
+    session = unidad.session
+    try:
+        filas = leer_filas(archivo.filename or "", await archivo.read())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Archivo inválido: {e}")
+    if not filas:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El archivo no contiene usuarios")
+    if len(filas) > IMPORTACION_MAX_FILAS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El archivo supera el máximo de {IMPORTACION_MAX_FILAS} usuarios"
+        )
+
+    usuarios, errores = validar_filas(filas)
+
+    # Usuarios o emails ya registrados, en una sola consulta y sin distinguir
+    # mayúsculas, igual que la comprobación dentro del archivo
+    if usuarios:
+        result = await session.execute(
+            select(func.lower(Usuario.username), func.lower(Usuario.email)).where(or_(
+                func.lower(Usuario.username).in_([u.username.lower() for u in usuarios]),
+                func.lower(Usuario.email).in_([u.email.lower() for u in usuarios])
+            ))
+        )
+        existentes = result.all()
+        usernames = {username for username, _ in existentes}
+        emails = {email for _, email in existentes}
+        for usuario in usuarios:
+            if usuario.username.lower() in usernames or usuario.email.lower() in emails:
+                errores.append({"usuario": usuario.username, "error": "El usuario o email ya existe"})
+
+    if errores:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"mensaje": "No se importó ningún usuario", "errores": errores}
+        )
+    if simular:
+        return {"message": "Archivo válido", "total": len(usuarios)}
+
+    passwords = [generate_random_password() for _ in usuarios]
+    hashes = await calcular_hashes(passwords)
+
+    # Inserción en lotes (un INSERT de varias filas por lote)
+    creados = []
+    for inicio in range(0, len(usuarios), IMPORTACION_LOTE):
+        lote = usuarios[inicio:inicio + IMPORTACION_LOTE]
+        result = await session.execute(
+            insert(Usuario).returning(Usuario.id, Usuario.username),
+            [
+                {
+                    "username": u.username,
+                    "email": u.email,
+                    "hashed_password": h,
+                    "nombre_completo": u.nombre_completo,
+                    "rol": u.rol,
+                    "creado_por": current_user["user_id"],
+                }
+                for u, h in zip(lote, hashes[inicio:inicio + IMPORTACION_LOTE])
+            ]
+        )
+        creados.extend(result.all())
+
+    await log_access(session, LogAccesoCreate(
+        usuario_id=current_user["user_id"],
+        username=current_user["sub"],
+        accion="import_users",
+        detalles={"mensaje": f"Usuarios importados: {len(creados)}"}
+    ))
+    # Un solo registro de auditoría para toda la importación
+    await log_audit_action(
+        session=session,
+        username=current_user["sub"],
+        user_id=current_user["user_id"],
+        action="create",
+        table="usuarios",
+        new_data={
+            "total": len(creados),
+            "archivo": archivo.filename,
+            "usuarios": [{"id": fila.id, "username": fila.username} for fila in creados],
+        },
+        details=f"Importación masiva: {len(creados)} usuarios creados desde {archivo.filename}"
+    )
+
+    # Emails de bienvenida a la bandeja de salida, en la misma transacción que la importación
+    await encolar_emails(session, [
+        (u.email, *email_service.welcome_content(u.username, p, u.rol), True)
+        for u, p in zip(usuarios, passwords)
+    ])
+    await unidad.confirmar()
+
+    return {
+        "message": f"{len(creados)} usuarios importados exitosamente",
+        "total": len(creados),
+        "usuarios": [{"id": fila.id, "username": fila.username} for fila in creados],
+    }
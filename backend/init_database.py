@@ -12,6 +12,8 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text, select
 from models import Base, Usuario, Rol, Permiso, ParametroSistema, ConfiguracionEmail
 from security import get_password_hash
+from backup_engine import instalar_seguimiento_eliminaciones
+from busqueda_usuarios import instalar_busqueda_usuarios
 from datetime import datetime, timedelta
 
 # Cargar variables de entorno desde .env
@@ -32,6 +34,22 @@ async def init_database():
     async with engine.begin() as conn:
         await conn.execute(text("CREATE SCHEMA IF NOT EXISTS sistema"))
         await conn.run_sync(Base.metadata.create_all)
+        # create_all no agrega índices nuevos a tablas ya existentes
+        await conn.run_sync(
+            lambda sync_conn: [indice.create(sync_conn, checkfirst=True) for indice in Usuario.__table__.indexes]
+        )
+        # Ni columnas nuevas: cuerpo cifrado de los emails en dead letter
+        await conn.execute(text(
+            "ALTER TABLE sistema.email_outbox ADD COLUMN IF NOT EXISTS cuerpo_cifrado boolean DEFAULT false"
+        ))
+        # Autocompletado y búsqueda de usuarios sin acentos (sistema.f_unaccent + índice GiST de trigramas)
+        await instalar_busqueda_usuarios(conn)
+        # Los índices GIN por columna quedaron reemplazados por el GiST anterior
+        for columna in ("username", "email", "nombre_completo"):
+            await conn.execute(text(f"DROP INDEX IF EXISTS sistema.ix_usuarios_{columna}_trgm"))
+        # Triggers de seguimiento de eliminaciones para backups incrementales
+        tablas = await instalar_seguimiento_eliminaciones(conn)
+        print(f"Seguimiento de eliminaciones instalado en {tablas} tablas")
     
     # Crear sesión
     async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -263,6 +281,33 @@ async def init_database():
                     categoria="sistema",
                     editable=True
                 ),
+                ParametroSistema(
+                    codigo="BACKUP_CRON",
+                    nombre="Programación del backup automático",
+                    valor="0 2 * * *",
+                    tipo="string",
+                    descripcion="Expresión cron (minuto hora día mes día-semana) del backup automático; vacío lo desactiva",
+                    categoria="sistema",
+                    editable=True
+                ),
+                ParametroSistema(
+                    codigo="BACKUP_CRON_TIPO",
+                    nombre="Tipo del backup automático",
+                    valor="completo",
+                    tipo="string",
+                    descripcion="Tipo del backup automático: completo, incremental o diferencial",
+                    categoria="sistema",
+                    editable=True
+                ),
+                ParametroSistema(
+                    codigo="BACKUP_RETENTION_CRON",
+                    nombre="Programación de la retención de backups",
+                    valor="30 3 * * *",
+                    tipo="string",
+                    descripcion="Expresión cron de la limpieza de backups expirados; vacío la desactiva",
+                    categoria="sistema",
+                    editable=True
+                ),
             ]
             
             for parametro in parametros:
@@ -20,6 +20,8 @@ proporcionando funcionalidades core como:
 # ============================================
 import os
 import json
+import time
+import asyncio
 import shutil
 import tempfile
 import zipfile
@@ -30,7 +32,7 @@ from typing import List, Dict, Any, Optional
 # 2. IMPORTACIONES DE TERCEROS
 # ============================================
 from fastapi import FastAPI, HTTPException, Depends, Response, status, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
@@ -47,7 +49,7 @@ from dotenv import load_dotenv
 # ============================================
 # Modelos de base de datos
 from models import (
-    Base, Usuario, Rol, Permiso, LogAuditoria, LogAcceso, SesionUsuario
+    Base, Usuario, Rol, Permiso, LogAuditoria, LogAcceso, SesionUsuario, BackupSistema
 )
 
 # Esquemas Pydantic
@@ -61,6 +63,29 @@ from security import check_permission, check_database_permission, get_current_us
 # Utilidades de auditoría
 from audit_utils import log_audit_action, log_activity, get_client_ip, get_user_agent
 
+# Usuario autenticado (una consulta como máximo por petición)
+from usuario_actual import get_usuario_actual
+from cache_bus import bus_invalidacion
+
+# Bandeja de salida de emails
+from email_outbox import repartidor_emails, reintentar_fallidos
+from email_service import email_service
+
+# Servicio de backups
+from backup_service import ejecutar_backup
+from backup_engine import reflejar_tabla_exportable, exportar_tabla_ndjson
+from backup_repositorio import repositorio_backups, aplicar_retencion
+
+# Planificador de tareas periódicas (backup nocturno y retención)
+from scheduler import planificador
+
+# Limitación de recursos de los backups
+from backup_throttle import control_backup
+
+# Instrumentación de SQL por petición
+from sql_metricas import MetricasSQL, metricas_sql, avisar_si_excede
+from consultas_lentas import registro_consultas_lentas, SQL_UMBRAL_LENTA_MS
+
 # ============================================
 # 4. CONFIGURACIÓN INICIAL
 # ============================================
@@ -71,7 +96,11 @@ load_dotenv()
 PORT = int(os.getenv("PORT", "8001"))
 
 # Importar configuración de base de datos desde el nuevo módulo
-from database import engine, SessionLocal, get_session
+from database import (
+    engine, SessionLocal, get_session, get_read_session, motor_lectura, replica_engines,
+    COOKIE_LEER_PRIMARIO, DB_LEER_ESCRITURAS_S
+)
+from pool_metricas import estado_pool
 
 # ============================================
 # 5. INICIALIZACIÓN DE FASTAPI
@@ -96,7 +125,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "ETag", "Accept-Ranges", "Content-Range", "X-Backup-Id", "Server-Timing", "X-Next-Cursor"],
     max_age=600
 )
 
@@ -106,6 +135,81 @@ app.add_middleware(
 
 # El get_session se ha movido a database.py
 
+# Rutas de backups, que no cuentan como tráfico interactivo
+RUTAS_BACKUP = ("/system/backup", "/system/restore", "/backup", "/debug")
+
+@app.middleware("http")
+async def medir_latencia_interactiva(request: Request, call_next):
+    """Mide la latencia de las peticiones interactivas para adaptar el ritmo de los backups"""
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    if not request.url.path.startswith(RUTAS_BACKUP):
+        control_backup.monitor.registrar((time.perf_counter() - inicio) * 1000)
+    return response
+
+@app.middleware("http")
+async def marcar_lectura_primario(request: Request, call_next):
+    """
+    Tras una escritura exitosa marca al cliente para que durante unos segundos
+    sus lecturas vayan al primario y vea sus cambios aunque la réplica tenga retraso.
+    """
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400 and replica_engines:
+        response.set_cookie(
+            COOKIE_LEER_PRIMARIO, "1", max_age=DB_LEER_ESCRITURAS_S, httponly=True, samesite="lax"
+        )
+    return response
+
+@app.middleware("http")
+async def instrumentar_sql(request: Request, call_next):
+    """
+    Cuenta las sentencias, el tiempo en base de datos y los commits de la
+    petición y los devuelve en la cabecera Server-Timing. En respuestas en
+    streaming solo se cuenta lo ejecutado antes de enviar las cabeceras.
+    """
+    metricas = MetricasSQL(request.method, request.url.path)
+    token = metricas_sql.set(metricas)
+    inicio = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metricas_sql.reset(token)
+    response.headers["Server-Timing"] = metricas.server_timing((time.perf_counter() - inicio) * 1000)
+    avisar_si_excede(metricas, request.method, request.url.path)
+    return response
+
+@app.on_event("startup")
+async def iniciar_planificador():
+    """Arranca el planificador; solo un proceso del cluster ejecuta cada tarea"""
+    planificador.iniciar()
+
+@app.on_event("shutdown")
+async def detener_planificador():
+    await planificador.detener()
+
+@app.on_event("startup")
+async def iniciar_bus_invalidacion():
+    """Escucha los avisos de invalidación de cachés publicados por cualquier proceso"""
+    bus_invalidacion.iniciar()
+
+@app.on_event("shutdown")
+async def detener_bus_invalidacion():
+    await bus_invalidacion.detener()
+
+@app.on_event("startup")
+async def iniciar_repartidor_emails():
+    """Envía en segundo plano los emails de la bandeja de salida"""
+    repartidor_emails.iniciar()
+
+@app.on_event("shutdown")
+async def detener_repartidor_emails():
+    await repartidor_emails.detener()
+    await email_service.pool.cerrar()
+
+@app.on_event("shutdown")
+async def cerrar_motores_explain():
+    await registro_consultas_lentas.cerrar()
+
 # ============================================
 # 7. INCLUSIÓN DE ROUTERS EXTERNOS
 # ============================================
@@ -115,6 +219,10 @@ from reactivate_user import router as reactivate_user_router
 from delete_user_physical import router as delete_user_physical_router
 from notify_admin_password_reset import router as notify_admin_password_reset_router
 from resend_user_password import router as resend_user_password_router
+from importar_usuarios import router as importar_usuarios_router, cerrar_pool_hash
+from operaciones_usuarios import router as operaciones_usuarios_router
+from restore_backup import router as restore_backup_router
+from backup_descargas import router as backup_descargas_router, respuesta_archivo_backup
 
 # Montar los routers en la aplicación
 app.include_router(auth_router)
@@ -122,6 +230,15 @@ app.include_router(reactivate_user_router)
 app.include_router(delete_user_physical_router)
 app.include_router(notify_admin_password_reset_router)
 app.include_router(resend_user_password_router)
+app.include_router(importar_usuarios_router)
+app.include_router(operaciones_usuarios_router)
+app.include_router(restore_backup_router)
+app.include_router(backup_descargas_router)
+
+@app.on_event("shutdown")
+def cerrar_procesos_importacion():
+    """Termina los procesos usados para calcular hashes en las importaciones de usuarios"""
+    cerrar_pool_hash()
 
 
 
@@ -130,7 +247,7 @@ app.include_router(resend_user_password_router)
 # ============================================
 @app.get("/auditoria/logs", summary="Obtener logs de auditoría")
 async def obtener_logs_auditoria(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: dict = Depends(check_permission("auditoria_read")),
     limit: int = 100,
     offset: int = 0,
@@ -184,7 +301,7 @@ async def obtener_logs_auditoria(
 @app.get("/auditoria/logs/{log_id}", summary="Obtener log de auditoría específico", response_model=LogAuditoriaResponse)
 async def obtener_log_auditoria(
     log_id: int,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: dict = Depends(check_permission("auditoria_read"))
 ):
     """
@@ -202,7 +319,7 @@ async def obtener_log_auditoria(
 
 @app.get("/auditoria/accesos", summary="Obtener logs de acceso", response_model=List[LogAccesoResponse])
 async def obtener_logs_acceso(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: dict = Depends(check_permission("auditoria_read")),
     limit: int = 100,
     offset: int = 0,
@@ -231,7 +348,7 @@ async def obtener_logs_acceso(
 
 @app.get("/auditoria/sesiones", summary="Obtener sesiones de usuarios", response_model=List[SesionUsuarioResponse])
 async def obtener_sesiones_usuarios(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     current_user: dict = Depends(check_permission("auditoria_read")),
     limit: int = 100,
     offset: int = 0,
@@ -266,31 +383,18 @@ async def obtener_sesiones_usuarios(
 async def crear_backup_tabla(
     table_name: str,
     session: AsyncSession = Depends(get_session),
-    current_user: dict = Depends(check_database_permission("sistema_backup"))
+    current_user: dict = Depends(check_database_permission("sistema_backup")),
+    user: Usuario = Depends(get_usuario_actual)
 ):
     """
-    Crea un backup de una tabla específica.
+    Crea un backup de una tabla de 'public' o 'sistema' (nombre simple o
+    'esquema.tabla') y lo envía como NDJSON en streaming, sin cargar la tabla
+    en memoria. Las columnas con contraseñas y tokens no se exportan.
     Solo usuarios con permiso 'sistema_backup' pueden acceder.
     """
-    import json
-    from datetime import datetime
     
     # Verificar permisos desde la base de datos
     try:
-        from models import Usuario
-        from sqlalchemy import select
-        
-        result = await session.execute(
-            select(Usuario).where(Usuario.username == current_user.get("sub"))
-        )
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Usuario no encontrado"
-            )
-        
         # Verificar si el usuario tiene el permiso sistema_backup
         result = await session.execute(
             text("""
@@ -323,74 +427,58 @@ async def crear_backup_tabla(
             detail="Error interno del servidor"
         )
     
-    # Validar tabla permitida
-    tablas_permitidas = [
-        "usuarios", "logs_auditoria", "parametros_sistema", "roles", "permisos"
-    ]
-    
-    if table_name not in tablas_permitidas:
-        raise HTTPException(status_code=400, detail=f"Tabla '{table_name}' no permitida para backup")
-    
+    # Reflejar la tabla (solo tablas permitidas de 'public' y 'sistema')
+    motor = await motor_lectura()
     try:
-        # Obtener datos de la tabla
-        if table_name == "usuarios":
-            from models import Usuario
-            result = await session.execute(select(Usuario))
-            data = [{"id": item.id, "username": item.username, "email": item.email, "nombre_completo": item.nombre_completo, "rol": item.rol, "activo": item.activo, "fecha_creacion": str(item.fecha_creacion) if item.fecha_creacion else None, "ultimo_acceso": str(item.ultimo_acceso) if item.ultimo_acceso else None} for item in result.scalars().all()]
-        elif table_name == "logs_auditoria":
-            from models import LogAuditoria
-            result = await session.execute(select(LogAuditoria))
-            data = [{"id": item.id, "usuario_id": item.usuario_id, "username": item.username, "accion": item.accion, "tabla": item.tabla, "registro_id": item.registro_id, "datos_anteriores": item.datos_anteriores, "datos_nuevos": item.datos_nuevos, "ip_address": item.ip_address, "user_agent": item.user_agent, "fecha": str(item.fecha), "detalles": item.detalles} for item in result.scalars().all()]
-        elif table_name == "parametros_sistema":
-            from models import ParametroSistema
-            result = await session.execute(select(ParametroSistema))
-            data = [{"id": item.id, "codigo": item.codigo, "nombre": item.nombre, "valor": item.valor, "tipo": item.tipo, "descripcion": item.descripcion, "categoria": item.categoria, "editable": item.editable, "fecha_creacion": str(item.fecha_creacion) if item.fecha_creacion else None} for item in result.scalars().all()]
-        elif table_name == "roles":
-            from models import Rol
-            result = await session.execute(select(Rol))
-            data = [{"id": item.id, "nombre": item.nombre, "descripcion": item.descripcion, "activo": item.activo, "fecha_creacion": str(item.fecha_creacion) if item.fecha_creacion else None} for item in result.scalars().all()]
-        elif table_name == "permisos":
-            from models import Permiso
-            result = await session.execute(select(Permiso))
-            data = [{"id": item.id, "nombre": item.nombre, "descripcion": item.descripcion, "modulo": item.modulo, "accion": item.accion, "activo": item.activo, "fecha_creacion": str(item.fecha_creacion) if item.fecha_creacion else None} for item in result.scalars().all()]
-        
-        # Crear estructura del backup
-        backup_data = {
-            "tabla": table_name,
-
-            "fecha_backup": datetime.utcnow().isoformat(),
-            "usuario_backup": current_user["sub"],
-            "total_registros": len(data),
-            "datos": data
+        async with motor.connect() as conn:
+            tabla = await reflejar_tabla_exportable(conn, table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    nombre_tabla = f"{tabla.schema}.{tabla.name}"
+    fecha = datetime.now()
+    username = current_user["sub"]
+    user_id = current_user["user_id"]
+
+    async def contenido():
+        # Las filas se leen con un cursor de servidor en una conexión propia;
+        # la auditoría se registra al terminar, en su propia sesión
+        resumen = {"registros": 0}
+        completo = False
+        try:
+            async for bloque in exportar_tabla_ndjson(motor, tabla, resumen):
+                yield bloque
+            completo = True
+        finally:
+            try:
+                async with SessionLocal() as audit_session:
+                    await log_audit_action(
+                        session=audit_session,
+                        username=username,
+                        user_id=user_id,
+                        action="export",
+                        table="backup",
+                        new_data={"tabla_backup": nombre_tabla, "total_registros": resumen["registros"], "completo": completo},
+                        details=f"Backup creado para tabla {nombre_tabla} con {resumen['registros']} registros"
+                        + ("" if completo else " (interrumpido)")
+                    )
+            except Exception as e:
+                print(f"❌ Error registrando auditoría del backup de {nombre_tabla}: {e}")
+
+    # Retornar NDJSON (un registro por línea) como archivo descargable
+    return StreamingResponse(
+        contenido(),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f"attachment; filename=backup_{tabla.name}_{fecha.strftime('%Y%m%d_%H%M%S')}.ndjson"
         }
-        
-        # Registrar log de auditoría
-        await log_audit_action(
-            session=session,
-            username=current_user["sub"],
-            user_id=current_user["user_id"],
-            action="export",
-            table="backup",
-            new_data={"tabla_backup": table_name, "total_registros": len(data)},
-            details=f"Backup creado para tabla {table_name} con {len(data)} registros"
-        )
-        
-        # Retornar JSON como archivo descargable
-        return JSONResponse(
-            content=backup_data,
-            headers={
-                "Content-Disposition": f"attachment; filename=backup_{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            }
-        )
-        
-    except Exception as e:
-        print(f"Error al crear backup de {table_name}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al crear backup de {table_name}: {str(e)}")
+    )
 
 @app.post("/debug/backup-test", summary="Endpoint de prueba para backup")
 async def test_backup(
     session: AsyncSession = Depends(get_session),
-    current_user: dict = Depends(check_database_permission("sistema_backup"))
+    current_user: dict = Depends(check_database_permission("sistema_backup")),
+    user: Usuario = Depends(get_usuario_actual)
 ):
     """
     Endpoint de prueba para verificar que el sistema funciona
@@ -401,19 +489,6 @@ async def test_backup(
     
     try:
         # Verificar permisos manualmente
-        from models import Usuario
-        from sqlalchemy import select
-        
-        print("Buscando usuario en base de datos...")
-        result = await session.execute(
-            select(Usuario).where(Usuario.username == current_user.get("sub"))
-        )
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            print("❌ Usuario no encontrado")
-            return {"error": "Usuario no encontrado"}
-        
         print(f"✅ Usuario encontrado: {user.username} (ID: {user.id})")
         
         # Verificar permisos
@@ -571,11 +646,22 @@ async def raw_debug_post():
 
 @app.post("/system/backup", summary="Crear backup completo del sistema")
 async def crear_backup_completo(
+    request: Request,
     session: AsyncSession = Depends(get_session),
-    current_user: dict = Depends(check_database_permission("sistema_backup"))
+    current_user: dict = Depends(check_database_permission("sistema_backup")),
+    user: Usuario = Depends(get_usuario_actual),
+    tipo: str = "completo",
+    formato: str = "json",
+    compresion: Optional[str] = None,
+    nivel: Optional[int] = None
 ):
     """
-    Crea un backup completo de todas las tablas del sistema.
+    Crea un backup de todas las tablas del sistema.
+    - completo: todas las filas
+    - incremental: cambios desde el último backup (de cualquier tipo)
+    - diferencial: cambios desde el último backup completo
+    El formato puede ser json (compatibilidad) o csv/binary (COPY de PostgreSQL).
+    La compresión puede ser store, deflate, xz o zstd, con su nivel opcional.
     Solo usuarios con permiso 'sistema_backup' pueden acceder.
     """
     import json
@@ -589,22 +675,6 @@ async def crear_backup_completo(
     
     # Verificar permisos desde la base de datos
     try:
-        from models import Usuario
-        from sqlalchemy import select
-        
-        print("Buscando usuario en base de datos...")
-        result = await session.execute(
-            select(Usuario).where(Usuario.username == current_user.get("sub"))
-        )
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            print("❌ Usuario no encontrado")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Usuario no encontrado"
-            )
-        
         print(f"✅ Usuario encontrado: {user.username} (ID: {user.id})")
         
         # Verificar si el usuario tiene el permiso sistema_backup
@@ -650,88 +720,21 @@ async def crear_backup_completo(
         print(f"Directorio temporal creado: {temp_dir}")
         
         try:
-            # Obtener todas las tablas de los esquemas 'public' y 'sistema'
-            print("Descubriendo tablas en schemas 'public' y 'sistema'...")
-            tables_query = text("""
-                SELECT table_schema, table_name 
-                FROM information_schema.tables 
-                WHERE table_schema IN ('public', 'sistema') 
-                AND table_type = 'BASE TABLE'
-                ORDER BY table_schema, table_name;
-            """)
-            result = await session.execute(tables_query)
-            all_tables = result.fetchall()
-            print(f"Se encontraron {len(all_tables)} tablas para respaldar")
-            
-            tablas_procesadas = []
-            
-            for schema, tabla in all_tables:
-                try:
-                    print(f"Procesando tabla: {schema}.{tabla}")
-                    
-                    # Ejecutar consulta SQL para obtener todos los datos
-                    query = text(f'SELECT * FROM "{schema}"."{tabla}"')
-                    result = await session.execute(query)
-                    rows = result.fetchall()
-                    keys = result.keys()
-                    
-                    # Convertir a lista de diccionarios
-                    data = []
-                    for row in rows:
-                        row_dict = {}
-                        for i, column in enumerate(keys):
-                            value = row[i]
-                            # Manejo de tipos especiales para JSON
-                            if value is not None:
-                                if isinstance(value, (datetime, date)):
-                                    row_dict[column] = value.isoformat()
-                                elif hasattr(value, '__str__') and not isinstance(value, (int, float, bool, str, list, dict)):
-                                    row_dict[column] = str(value)
-                                else:
-                                    row_dict[column] = value
-                            else:
-                                row_dict[column] = None
-                        data.append(row_dict)
-                    
-                    # Guardar datos en archivo JSON (un archivo por schema_tabla)
-                    filename = f"{schema}_{tabla}.json"
-                    tabla_file = os.path.join(temp_dir, filename)
-                    with open(tabla_file, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
-                    
-                    tablas_procesadas.append(f"{schema}.{tabla}")
-                    print(f"✅ Tabla {schema}.{tabla} procesada: {len(data)} registros")
-                        
-                except Exception as e:
-                    print(f"❌ Error procesando tabla {schema}.{tabla}: {e}")
-                    continue
-            
-            # Crear archivo de metadatos
-            print("Creando archivo de metadatos...")
-            metadata = {
-                "fecha_backup": datetime.utcnow().isoformat(),
-                "usuario_backup": current_user["sub"],
-                "sistema": "Sistema de Gestión de Información",
-                "version": "1.0.0",
-                "tablas_incluidas": tablas_procesadas,
-                "total_tablas": len(tablas_procesadas),
-                "notas": "Backup completo de esquemas public y sistema"
-            }
-            
-            metadata_file = os.path.join(temp_dir, "metadata.json")
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
-            
-            # Crear archivo ZIP
-            print("Creando archivo ZIP...")
-            zip_filename = f"backup_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            zip_path = os.path.join(temp_dir, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for filename in os.listdir(temp_dir):
-                    if filename.endswith('.json'):
-                        zipf.write(os.path.join(temp_dir, filename), filename)
-            
-            print(f"✅ Archivo ZIP creado: {zip_path}")
+            # Volcar las tablas de 'public' y 'sistema' desde un mismo snapshot
+            # (solo los cambios desde la base si el backup es incremental o diferencial)
+            print(f"Ejecutando backup {tipo} de schemas 'public' y 'sistema'...")
+            registro, archivo_path, metadata = await ejecutar_backup(
+                session,
+                username=current_user["sub"],
+                user_id=current_user["user_id"],
+                dest_dir=temp_dir,
+                tipo=tipo,
+                formato=formato,
+                compresion=compresion,
+                nivel=nivel
+            )
+            tablas_procesadas = metadata["tablas_incluidas"]
+            print(f"✅ Archivo de backup creado: {archivo_path} (snapshot {metadata['snapshot']})")
             
             # Registrar log de auditoría
             print("Registrando log de auditoría...")
@@ -741,29 +744,19 @@ async def crear_backup_completo(
                 user_id=current_user["user_id"],
                 action="export",
                 table="backup",
-                new_data={"tipo_backup": "completo", "total_tablas": len(tablas_procesadas)},
-                details=f"Backup completo realizado ({len(tablas_procesadas)} tablas de public y sistema)"
+                record_id=registro.id,
+                new_data={"tipo_backup": tipo, "formato": formato, "compresion": metadata["compresion"], "total_tablas": len(tablas_procesadas), "base_id": metadata["base_id"]},
+                details=f"Backup {tipo} realizado ({len(tablas_procesadas)} tablas de public y sistema)"
             )
             
-            # Leer el archivo ZIP y retornarlo
-            print("Leyendo archivo ZIP para respuesta...")
-            with open(zip_path, 'rb') as f:
-                zip_content = f.read()
-            
-            print(f"✅ Archivo ZIP leído: {len(zip_content)} bytes")
-            
-            # Limpiar archivos temporales
+            # Limpiar archivos temporales (el archivo final queda guardado en BACKUP_DIR)
             print("Limpiando archivos temporales...")
             shutil.rmtree(temp_dir, ignore_errors=True)
             
+            # El archivo se envía desde disco; si la descarga se corta puede
+            # reanudarse en /system/backups/{id}/descargar sin repetir el backup
             print("✅ BACKUP COMPLETADO EXITOSAMENTE")
-            return Response(
-                content=zip_content,
-                media_type="application/zip",
-                headers={
-                    "Content-Disposition": f"attachment; filename={zip_filename}"
-                }
-            )
+            return respuesta_archivo_backup(request, registro)
             
         except Exception as e:
             print(f"❌ Error durante el procesamiento: {e}")
@@ -772,6 +765,8 @@ async def crear_backup_completo(
                 shutil.rmtree(temp_dir, ignore_errors=True)
             raise e
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error al crear backup completo: {e}")
         print(f"Tipo de error: {type(e)}")
@@ -779,6 +774,84 @@ async def crear_backup_completo(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error al crear backup completo: {str(e)}")
 
+@app.get("/system/backup/repositorio", summary="Estado del repositorio de backups")
+async def estado_repositorio_backups(
+    current_user: dict = Depends(check_permission("sistema_backup"))
+):
+    """
+    Muestra el número de fragmentos y el espacio en disco del repositorio
+    deduplicado de backups.
+    """
+    estadisticas = await asyncio.to_thread(repositorio_backups.estadisticas)
+    return {"directorio": repositorio_backups.directorio, **estadisticas}
+
+@app.get("/system/backup/programacion", summary="Programación de tareas de backup")
+async def programacion_backups(
+    session: AsyncSession = Depends(get_session),
+    current_user: dict = Depends(check_permission("sistema_backup"))
+):
+    """
+    Muestra las tareas programadas de este proceso (expresión cron y próxima
+    ejecución) y las últimas ejecuciones registradas en el historial.
+    """
+    result = await session.execute(
+        select(BackupSistema)
+        .where(BackupSistema.detalles["tarea"].as_string().isnot(None))
+        .order_by(desc(BackupSistema.fecha_inicio))
+        .limit(20)
+    )
+    return {
+        **planificador.estado(),
+        "historial": [
+            {
+                "id": b.id,
+                "tarea": b.detalles.get("tarea"),
+                "programada": b.detalles.get("programada"),
+                "tipo": b.tipo,
+                "estado": b.estado,
+                "fecha_inicio": b.fecha_inicio,
+                "fecha_fin": b.fecha_fin,
+            }
+            for b in result.scalars().all()
+        ],
+    }
+
+@app.get("/system/backup/limites", summary="Estado de la limitación de backups")
+async def limites_backup(
+    current_user: dict = Depends(check_permission("sistema_backup"))
+):
+    """
+    Muestra los límites vigentes de los backups (filas/s, bytes/s y
+    conexiones) y el p95 de las peticiones interactivas que los ajusta.
+    """
+    return control_backup.estado()
+
+@app.post("/system/backup/retencion", summary="Aplicar retención de backups")
+async def aplicar_retencion_backups(
+    session: AsyncSession = Depends(get_session),
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """
+    Expira los backups más antiguos que el parámetro BACKUP_RETENTION_DAYS y
+    elimina del repositorio los fragmentos que ya no referencia ningún backup.
+    Solo usuarios con permiso 'sistema_config' pueden acceder.
+    """
+    try:
+        resultado = await aplicar_retencion(session)
+        await log_audit_action(
+            session=session,
+            username=current_user["sub"],
+            user_id=current_user["user_id"],
+            action="delete",
+            table="backup",
+            new_data=resultado,
+            details=f"Retención de backups: {len(resultado['backups_expirados'])} expirados, {resultado['chunks_eliminados']} fragmentos eliminados"
+        )
+        return resultado
+    except Exception as e:
+        print(f"❌ Error al aplicar la retención de backups: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al aplicar la retención de backups: {str(e)}")
+
 
 
 # ============================================
@@ -795,3 +868,76 @@ async def health_check():
     """
     return {"status": "ok"}
 
+@app.get("/system/db/pool", summary="Estado del pool de conexiones")
+async def estado_pool_conexiones(
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """
+    Muestra la configuración del pool, las conexiones en uso y libres, los
+    checkouts en espera y el histograma de tiempos de espera por conexión.
+    Solo administradores (permiso 'sistema_config') pueden acceder.
+    """
+    return {
+        **estado_pool(engine.pool),
+        "replicas": [estado_pool(replica.pool) for replica in replica_engines],
+    }
+
+@app.post("/system/db/pool/reiniciar-metricas", summary="Reiniciar métricas del pool")
+async def reiniciar_metricas_pool(
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """Pone a cero los contadores acumulados del pool para medir un nuevo periodo de carga"""
+    engine.pool.metricas.reiniciar()
+    return {"message": "Métricas del pool reiniciadas"}
+
+@app.get("/system/db/consultas-lentas", summary="Consultas lentas recientes")
+async def listar_consultas_lentas(
+    limite: int = 50,
+    ruta: Optional[str] = None,
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """
+    Devuelve las últimas sentencias que superaron SQL_UMBRAL_LENTA_MS, de la
+    más reciente a la más antigua, con sus parámetros, la ruta y el usuario de
+    la petición y el plan de ejecución (EXPLAIN) cuando ya está disponible.
+    Solo administradores (permiso 'sistema_config') pueden acceder.
+    """
+    return {
+        "umbral_ms": SQL_UMBRAL_LENTA_MS,
+        "consultas": registro_consultas_lentas.listar(limite, ruta),
+    }
+
+@app.delete("/system/db/consultas-lentas", summary="Vaciar el registro de consultas lentas")
+async def vaciar_consultas_lentas(
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """Descarta las consultas lentas registradas y los planes guardados"""
+    registro_consultas_lentas.limpiar()
+    return {"message": "Registro de consultas lentas vaciado"}
+
+@app.get("/system/emails", summary="Estado de la bandeja de salida de emails")
+async def estado_bandeja_emails(
+    session: AsyncSession = Depends(get_session),
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """
+    Cuenta los emails por estado (pendiente, enviando, enviado, fallido) y
+    muestra los últimos que agotaron los reintentos con su error.
+    Solo administradores (permiso 'sistema_config') pueden acceder.
+    """
+    return await repartidor_emails.estado(session)
+
+@app.post("/system/emails/reintentar", summary="Reintentar emails fallidos")
+async def reintentar_emails_fallidos(
+    ids: Optional[List[int]] = None,
+    session: AsyncSession = Depends(get_session),
+    current_user: dict = Depends(check_permission("sistema_config"))
+):
+    """
+    Vuelve a poner en cola los emails fallidos indicados en `ids` (o todos si
+    no se indica ninguno), con los intentos a cero.
+    Solo administradores (permiso 'sistema_config') pueden acceder.
+    """
+    total = await reintentar_fallidos(session, ids)
+    return {"message": f"{total} emails puestos de nuevo en cola", "total": total}
+
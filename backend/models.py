@@ -1,7 +1,7 @@
 # models.py
 # Modelos de base de datos para el sistema
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Table, JSON, Float, Date
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Table, JSON, Float, Date, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -51,6 +51,19 @@ class Usuario(Base):
     logs_auditoria = relationship("LogAuditoria", back_populates="usuario")
     creador = relationship("Usuario", remote_side=[id])
 
+# Índices del listado paginado de usuarios (/auth/users)
+# - orden + id: la página siguiente se lee con una comparación de tuplas (paginación por cursor)
+# Las búsquedas ILIKE usan el índice GiST de trigramas del autocompletado (busqueda_usuarios.py)
+# Las fechas nulas se ordenan como '-infinity' para que el cursor no tenga que tratar NULL
+ORDEN_FECHA_CREACION = "coalesce(fecha_creacion, '-infinity'::timestamp)"
+ORDEN_ULTIMO_ACCESO = "coalesce(ultimo_acceso, '-infinity'::timestamp)"
+Index("ix_usuarios_nombre_completo_id", Usuario.nombre_completo, Usuario.id)
+Index("ix_usuarios_fecha_creacion_id", text(ORDEN_FECHA_CREACION), Usuario.id)
+Index("ix_usuarios_ultimo_acceso_id", text(ORDEN_ULTIMO_ACCESO), Usuario.id)
+# Búsqueda de duplicados sin distinguir mayúsculas (importación masiva)
+Index("ix_usuarios_username_lower", func.lower(Usuario.username))
+Index("ix_usuarios_email_lower", func.lower(Usuario.email))
+
 class Rol(Base):
     __tablename__ = "roles"
     __table_args__ = {"schema": "sistema"}
@@ -182,6 +195,28 @@ class ConfiguracionEmail(Base):
     fecha_creacion = Column(DateTime, default=func.now())
     creado_por = Column(Integer, ForeignKey('sistema.usuarios.id'), nullable=True)
 
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = {"schema": "sistema"}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    destinatario = Column(String(100), nullable=False)
+    asunto = Column(String(200), nullable=False)
+    cuerpo = Column(Text, nullable=False)
+    # Los fallidos guardan el cuerpo cifrado (puede llevar contraseñas temporales o tokens)
+    cuerpo_cifrado = Column(Boolean, default=False)
+    es_html = Column(Boolean, default=True)
+    estado = Column(String(20), default='pendiente')  # pendiente, enviando, enviado, fallido
+    intentos = Column(Integer, default=0)
+    # Próximo intento (pendiente) o fin del plazo de envío del worker que lo tomó (enviando)
+    proximo_intento = Column(DateTime, default=func.now())
+    ultimo_error = Column(Text)
+    fecha_creacion = Column(DateTime, default=func.now())
+    fecha_envio = Column(DateTime)
+
+# Correos a repartir: el worker busca por estado y fecha del próximo intento
+Index("ix_email_outbox_estado_proximo", EmailOutbox.estado, EmailOutbox.proximo_intento)
+
 # ===== SISTEMA DE NOTIFICACIONES =====
 
 class Notificacion(Base):
@@ -209,13 +244,24 @@ class BackupSistema(Base):
     descripcion = Column(Text)
     ruta_archivo = Column(String(500), nullable=False)
     tamano_bytes = Column(Integer)
-    tipo = Column(String(20), default='completo')  # completo, incremental, diferencial
-    estado = Column(String(20), default='en_proceso')  # en_proceso, completado, fallido
+    tipo = Column(String(20), default='completo')  # completo, incremental, diferencial, retencion
+    estado = Column(String(20), default='en_proceso')  # en_proceso, completado, fallido, expirado
     fecha_inicio = Column(DateTime, default=func.now())
     fecha_fin = Column(DateTime)
     creado_por = Column(Integer, ForeignKey('sistema.usuarios.id'), nullable=True)
     detalles = Column(JSON)
 
+class RegistroEliminado(Base):
+    __tablename__ = "registros_eliminados"
+    __table_args__ = {"schema": "sistema"}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    esquema = Column(String(63), nullable=False)
+    tabla = Column(String(63), nullable=False)
+    clave = Column(JSON)  # Clave primaria de la fila eliminada (NULL = TRUNCATE)
+    txid = Column(BigInteger, nullable=False, index=True)  # Transacción que eliminó la fila
+    fecha = Column(DateTime, default=func.now())
+
 # ===== SISTEMA DE REPORTES =====
 
 class Reporte(Base):
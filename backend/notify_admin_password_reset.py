@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Usuario
 from database import get_session
-from email_service import email_service
+from email_outbox import encolar_email
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/notify", tags=["Notificaciones"])
@@ -23,10 +23,13 @@ async def notify_admin_forgot_password(
     admin = result.scalar_one_or_none()
     if not admin:
         raise HTTPException(status_code=404, detail="No se encontró el usuario admin")
-    # Enviar email
-    email_service.send_email(
-        to_email=admin.email,
-        subject="Solicitud de restablecimiento de contraseña",
-        body=f"El usuario '{username}' ha solicitado recuperar su contraseña. Favor de contactarlo para asistirlo."
+    # Email a la bandeja de salida; lo envía el repartidor en segundo plano
+    encolar_email(
+        session,
+        admin.email,
+        "Solicitud de restablecimiento de contraseña",
+        f"El usuario '{username}' ha solicitado recuperar su contraseña. Favor de contactarlo para asistirlo.",
+        es_html=False
     )
+    await session.commit()
     return {"message": "Se ha notificado al administrador"}
@@ -0,0 +1,114 @@
+# operaciones_usuarios.py
+# Activación, desactivación y cambio de rol de muchos usuarios en una sola sentencia
+
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, update, insert, and_, not_, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import Usuario, LogAuditoria
+from schemas import OperacionMasivaUsuarios, LogAccesoCreate
+from security import check_permission, ROLES
+from database import get_unidad_trabajo, UnidadDeTrabajo
+from cache_bus import bus_invalidacion
+from auth import log_access, condiciones_usuarios
+
+router = APIRouter(prefix="/auth", tags=["Autenticación"])
+
+# Cuenta que ninguna operación masiva puede desactivar ni cambiar de rol
+ADMIN_PROTEGIDO = and_(Usuario.username == "admin", Usuario.rol == "admin")
+
+
+@router.post("/users/masivo")
+async def operacion_masiva_usuarios(
+    operacion: OperacionMasivaUsuarios,
+    current_user: dict = Depends(check_permission("manage_users")),
+    unidad: UnidadDeTrabajo = Depends(get_unidad_trabajo)
+):
+    """
+    Activa, desactiva o cambia el rol de los usuarios indicados por `ids` o
+    por `filtro` (rol, activo, busqueda) con un único UPDATE ... RETURNING.
+    Solo se modifican los usuarios cuyo valor cambia, y el usuario admin
+    nunca se desactiva ni cambia de rol.
+    Solo administradores (permiso 'manage_users') pueden acceder.
+    """
+    session = unidad.session
+
+    # Selección de usuarios: ids (un solo parámetro array) y/o filtro
+    condiciones = []
+    if operacion.ids:
+        condiciones.append(Usuario.id == any_(bindparam("ids", operacion.ids, type_=ARRAY(Integer))))
+    if operacion.filtro:
+        filtro = operacion.filtro
+        condiciones.extend(condiciones_usuarios(filtro.rol, filtro.activo, filtro.busqueda))
+    if not condiciones:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Indique ids o un filtro con al menos un criterio"
+        )
+
+    if operacion.accion == "activar":
+        valores = {"activo": True}
+        condiciones.append(Usuario.activo == False)
+        accion_auditoria = "update"
+    elif operacion.accion == "desactivar":
+        valores = {"activo": False}
+        condiciones.extend([Usuario.activo == True, not_(ADMIN_PROTEGIDO)])
+        accion_auditoria = "delete"
+    else:
+        if operacion.rol not in ROLES:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Rol inválido: {operacion.rol}")
+        valores = {"rol": operacion.rol}
+        condiciones.extend([Usuario.rol != operacion.rol, not_(ADMIN_PROTEGIDO)])
+        accion_auditoria = "update"
+
+    # Los valores anteriores salen de la misma sentencia: UPDATE ... FROM (SELECT ... FOR UPDATE)
+    anteriores = (
+        select(Usuario.id, Usuario.rol, Usuario.activo)
+        .where(*condiciones)
+        .with_for_update()
+        .correlate(None)
+        .subquery("anteriores")
+    )
+    result = await session.execute(
+        update(Usuario)
+        .where(Usuario.id == anteriores.c.id)
+        .values(**valores)
+        .returning(Usuario.id, Usuario.username, anteriores.c.rol, anteriores.c.activo)
+        .execution_options(synchronize_session=False)
+    )
+    modificados = result.all()
+
+    if modificados:
+        ahora = datetime.utcnow()
+        # Un registro de auditoría por usuario, insertados en un solo lote
+        await session.execute(insert(LogAuditoria), [
+            {
+                "usuario_id": current_user["user_id"],
+                "username": current_user["sub"],
+                "accion": accion_auditoria,
+                "tabla": "usuarios",
+                "registro_id": fila.id,
+                "datos_anteriores": {"username": fila.username, "rol": fila.rol, "activo": fila.activo},
+                "datos_nuevos": valores,
+                "fecha": ahora,
+                "detalles": f"Operación masiva '{operacion.accion}': {fila.username}",
+            }
+            for fila in modificados
+        ])
+        await log_access(session, LogAccesoCreate(
+            usuario_id=current_user["user_id"],
+            username=current_user["sub"],
+            accion=f"bulk_{operacion.accion}",
+            detalles={"mensaje": f"Operación masiva '{operacion.accion}' sobre {len(modificados)} usuarios"}
+        ))
+        # Toda la caché de usuarios: un solo aviso en lugar de uno por id
+        await bus_invalidacion.publicar(session, "usuarios")
+    await unidad.confirmar()
+
+    return {
+        "message": f"{len(modificados)} usuarios modificados",
+        "total": len(modificados),
+        "usuarios": [{"id": fila.id, "username": fila.username} for fila in modificados],
+    }
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Utilidades para leer los parámetros del sistema (sistema.parametros_sistema)
+"""
+
+import json
+from typing import Any, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ParametroSistema
+
+
+def convertir_valor(valor: Optional[str], tipo: Optional[str]) -> Any:
+    """
+    Convierte el valor textual de un parámetro según su tipo
+    (string, integer, float, boolean, json)
+    """
+    if valor is None:
+        return None
+    if tipo == "integer":
+        return int(valor)
+    if tipo == "float":
+        return float(valor)
+    if tipo == "boolean":
+        return valor.strip().lower() in ("true", "1", "si", "sí", "yes")
+    if tipo == "json":
+        return json.loads(valor)
+    return valor
+
+
+async def get_parametro(session: AsyncSession, codigo: str, default: Any = None) -> Any:
+    """
+    Obtiene el valor convertido de un parámetro activo del sistema.
+
+    Args:
+        session: Sesión de base de datos
+        codigo: Código del parámetro (p. ej. BACKUP_RETENTION_DAYS)
+        default: Valor a retornar si el parámetro no existe, está inactivo o es inválido
+    """
+    result = await session.execute(
+        select(ParametroSistema).where(
+            ParametroSistema.codigo == codigo,
+            ParametroSistema.activo == True
+        )
+    )
+    parametro = result.scalar_one_or_none()
+    if not parametro:
+        return default
+    try:
+        valor = convertir_valor(parametro.valor, parametro.tipo)
+    except (ValueError, TypeError):
+        print(f"Parámetro {codigo} con valor inválido: {parametro.valor!r}")
+        return default
+    return default if valor is None else valor
@@ -0,0 +1,145 @@
+# pool_metricas.py
+# Pool de conexiones instrumentado: conexiones en uso, peticiones en espera y tiempos de checkout
+
+import time
+import threading
+from bisect import bisect_left
+from typing import Dict, Any, List
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Límites superiores (ms) de los buckets del histograma de espera en el checkout
+BUCKETS_ESPERA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class MetricasPool:
+    """Contadores del pool; se actualizan en cada checkout"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.esperando = 0
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Pone a cero los acumulados (no los checkouts que están esperando ahora)"""
+        with self._lock:
+            self.max_esperando = self.esperando
+            self.checkouts = 0
+            self.timeouts = 0
+            self.errores = 0
+            self.espera_total_ms = 0.0
+            self.espera_max_ms = 0.0
+            self.buckets = [0] * (len(BUCKETS_ESPERA_MS) + 1)
+            self.conexiones_creadas = 0
+            self.creacion_total_ms = 0.0
+            self.creacion_max_ms = 0.0
+
+    def inicio_espera(self):
+        with self._lock:
+            self.esperando += 1
+            self.max_esperando = max(self.max_esperando, self.esperando)
+
+    def fin_espera(self, espera_ms: float, resultado: str = "ok"):
+        with self._lock:
+            self.esperando -= 1
+            if resultado == "timeout":
+                self.timeouts += 1
+                return
+            if resultado == "error":
+                self.errores += 1
+                return
+            self.checkouts += 1
+            self.espera_total_ms += espera_ms
+            self.espera_max_ms = max(self.espera_max_ms, espera_ms)
+            self.buckets[bisect_left(BUCKETS_ESPERA_MS, espera_ms)] += 1
+
+    def conexion_creada(self, creacion_ms: float):
+        with self._lock:
+            self.conexiones_creadas += 1
+            self.creacion_total_ms += creacion_ms
+            self.creacion_max_ms = max(self.creacion_max_ms, creacion_ms)
+
+    def histograma(self) -> List[Dict[str, Any]]:
+        """Histograma acumulado (le = 'menor o igual que', como en Prometheus)"""
+        acumulado = 0
+        resultado = []
+        for limite, cantidad in zip(list(BUCKETS_ESPERA_MS) + ["+Inf"], self.buckets):
+            acumulado += cantidad
+            resultado.append({"le_ms": limite, "checkouts": acumulado})
+        return resultado
+
+
+class PoolInstrumentado(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool que mide cuánto espera cada checkout por una
+    conexión libre y cuántos checkouts esperan a la vez. El tiempo de abrir
+    una conexión nueva (TCP, TLS y autenticación) se mide aparte y no cuenta
+    como espera: un pool frío no es un pool saturado.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metricas = MetricasPool()
+        # Configuración con que se creó (el pool no la expone públicamente)
+        self.configuracion = {
+            "max_overflow": kwargs.get("max_overflow", 10),
+            "recycle_s": kwargs.get("recycle", -1),
+            "pre_ping": kwargs.get("pre_ping", False),
+        }
+        # Duración de la creación de cada conexión abierta durante un checkout, por registro
+        self._creacion_ms: Dict[int, float] = {}
+
+    def _create_connection(self):
+        inicio = time.perf_counter()
+        registro = super()._create_connection()
+        creacion_ms = (time.perf_counter() - inicio) * 1000
+        self._creacion_ms[id(registro)] = creacion_ms
+        self.metricas.conexion_creada(creacion_ms)
+        return registro
+
+    def _do_get(self):
+        self.metricas.inicio_espera()
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except exc.TimeoutError:
+            self.metricas.fin_espera(0, "timeout")
+            raise
+        except BaseException:
+            self.metricas.fin_espera(0, "error")
+            raise
+        creacion_ms = self._creacion_ms.pop(id(conexion), 0.0)
+        self.metricas.fin_espera(max((time.perf_counter() - inicio) * 1000 - creacion_ms, 0.0))
+        return conexion
+
+
+def estado_pool(pool) -> Dict[str, Any]:
+    """Estado actual y métricas acumuladas de un pool"""
+    estado = {"clase": type(pool).__name__, "descripcion": pool.status()}
+    if hasattr(pool, "size"):
+        estado.update({
+            "tamano": pool.size(),
+            **getattr(pool, "configuracion", {}),
+            "timeout_s": pool.timeout(),
+            "en_uso": pool.checkedout(),
+            "libres": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+
+    metricas = getattr(pool, "metricas", None)
+    if metricas is not None:
+        estado.update({
+            "esperando": metricas.esperando,
+            "max_esperando": metricas.max_esperando,
+            "checkouts": metricas.checkouts,
+            "timeouts": metricas.timeouts,
+            "errores": metricas.errores,
+            "espera_media_ms": round(metricas.espera_total_ms / metricas.checkouts, 3) if metricas.checkouts else 0,
+            "espera_max_ms": round(metricas.espera_max_ms, 3),
+            "histograma_espera": metricas.histograma(),
+            "conexiones_creadas": metricas.conexiones_creadas,
+            "creacion_media_ms": round(metricas.creacion_total_ms / metricas.conexiones_creadas, 3) if metricas.conexiones_creadas else 0,
+            "creacion_max_ms": round(metricas.creacion_max_ms, 3),
+        })
+    return estado
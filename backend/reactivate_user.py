@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from models import Usuario, LogAcceso
 from schemas import LogAccesoCreate
 from database import get_session
+from repositorio_usuarios import usuario_por_id
+from cache_bus import bus_invalidacion
 from security import check_permission
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
@@ -15,13 +16,13 @@ async def reactivate_user(
     session: AsyncSession = Depends(get_session)
 ):
     """Reactiva un usuario inactivo (activo=True)"""
-    result = await session.execute(select(Usuario).where(Usuario.id == user_id))
-    user = result.scalar_one_or_none()
+    user = await usuario_por_id(session, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     if user.activo:
         raise HTTPException(status_code=400, detail="El usuario ya está activo")
     user.activo = True
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
     await session.commit()
     # Registrar log
     await session.execute(
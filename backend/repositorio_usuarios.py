@@ -0,0 +1,50 @@
+# repositorio_usuarios.py
+# Consultas frecuentes de usuarios y restablecimientos de contraseña con sentencias precompiladas
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Usuario, PasswordReset
+
+# Las consultas se construyen con lambda_stmt: SQLAlchemy guarda la sentencia
+# compilada asociada al código de la lambda y en cada llamada solo extrae los
+# valores de los parámetros, sin reconstruir el select() ni calcular su clave de
+# caché. Además, asyncpg reutiliza el prepared statement en cada conexión.
+
+
+async def usuario_por_username(session: AsyncSession, username: str) -> Optional[Usuario]:
+    """Obtiene un usuario por su nombre de usuario"""
+    stmt = lambda_stmt(lambda: select(Usuario).where(Usuario.username == username))
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def usuario_por_id(session: AsyncSession, user_id: int) -> Optional[Usuario]:
+    """Obtiene un usuario por su id"""
+    stmt = lambda_stmt(lambda: select(Usuario).where(Usuario.id == user_id))
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def usuario_por_email(session: AsyncSession, email: str) -> Optional[Usuario]:
+    """Obtiene un usuario por su email"""
+    stmt = lambda_stmt(lambda: select(Usuario).where(Usuario.email == email))
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def reset_vigente_por_token(session: AsyncSession, token: str) -> Optional[PasswordReset]:
+    """Obtiene un restablecimiento de contraseña sin usar y no expirado por su token"""
+    ahora = datetime.utcnow()
+    stmt = lambda_stmt(
+        lambda: select(PasswordReset).where(
+            PasswordReset.token == token,
+            PasswordReset.usado == False,
+            PasswordReset.expira_en > ahora
+        )
+    )
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
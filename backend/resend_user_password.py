@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from models import Usuario
 from database import get_session
+from repositorio_usuarios import usuario_por_username
 from email_service import email_service
+from email_outbox import encolar_email
 from pydantic import BaseModel
+from cache_bus import bus_invalidacion
 from security import get_password_hash
 import secrets
 import string
@@ -21,20 +23,15 @@ async def resend_user_password(
 ):
     """Genera una nueva contraseña temporal y la envía al usuario por email"""
     username = data.username
-    result = await session.execute(select(Usuario).where(Usuario.username == username))
-    user = result.scalar_one_or_none()
+    user = await usuario_por_username(session, username)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     # Generar contraseña temporal
     alphabet = string.ascii_letters + string.digits
     temp_password = ''.join(secrets.choice(alphabet) for _ in range(10))
     user.hashed_password = get_password_hash(temp_password)
+    await bus_invalidacion.publicar(session, "usuarios", user.id)
+    # Email a la bandeja de salida en la misma transacción que la nueva contraseña
+    encolar_email(session, user.email, *email_service.welcome_content(user.username, temp_password, user.rol))
     await session.commit()
-    # Enviar email
-    email_service.send_welcome_email(
-        user.email,
-        user.username,
-        temp_password,
-        user.rol
-    )
     return {"message": "Se ha enviado una nueva contraseña temporal al usuario por email."}
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# Para ejecutar este script: python restore_backup.py archivo [--workers N]
+"""
+Restauración de backups generados por /system/backup.
+
+Valida metadata.json y carga cada tabla con COPY FROM, en paralelo, en una
+tabla de preparación (UNLOGGED). Después, en una única transacción, vacía las
+tablas reales y las llena desde las de preparación en orden de dependencias
+(claves foráneas), con los triggers, las claves foráneas y los índices
+secundarios diferidos hasta el final. Si algo falla, la transacción se
+revierte y la base conserva sus datos. Los backups incrementales y
+diferenciales se aplican como deltas sobre la base.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tarfile
+import zipfile
+import tempfile
+import argparse
+from typing import List, Dict, Any, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection, AsyncSession
+from dotenv import load_dotenv
+
+from backup_engine import FORMATOS_BACKUP
+from backup_compresion import extraer_archivo
+from audit_utils import log_audit_action
+from security import check_permission
+from database import engine, get_session
+
+load_dotenv()
+
+router = APIRouter(prefix="/system", tags=["Backups"])
+
+# Conexiones paralelas para la carga (0 = automático según CPUs)
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", "0"))
+
+# Filas por lote al cargar archivos en formato json
+LOTE_JSON = 10000
+
+
+class BackupInvalidoError(ValueError):
+    """El archivo no es un backup válido o no coincide con la base de datos"""
+
+
+# ============================================
+# VALIDACIÓN DEL ARCHIVO
+# ============================================
+
+def leer_metadata(backup_dir: str) -> Dict[str, Any]:
+    """Lee y valida metadata.json y la presencia de los archivos de cada tabla"""
+    nombres = set(os.listdir(backup_dir))
+    if "metadata.json" not in nombres:
+        raise BackupInvalidoError("El backup no contiene metadata.json")
+    try:
+        with open(os.path.join(backup_dir, "metadata.json"), encoding='utf-8') as f:
+            metadata = json.load(f)
+    except ValueError as e:
+        raise BackupInvalidoError(f"metadata.json no es JSON válido: {e}")
+
+    # Los backups anteriores a los formatos COPY no registran tipo ni formato
+    metadata.setdefault("tipo", "completo")
+    metadata.setdefault("formato", "json")
+    metadata.setdefault("archivos", {})
+
+    tablas = metadata.get("tablas_incluidas")
+    if not isinstance(tablas, list) or not tablas:
+        raise BackupInvalidoError("metadata.json no indica tablas_incluidas")
+    if metadata["formato"] not in FORMATOS_BACKUP:
+        raise BackupInvalidoError(f"Formato de backup desconocido: {metadata['formato']}")
+    if metadata["formato"] != "json" and not metadata.get("columnas"):
+        raise BackupInvalidoError("Los backups COPY requieren las columnas de cada tabla en metadata.json")
+    if metadata["tipo"] != "completo" and not (metadata.get("claves_primarias") and metadata.get("columnas")):
+        raise BackupInvalidoError("Los backups incrementales requieren claves primarias y columnas en metadata.json")
+
+    for nombre in tablas:
+        archivo = archivo_tabla(metadata, nombre)
+        if archivo not in nombres:
+            raise BackupInvalidoError(f"Falta el archivo {archivo} de la tabla {nombre}")
+    return metadata
+
+
+def archivo_tabla(metadata: Dict[str, Any], nombre: str) -> str:
+    """Nombre del archivo que contiene el volcado de la tabla"""
+    if nombre in metadata["archivos"]:
+        return metadata["archivos"][nombre]["archivo"]
+    schema, tabla = nombre.split(".", 1)
+    return f"{schema}_{tabla}.{FORMATOS_BACKUP[metadata['formato']]}"
+
+
+async def _validar_tablas_destino(conn: AsyncConnection, metadata: Dict[str, Any]):
+    """Comprueba que las tablas (y sus columnas, si se conocen) existen en la base de datos"""
+    result = await conn.execute(text("""
+        SELECT table_schema || '.' || table_name, array_agg(column_name::text)
+        FROM information_schema.columns
+        GROUP BY table_schema, table_name
+    """))
+    existentes = {nombre: set(columnas) for nombre, columnas in result.fetchall()}
+
+    for nombre in metadata["tablas_incluidas"]:
+        if nombre not in existentes:
+            raise BackupInvalidoError(f"La tabla {nombre} no existe en la base de datos")
+        faltantes = set((metadata.get("columnas") or {}).get(nombre, [])) - existentes[nombre]
+        if faltantes:
+            raise BackupInvalidoError(f"La tabla {nombre} no tiene las columnas {sorted(faltantes)}")
+
+
+# ============================================
+# ORDEN DE CARGA Y TRABAJO DIFERIDO
+# ============================================
+
+async def niveles_dependencia(conn: AsyncConnection, tablas: List[str]) -> List[List[str]]:
+    """
+    Agrupa las tablas en niveles según sus claves foráneas: cada tabla queda en
+    un nivel posterior a las tablas que referencia. Las tablas de un mismo
+    nivel pueden cargarse en paralelo.
+    """
+    result = await conn.execute(text("""
+        SELECT cn.nspname || '.' || c.relname, fn.nspname || '.' || f.relname
+        FROM pg_constraint k
+        JOIN pg_class c ON c.oid = k.conrelid
+        JOIN pg_namespace cn ON cn.oid = c.relnamespace
+        JOIN pg_class f ON f.oid = k.confrelid
+        JOIN pg_namespace fn ON fn.oid = f.relnamespace
+        WHERE k.contype = 'f'
+    """))
+    dependencias = {nombre: set() for nombre in tablas}
+    for tabla, referenciada in result.fetchall():
+        # Las autorreferencias (p. ej. usuarios.creado_por) no afectan al orden
+        if tabla in dependencias and referenciada in dependencias and tabla != referenciada:
+            dependencias[tabla].add(referenciada)
+
+    niveles = []
+    pendientes = dict(dependencias)
+    while pendientes:
+        nivel = sorted(t for t, deps in pendientes.items() if not deps & pendientes.keys())
+        if not nivel:
+            # Ciclo de claves foráneas: se cargan juntas, las FK ya están diferidas
+            nivel = sorted(pendientes)
+        niveles.append(nivel)
+        for tabla in nivel:
+            del pendientes[tabla]
+    return niveles
+
+
+def _preparacion(nombre: str) -> str:
+    """Tabla de preparación (en el mismo schema) donde se carga el archivo de la tabla"""
+    return f"{nombre}__restauracion"
+
+
+def _lista_sql(tablas: List[str]) -> str:
+    """Lista de oids para filtrar en el catálogo"""
+    return ", ".join(f"'{_ident(t)}'::regclass" for t in tablas)
+
+
+def _ident(nombre: str) -> str:
+    """Identificador calificado y entre comillas de schema.tabla"""
+    schema, tabla = nombre.split(".", 1)
+    return f'"{schema}"."{tabla}"'
+
+
+async def _capturar_diferidos(conn: AsyncConnection, tablas: List[str]) -> Dict[str, List[Tuple[str, str, str]]]:
+    """Guarda la definición de las FK y los índices secundarios que se recrearán tras la carga"""
+    oids = _lista_sql(tablas)
+    fks = await conn.execute(text(f"""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f' AND (conrelid IN ({oids}) OR confrelid IN ({oids}))
+    """))
+    # Índices que no respaldan una restricción (PK y UNIQUE se mantienen)
+    indices = await conn.execute(text(f"""
+        SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid IN ({oids})
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+    """))
+    return {"fks": [tuple(r) for r in fks.fetchall()], "indices": [tuple(r) for r in indices.fetchall()]}
+
+
+async def _preparar_tablas(conn: AsyncConnection, tablas: List[str], diferidos: Dict[str, Any], vaciar: bool):
+    """Desactiva triggers, elimina FK e índices secundarios y vacía las tablas (restauración completa)"""
+    for nombre in tablas:
+        await conn.execute(text(f"ALTER TABLE {_ident(nombre)} DISABLE TRIGGER USER"))
+    for tabla, nombre, _ in diferidos["fks"]:
+        await conn.execute(text(f'ALTER TABLE {tabla} DROP CONSTRAINT IF EXISTS "{nombre}"'))
+    for _, indice, _ in diferidos["indices"]:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {indice}"))
+    if vaciar:
+        await conn.execute(text(f"TRUNCATE {', '.join(_ident(t) for t in tablas)}"))
+
+
+async def _restablecer_diferidos(conn: AsyncConnection, tablas: List[str], diferidos: Dict[str, Any]):
+    """Recrea índices, claves foráneas, triggers y secuencias (en la transacción de la restauración)"""
+    for _, _, definicion in diferidos["indices"]:
+        await conn.execute(text(definicion))
+    for tabla, nombre, definicion in diferidos["fks"]:
+        await conn.execute(text(f'ALTER TABLE {tabla} ADD CONSTRAINT "{nombre}" {definicion}'))
+    for nombre in tablas:
+        await conn.execute(text(f"ALTER TABLE {_ident(nombre)} ENABLE TRIGGER USER"))
+
+    # Ajustar las secuencias de las columnas serial/identity al máximo cargado
+    result = await conn.execute(text(f"""
+        SELECT a.attrelid::regclass::text, a.attname::text,
+               pg_get_serial_sequence(a.attrelid::regclass::text, a.attname)
+        FROM pg_attribute a
+        WHERE a.attrelid IN ({_lista_sql(tablas)}) AND a.attnum > 0 AND NOT a.attisdropped
+    """))
+    for tabla, columna, secuencia in result.fetchall():
+        if secuencia:
+            await conn.execute(text(
+                f'SELECT setval(\'{secuencia}\', COALESCE(MAX("{columna}"), 1), MAX("{columna}") IS NOT NULL) FROM {tabla}'
+            ))
+
+
+async def _crear_preparacion(engine: AsyncEngine, tablas: List[str]):
+    """Crea vacías las tablas de preparación, sin índices ni restricciones para cargar rápido"""
+    async with engine.begin() as conn:
+        for nombre in tablas:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {_ident(_preparacion(nombre))}"))
+            await conn.execute(text(
+                f"CREATE UNLOGGED TABLE {_ident(_preparacion(nombre))} (LIKE {_ident(nombre)})"
+            ))
+
+
+async def _eliminar_preparacion(engine: AsyncEngine, tablas: List[str]):
+    async with engine.begin() as conn:
+        for nombre in tablas:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {_ident(_preparacion(nombre))}"))
+
+
+# ============================================
+# CARGA DE DATOS
+# ============================================
+
+async def _copiar_archivo(driver, destino: str, path: str, columnas: Optional[List[str]], formato: str) -> int:
+    """Carga un archivo csv/binary con COPY FROM en la tabla (o tabla temporal) destino"""
+    schema, tabla = destino.split(".", 1) if "." in destino else (None, destino)
+    estado = await driver.copy_to_table(
+        tabla,
+        schema_name=schema,
+        source=path,
+        columns=columnas,
+        format=formato,
+        header=(formato == "csv")
+    )
+    # asyncpg devuelve la etiqueta del comando, p. ej. "COPY 1500"
+    return int(estado.split()[-1])
+
+
+async def _insertar_json(driver, destino: str, path: str) -> int:
+    """Carga un archivo json por lotes con json_populate_recordset (PostgreSQL convierte los tipos)"""
+    with open(path, encoding='utf-8') as f:
+        filas = json.load(f)
+    destino_sql = _ident(destino) if "." in destino else f'"{destino}"'
+    for inicio in range(0, len(filas), LOTE_JSON):
+        lote = json.dumps(filas[inicio:inicio + LOTE_JSON], ensure_ascii=False)
+        await driver.execute(
+            f"INSERT INTO {destino_sql} SELECT * FROM json_populate_recordset(NULL::{destino_sql}, $1::json)",
+            lote
+        )
+    return len(filas)
+
+
+async def _cargar_tabla(
+    engine: AsyncEngine,
+    nombre: str,
+    path: str,
+    metadata: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Carga el archivo de una tabla en su tabla de preparación y mide filas/segundo"""
+    formato = metadata["formato"]
+    columnas = (metadata.get("columnas") or {}).get(nombre)
+    destino = _preparacion(nombre)
+
+    inicio = time.perf_counter()
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        driver = raw.driver_connection
+        async with driver.transaction():
+            cargar = _insertar_json(driver, destino, path) if formato == "json" else \
+                _copiar_archivo(driver, destino, path, columnas, formato)
+            registros = await cargar
+    segundos = time.perf_counter() - inicio
+    return {
+        "registros": registros,
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(registros / segundos) if segundos > 0 else registros,
+    }
+
+
+def _sql_aplicar(nombre: str, metadata: Dict[str, Any]) -> str:
+    """Sentencia que pasa las filas de la tabla de preparación a la tabla real"""
+    columnas = (metadata.get("columnas") or {}).get(nombre)
+    origen = _ident(_preparacion(nombre))
+    if metadata["tipo"] == "completo":
+        if not columnas:
+            return f"INSERT INTO {_ident(nombre)} OVERRIDING SYSTEM VALUE SELECT * FROM {origen}"
+        lista = ", ".join(f'"{c}"' for c in columnas)
+        return f"INSERT INTO {_ident(nombre)} ({lista}) OVERRIDING SYSTEM VALUE SELECT {lista} FROM {origen}"
+
+    # Delta: upsert por clave primaria. Un upsert (y no DELETE + INSERT) evita
+    # violar las FK de las filas hijas.
+    claves = metadata["claves_primarias"].get(nombre)
+    if not claves:
+        raise BackupInvalidoError(f"La tabla {nombre} no tiene clave primaria; no se puede aplicar el delta")
+    lista = ", ".join(f'"{c}"' for c in columnas)
+    columnas_clave = ", ".join(f'"{c}"' for c in claves)
+    asignaciones = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in columnas if c not in claves)
+    accion = f"DO UPDATE SET {asignaciones}" if asignaciones else "DO NOTHING"
+    # Las filas repetidas por el solapamiento de seguimiento se aplican una sola vez
+    return (
+        f'INSERT INTO {_ident(nombre)} ({lista}) OVERRIDING SYSTEM VALUE '
+        f'SELECT DISTINCT ON ({columnas_clave}) {lista} FROM {origen} '
+        f'ON CONFLICT ({columnas_clave}) {accion}'
+    )
+
+
+async def _aplicar_eliminaciones(conn: AsyncConnection, path: str, tablas: List[str]) -> int:
+    """Aplica las eliminaciones registradas desde la base (solo deltas)"""
+    with open(path, encoding='utf-8') as f:
+        eliminaciones = json.load(f)
+    aplicadas = 0
+    for e in eliminaciones:
+        nombre = f"{e['esquema']}.{e['tabla']}"
+        if nombre not in tablas:
+            continue
+        if e["clave"] is None:
+            # TRUNCATE en el origen: las filas posteriores vienen en el delta
+            await conn.execute(text(f"DELETE FROM {_ident(nombre)}"))
+        else:
+            condicion = " AND ".join(f'"{c}"::text = :k{i}' for i, c in enumerate(e["clave"]))
+            params = {f"k{i}": str(v) for i, v in enumerate(e["clave"].values())}
+            await conn.execute(text(f"DELETE FROM {_ident(nombre)} WHERE {condicion}"), params)
+        aplicadas += 1
+    return aplicadas
+
+
+async def restaurar_backup(engine: AsyncEngine, archivo_path: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Restaura un archivo de backup (zip, tar.xz o tar.zst) en la base de datos.
+
+    Returns:
+        dict: tipo de backup, niveles de carga y filas/segundo por tabla
+    """
+    workers = max(1, workers or RESTORE_WORKERS or (os.cpu_count() or 1))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # La descompresión se ejecuta en un hilo para no bloquear el event loop
+        try:
+            await asyncio.to_thread(extraer_archivo, archivo_path, temp_dir)
+        except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+            raise BackupInvalidoError(f"No se pudo leer el archivo de backup: {e}")
+
+        metadata = leer_metadata(temp_dir)
+        tablas = metadata["tablas_incluidas"]
+        delta = metadata["tipo"] != "completo"
+
+        async with engine.begin() as conn:
+            await _validar_tablas_destino(conn, metadata)
+            niveles = await niveles_dependencia(conn, tablas)
+        # Validar las sentencias de aplicación antes de cargar nada
+        sentencias = {nombre: _sql_aplicar(nombre, metadata) for nombre in tablas}
+
+        resultados: Dict[str, Any] = {}
+        semaforo = asyncio.Semaphore(workers)
+
+        async def cargar(nombre: str):
+            async with semaforo:
+                path = os.path.join(temp_dir, archivo_tabla(metadata, nombre))
+                resultados[nombre] = await _cargar_tabla(engine, nombre, path, metadata)
+                r = resultados[nombre]
+                print(f"✅ {nombre}: {r['registros']} registros en {r['segundos']}s ({r['filas_por_segundo']} filas/s)")
+
+        await _crear_preparacion(engine, tablas)
+        try:
+            # Las tablas de preparación no tienen FK: se cargan todas en paralelo
+            await asyncio.gather(*[cargar(nombre) for nombre in tablas])
+
+            # Aplicación en una sola transacción: si falla, las tablas reales no cambian
+            print("Aplicando la restauración...")
+            inicio = time.perf_counter()
+            async with engine.begin() as conn:
+                # Los deltas son pequeños: solo se difieren los triggers, no FK ni índices
+                diferidos = {"fks": [], "indices": []} if delta else await _capturar_diferidos(conn, tablas)
+                await _preparar_tablas(conn, tablas, diferidos, vaciar=not delta)
+                eliminaciones = 0
+                if delta and os.path.exists(os.path.join(temp_dir, "eliminaciones.json")):
+                    eliminaciones = await _aplicar_eliminaciones(conn, os.path.join(temp_dir, "eliminaciones.json"), tablas)
+                for nivel in niveles:
+                    for nombre in nivel:
+                        await conn.execute(text(sentencias[nombre]))
+                await _restablecer_diferidos(conn, tablas, diferidos)
+            segundos_aplicacion = round(time.perf_counter() - inicio, 3)
+        finally:
+            await _eliminar_preparacion(engine, tablas)
+
+        async with engine.begin() as conn:
+            for nombre in tablas:
+                await conn.execute(text(f"ANALYZE {_ident(nombre)}"))
+
+        return {
+            "tipo": metadata["tipo"],
+            "formato": metadata["formato"],
+            "fecha_backup": metadata.get("fecha_backup"),
+            "niveles": niveles,
+            "eliminaciones_aplicadas": eliminaciones,
+            "segundos_aplicacion": segundos_aplicacion,
+            "tablas": resultados,
+        }
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# ============================================
+# ENDPOINT DE ADMINISTRACIÓN
+# ============================================
+
+@router.post("/restore", summary="Restaurar un backup del sistema")
+async def restaurar_backup_endpoint(
+    archivo: UploadFile = File(...),
+    confirmar: bool = False,
+    workers: Optional[int] = None,
+    current_user: dict = Depends(check_permission("sistema_config")),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Restaura un archivo generado por /system/backup. Reemplaza los datos de
+    las tablas incluidas, por lo que exige `confirmar=true`.
+    Solo administradores (permiso 'sistema_config') pueden acceder.
+    """
+    if not confirmar:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La restauración reemplaza los datos actuales; repita la petición con confirmar=true"
+        )
+    temp_dir = tempfile.mkdtemp()
+    try:
+        archivo_path = os.path.join(temp_dir, "backup")
+        with open(archivo_path, 'wb') as f:
+            while bloque := await archivo.read(1024 * 1024):
+                f.write(bloque)
+
+        try:
+            resultado = await restaurar_backup(engine, archivo_path, workers)
+        except BackupInvalidoError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            print(f"❌ Error al restaurar backup: {e}")
+            raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
+
+        await log_audit_action(
+            session=session,
+            username=current_user["sub"],
+            user_id=current_user.get("user_id"),
+            action="restore",
+            table="backup",
+            new_data={
+                "archivo": archivo.filename,
+                "tipo": resultado["tipo"],
+                "tablas": {t: r["registros"] for t, r in resultado["tablas"].items()},
+            },
+            details=f"Backup {resultado['tipo']} restaurado ({len(resultado['tablas'])} tablas)"
+        )
+        return resultado
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# ============================================
+# LÍNEA DE COMANDOS
+# ============================================
+
+async def main():
+    parser = argparse.ArgumentParser(description="Restaura un backup del sistema")
+    parser.add_argument("archivo", help="Archivo generado por /system/backup (zip, tar.xz o tar.zst)")
+    parser.add_argument("--workers", type=int, default=None, help="Conexiones paralelas de carga")
+    args = parser.parse_args()
+
+    try:
+        resultado = await restaurar_backup(engine, args.archivo, args.workers)
+    except BackupInvalidoError as e:
+        print(f"❌ Backup inválido: {e}")
+        sys.exit(1)
+    finally:
+        await engine.dispose()
+
+    print(f"\nBackup {resultado['tipo']} ({resultado['formato']}) del {resultado['fecha_backup']} restaurado")
+    print(f"{'Tabla':<40}{'Registros':>12}{'Segundos':>10}{'Filas/s':>12}")
+    for nombre, r in resultado["tablas"].items():
+        print(f"{nombre:<40}{r['registros']:>12}{r['segundos']:>10}{r['filas_por_segundo']:>12}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
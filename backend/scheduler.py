@@ -0,0 +1,312 @@
+# scheduler.py
+# Planificador de tareas periódicas (backup nocturno y retención) con elección de líder en PostgreSQL
+
+import os
+import shutil
+import asyncio
+import tempfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, Optional, Set
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from models import BackupSistema
+from database import engine, SessionLocal
+from parametros_utils import get_parametro
+from backup_service import ejecutar_backup
+from backup_repositorio import aplicar_retencion
+
+load_dotenv()
+
+# Permite desactivar el planificador en algún proceso (p. ej. scripts o tests)
+SCHEDULER_HABILITADO = os.getenv("SCHEDULER_HABILITADO", "true").lower() == "true"
+
+# Segundos entre revisiones de las programaciones
+SCHEDULER_INTERVALO = int(os.getenv("SCHEDULER_INTERVALO", "30"))
+
+# Zona horaria en que se interpretan las expresiones cron (igual en todos los nodos).
+# El horario programado se registra siempre en UTC.
+SCHEDULER_ZONA_HORARIA = ZoneInfo(os.getenv("SCHEDULER_ZONA_HORARIA", "UTC"))
+
+# Espacio de claves de los advisory locks del planificador
+CLAVE_LOCKS = 7310
+
+# Rango de valores de cada campo cron: minuto, hora, día del mes, mes, día de la semana
+_RANGOS_CRON = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parsear_campo(campo: str, minimo: int, maximo: int) -> Set[int]:
+    """Convierte un campo cron (*, listas, rangos y pasos) en el conjunto de valores que admite"""
+    valores = set()
+    for parte in campo.split(","):
+        paso = 1
+        if "/" in parte:
+            parte, paso_texto = parte.split("/", 1)
+            paso = int(paso_texto)
+            if paso < 1:
+                raise ValueError(f"Paso inválido en el campo cron '{campo}'")
+        if parte == "*":
+            inicio, fin = minimo, maximo
+        elif "-" in parte:
+            inicio, fin = (int(valor) for valor in parte.split("-", 1))
+        else:
+            inicio = int(parte)
+            fin = maximo if "/" in campo else inicio
+        if not minimo <= inicio <= fin <= maximo:
+            raise ValueError(f"Valor fuera de rango en el campo cron '{campo}' ({minimo}-{maximo})")
+        valores.update(range(inicio, fin + 1, paso))
+    return valores
+
+
+class ExpresionCron:
+    """
+    Expresión cron de 5 campos: minuto hora día-del-mes mes día-de-la-semana
+    (0 y 7 son domingo). Como en cron, si se restringen el día del mes y el de
+    la semana basta con que coincida uno de los dos.
+    """
+
+    def __init__(self, expresion: str):
+        campos = expresion.split()
+        if len(campos) != 5:
+            raise ValueError(f"La expresión cron '{expresion}' debe tener 5 campos")
+        self.expresion = " ".join(campos)
+        self.minutos, self.horas, self.dias, self.meses, dias_semana = (
+            _parsear_campo(campo, *rango) for campo, rango in zip(campos, _RANGOS_CRON)
+        )
+        self.dias_semana = {0 if dia == 7 else dia for dia in dias_semana}
+        self._dia_restringido = not campos[2].startswith("*")
+        self._semana_restringida = not campos[4].startswith("*")
+
+    def _coincide_dia(self, fecha: datetime) -> bool:
+        en_mes = fecha.day in self.dias
+        en_semana = (fecha.weekday() + 1) % 7 in self.dias_semana
+        if self._dia_restringido and self._semana_restringida:
+            return en_mes or en_semana
+        return en_mes and en_semana
+
+    def siguiente(self, desde: datetime) -> datetime:
+        """Primer minuto posterior a `desde` que cumple la expresión"""
+        fecha = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = fecha + timedelta(days=366 * 5)
+        while fecha < limite:
+            if fecha.month not in self.meses:
+                fecha = (fecha.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._coincide_dia(fecha):
+                fecha = (fecha + timedelta(days=1)).replace(hour=0, minute=0)
+            elif fecha.hour not in self.horas:
+                fecha = (fecha + timedelta(hours=1)).replace(minute=0)
+            elif fecha.minute not in self.minutos:
+                fecha += timedelta(minutes=1)
+            else:
+                return fecha
+        raise ValueError(f"La expresión cron '{self.expresion}' no tiene próximas ejecuciones")
+
+
+async def _tarea_backup(session: AsyncSession, detalles: Dict[str, Any]) -> BackupSistema:
+    """Backup programado del tipo configurado en BACKUP_CRON_TIPO"""
+    tipo = await get_parametro(session, "BACKUP_CRON_TIPO", "completo")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        registro, _, _ = await ejecutar_backup(
+            session,
+            username="scheduler",
+            user_id=None,
+            dest_dir=temp_dir,
+            tipo=tipo,
+            detalles_extra=detalles
+        )
+        return registro
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def _tarea_retencion(session: AsyncSession, detalles: Dict[str, Any]) -> BackupSistema:
+    """Retención programada; la ejecución queda registrada como un BackupSistema de tipo 'retencion'"""
+    inicio = datetime.utcnow()
+    registro = BackupSistema(
+        nombre=f"retencion_{inicio.strftime('%Y%m%d_%H%M%S')}",
+        descripcion="Retención programada de backups",
+        ruta_archivo="",
+        tipo="retencion",
+        estado="en_proceso",
+        fecha_inicio=inicio,
+        detalles=detalles
+    )
+    session.add(registro)
+    await session.commit()
+
+    try:
+        resultado = await aplicar_retencion(session)
+        registro.estado = "completado"
+        registro.detalles = {**detalles, **resultado}
+    except Exception as e:
+        await session.rollback()
+        registro.estado = "fallido"
+        registro.detalles = {**detalles, "error": str(e)}
+        session.add(registro)
+        raise
+    finally:
+        registro.fecha_fin = datetime.utcnow()
+        await session.commit()
+    return registro
+
+
+# Tareas programables: parámetro con la expresión cron, expresión por defecto y función
+TAREAS: Dict[str, Dict[str, Any]] = {
+    "backup": {"parametro": "BACKUP_CRON", "defecto": "0 2 * * *", "funcion": _tarea_backup},
+    "retencion": {"parametro": "BACKUP_RETENTION_CRON", "defecto": "30 3 * * *", "funcion": _tarea_retencion},
+}
+
+
+async def _ya_ejecutada(session: AsyncSession, nombre: str, programada: str) -> bool:
+    """Indica si algún nodo ya registró la ejecución de esta tarea para ese horario"""
+    result = await session.execute(
+        select(BackupSistema.id).where(
+            BackupSistema.detalles["tarea"].as_string() == nombre,
+            BackupSistema.detalles["programada"].as_string() == programada
+        ).limit(1)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+def clave_programada(programada: datetime) -> str:
+    """Horario programado en UTC: nodos con distinta zona local generan la misma clave"""
+    return programada.astimezone(timezone.utc).isoformat()
+
+
+async def ejecutar_tarea(nombre: str, programada: datetime) -> Optional[BackupSistema]:
+    """
+    Ejecuta una tarea programada si este proceso gana el advisory lock.
+
+    El lock de sesión se mantiene en una conexión propia durante toda la
+    ejecución y PostgreSQL lo libera solo si el proceso muere. Con el lock
+    tomado se revisa el historial en BackupSistema, de modo que un nodo que
+    llegue tarde al mismo horario no repite la ejecución.
+    """
+    clave = {"espacio": CLAVE_LOCKS, "tarea": nombre}
+    detalles = {"tarea": nombre, "programada": clave_programada(programada)}
+
+    async with engine.connect() as conn:
+        obtenido = await conn.scalar(
+            text("SELECT pg_try_advisory_lock(:espacio, hashtext(:tarea))"), clave
+        )
+        await conn.commit()
+        if not obtenido:
+            print(f"Tarea '{nombre}' ({detalles['programada']}) en ejecución en otro nodo")
+            return None
+
+        try:
+            async with SessionLocal() as session:
+                if await _ya_ejecutada(session, nombre, detalles["programada"]):
+                    print(f"Tarea '{nombre}' ({detalles['programada']}) ya ejecutada por otro nodo")
+                    return None
+                print(f"Ejecutando tarea programada '{nombre}' ({detalles['programada']})...")
+                registro = await TAREAS[nombre]["funcion"](session, detalles)
+                print(f"✅ Tarea '{nombre}' completada (registro {registro.id})")
+                return registro
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:espacio, hashtext(:tarea))"), clave)
+            await conn.commit()
+
+
+class PlanificadorBackups:
+    """
+    Revisa periódicamente las expresiones cron de ParametroSistema (los
+    cambios se aplican sin reiniciar) y lanza cada tarea cuando llega su
+    horario. Las ejecuciones perdidas mientras el servicio estaba detenido
+    no se recuperan: se espera al siguiente horario.
+    """
+
+    def __init__(self):
+        self._ciclo_task: Optional[asyncio.Task] = None
+        self._proximas: Dict[str, Dict[str, Any]] = {}
+        self._en_curso: Dict[str, asyncio.Task] = {}
+
+    async def _cargar_expresiones(self) -> Dict[str, Optional[ExpresionCron]]:
+        expresiones = {}
+        async with SessionLocal() as session:
+            for nombre, tarea in TAREAS.items():
+                valor = await get_parametro(session, tarea["parametro"], tarea["defecto"])
+                try:
+                    expresiones[nombre] = ExpresionCron(valor) if valor else None
+                except ValueError as e:
+                    print(f"❌ {tarea['parametro']} inválido, tarea '{nombre}' desactivada: {e}")
+                    expresiones[nombre] = None
+        return expresiones
+
+    async def revisar(self):
+        """Lanza las tareas cuyo horario ya llegó y calcula su próxima ejecución"""
+        ahora = datetime.now(SCHEDULER_ZONA_HORARIA)
+        for nombre, cron in (await self._cargar_expresiones()).items():
+            # Un error en una tarea no impide programar las demás
+            try:
+                self._revisar_tarea(nombre, cron, ahora)
+            except Exception as e:
+                self._proximas.pop(nombre, None)
+                print(f"❌ Error al programar la tarea '{nombre}': {e}")
+
+    def _revisar_tarea(self, nombre: str, cron: Optional[ExpresionCron], ahora: datetime):
+        if cron is None:
+            self._proximas.pop(nombre, None)
+            return
+
+        actual = self._proximas.get(nombre)
+        if actual is None or actual["cron"] != cron.expresion:
+            self._proximas[nombre] = {"cron": cron.expresion, "proxima": cron.siguiente(ahora)}
+            return
+        if ahora < actual["proxima"]:
+            return
+
+        self._proximas[nombre] = {"cron": cron.expresion, "proxima": cron.siguiente(ahora)}
+        en_curso = self._en_curso.get(nombre)
+        if en_curso and not en_curso.done():
+            print(f"Tarea '{nombre}' sigue en ejecución, se omite el horario {actual['proxima']}")
+            return
+        self._en_curso[nombre] = asyncio.create_task(self._ejecutar(nombre, actual["proxima"]))
+
+    async def _ejecutar(self, nombre: str, programada: datetime):
+        try:
+            await ejecutar_tarea(nombre, programada)
+        except Exception as e:
+            print(f"❌ Error en la tarea programada '{nombre}': {e}")
+
+    async def _ciclo(self):
+        while True:
+            try:
+                await self.revisar()
+            except Exception as e:
+                print(f"❌ Error en el planificador: {e}")
+            await asyncio.sleep(SCHEDULER_INTERVALO)
+
+    def iniciar(self):
+        if SCHEDULER_HABILITADO and self._ciclo_task is None:
+            self._ciclo_task = asyncio.create_task(self._ciclo())
+            print("✅ Planificador de backups iniciado")
+
+    async def detener(self):
+        tareas = [t for t in [self._ciclo_task, *self._en_curso.values()] if t and not t.done()]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self._ciclo_task = None
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "habilitado": SCHEDULER_HABILITADO,
+            "activo": self._ciclo_task is not None and not self._ciclo_task.done(),
+            "tareas": {
+                nombre: {
+                    "cron": info["cron"],
+                    "proxima": info["proxima"].isoformat(),
+                    "en_curso": nombre in self._en_curso and not self._en_curso[nombre].done(),
+                }
+                for nombre, info in self._proximas.items()
+            },
+        }
+
+
+# Instancia global del planificador
+planificador = PlanificadorBackups()
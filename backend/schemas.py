@@ -56,6 +56,23 @@ class UserUpdate(BaseModel):
     rol: Optional[str] = None
     activo: Optional[bool] = None
 
+class FiltroUsuarios(BaseModel):
+    rol: Optional[str] = None
+    activo: Optional[bool] = None
+    busqueda: Optional[str] = None  # Subcadena de username, email o nombre completo
+
+class OperacionMasivaUsuarios(BaseModel):
+    accion: str  # activar, desactivar, cambiar_rol
+    ids: Optional[List[int]] = None
+    filtro: Optional[FiltroUsuarios] = None
+    rol: Optional[str] = None  # Rol nuevo (solo para cambiar_rol)
+
+    @validator('accion')
+    def accion_must_be_valid(cls, v):
+        if v not in ('activar', 'desactivar', 'cambiar_rol'):
+            raise ValueError('La acción debe ser activar, desactivar o cambiar_rol')
+        return v
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -12,6 +12,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from dotenv import load_dotenv
 
+from sql_metricas import metricas_sql
+
 load_dotenv()
 
 # Configuración de seguridad
@@ -74,6 +76,10 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     """Obtiene el usuario actual basado en el token"""
     token = credentials.credentials
     payload = verify_token(token)
+    # Usuario de la petición para la instrumentación de SQL (consultas lentas)
+    metricas = metricas_sql.get()
+    if metricas is not None:
+        metricas.usuario = payload.get("sub")
     return payload
 
 # Roles y permisos (Hardcoded para validación rápida, idealmente usar base de datos)
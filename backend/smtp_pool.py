@@ -0,0 +1,185 @@
+# smtp_pool.py
+# Pool de conexiones SMTP autenticadas y reutilizables (aiosmtplib)
+
+import os
+import time
+import asyncio
+from typing import List, Optional, Tuple, Dict, Any
+
+import aiosmtplib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Conexiones SMTP abiertas como máximo; también limita los envíos en paralelo
+SMTP_POOL_TAMANO = int(os.getenv("SMTP_POOL_TAMANO", "4"))
+# Mensajes por conexión antes de renovarla (muchos servidores limitan los mensajes por sesión)
+SMTP_POOL_MAX_MENSAJES = int(os.getenv("SMTP_POOL_MAX_MENSAJES", "100"))
+# Segundos que se conserva una conexión libre; el servidor suele cerrar las inactivas
+SMTP_POOL_INACTIVIDAD_S = float(os.getenv("SMTP_POOL_INACTIVIDAD_S", "60"))
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "30"))
+
+
+def _es_error_conexion(error: Exception) -> bool:
+    """Fallo de la conexión (no del mensaje): hay que descartarla y usar otra"""
+    if isinstance(error, (aiosmtplib.SMTPServerDisconnected, OSError)):
+        return True
+    # 421: el servidor va a cerrar la sesión
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code == 421
+
+
+class _Conexion:
+    def __init__(self, smtp: aiosmtplib.SMTP):
+        self.smtp = smtp
+        self.mensajes = 0
+        self.ultimo_uso = time.monotonic()
+
+
+class PoolSMTP:
+    """
+    Mantiene hasta `tamano` conexiones SMTP ya saludadas, con STARTTLS y login,
+    y las reutiliza para muchos mensajes. Las libres se reparten de la más a
+    la menos reciente; las que llevan más de `inactividad_s` sin usarse o ya
+    enviaron `max_mensajes` se cierran y se abre otra. Si un envío falla por
+    la conexión, se descarta y se reintenta una vez con una conexión nueva.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = True,
+        tamano: int = SMTP_POOL_TAMANO,
+        max_mensajes: int = SMTP_POOL_MAX_MENSAJES,
+        inactividad_s: float = SMTP_POOL_INACTIVIDAD_S,
+        timeout: float = SMTP_TIMEOUT_S,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.tamano = max(1, tamano)
+        self.max_mensajes = max(1, max_mensajes)
+        self.inactividad_s = inactividad_s
+        self.timeout = timeout
+        self._libres: List[_Conexion] = []
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._en_uso = 0
+        self.enviados = 0
+        self.errores = 0
+        self.conexiones_abiertas = 0
+        self.reconexiones = 0
+
+    def _preparar(self):
+        # El semáforo y las conexiones pertenecen a un event loop; con uno nuevo se empieza de cero
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaforo = asyncio.Semaphore(self.tamano)
+            self._libres = []
+            self._en_uso = 0
+
+    async def _conectar(self) -> _Conexion:
+        # Puerto 465: TLS implícito; en el resto STARTTLS si está habilitado
+        implicito = self.port == 465
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            timeout=self.timeout,
+            use_tls=implicito,
+            start_tls=self.starttls and not implicito,
+        )
+        await smtp.connect()
+        try:
+            if self.username:
+                await smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.conexiones_abiertas += 1
+        return _Conexion(smtp)
+
+    async def _cerrar_conexion(self, conexion: _Conexion):
+        try:
+            await asyncio.wait_for(conexion.smtp.quit(), timeout=5)
+        except Exception:
+            conexion.smtp.close()
+
+    async def _tomar(self) -> _Conexion:
+        ahora = time.monotonic()
+        while self._libres:
+            conexion = self._libres.pop()
+            if conexion.smtp.is_connected and ahora - conexion.ultimo_uso < self.inactividad_s:
+                return conexion
+            await self._cerrar_conexion(conexion)
+        return await self._conectar()
+
+    async def _devolver(self, conexion: _Conexion):
+        conexion.ultimo_uso = time.monotonic()
+        if conexion.mensajes >= self.max_mensajes:
+            await self._cerrar_conexion(conexion)
+        else:
+            self._libres.append(conexion)
+
+    async def enviar(self, remitente: str, destinatario: str, mensaje: str) -> Optional[str]:
+        """Envía un mensaje ya armado; retorna None si se envió o el texto del error"""
+        self._preparar()
+        async with self._semaforo:
+            self._en_uso += 1
+            try:
+                return await self._enviar(remitente, destinatario, mensaje)
+            finally:
+                self._en_uso -= 1
+
+    async def _enviar(self, remitente: str, destinatario: str, mensaje: str) -> Optional[str]:
+        for intento in (1, 2):
+            try:
+                conexion = await self._tomar()
+            except Exception as e:
+                self.errores += 1
+                return f"Error conectando al servidor de email: {e}"
+            try:
+                await conexion.smtp.sendmail(remitente, [destinatario], mensaje)
+            except Exception as e:
+                if _es_error_conexion(e):
+                    conexion.smtp.close()
+                    # Conexión libre cerrada por el servidor: se reintenta con una nueva
+                    if intento == 1:
+                        self.reconexiones += 1
+                        continue
+                else:
+                    # Destinatario o mensaje rechazado: la conexión sigue sirviendo
+                    await self._devolver(conexion)
+                self.errores += 1
+                return str(e)
+            conexion.mensajes += 1
+            self.enviados += 1
+            await self._devolver(conexion)
+            return None
+
+    async def enviar_lote(self, remitente: str, mensajes: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """Envía (destinatario, mensaje) en paralelo, hasta `tamano` a la vez"""
+        return list(await asyncio.gather(*(
+            self.enviar(remitente, destinatario, mensaje) for destinatario, mensaje in mensajes
+        )))
+
+    async def cerrar(self):
+        """Cierra las conexiones libres (al apagar la aplicación)"""
+        libres, self._libres = self._libres, []
+        await asyncio.gather(*(self._cerrar_conexion(c) for c in libres), return_exceptions=True)
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "servidor": f"{self.host}:{self.port}",
+            "tamano": self.tamano,
+            "en_uso": self._en_uso,
+            "libres": len(self._libres),
+            "enviados": self.enviados,
+            "errores": self.errores,
+            "conexiones_abiertas": self.conexiones_abiertas,
+            "reconexiones": self.reconexiones,
+        }
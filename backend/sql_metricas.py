@@ -0,0 +1,102 @@
+# sql_metricas.py
+# Instrumentación de SQL por petición: sentencias, tiempo en base de datos y commits
+
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional, Callable, List, Dict, Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sentencias por petición a partir de las que se avisa de un posible N+1
+SQL_MAX_CONSULTAS = int(os.getenv("SQL_MAX_CONSULTAS", "20"))
+
+
+class MetricasSQL:
+    """Acumulados de SQL de una petición"""
+
+    def __init__(self, metodo: str = "", ruta: str = ""):
+        self.metodo = metodo
+        self.ruta = ruta
+        # Lo completa get_current_user cuando la petición está autenticada
+        self.usuario: Optional[str] = None
+        self.consultas = 0
+        self.tiempo_db_ms = 0.0
+        self.commits = 0
+        self.sentencias: Counter = Counter()
+
+    def server_timing(self, total_ms: float) -> str:
+        """Valor de la cabecera Server-Timing"""
+        return (
+            f'db;dur={self.tiempo_db_ms:.1f};desc="{self.consultas} consultas", '
+            f'commits;desc="{self.commits}", '
+            f'total;dur={total_ms:.1f}'
+        )
+
+
+# Métricas de la petición en curso (SQLAlchemy propaga el contexto a sus greenlets)
+metricas_sql: ContextVar[Optional[MetricasSQL]] = ContextVar("metricas_sql", default=None)
+
+# Funciones que reciben cada sentencia ejecutada en una petición:
+# (conexión, sentencia, parámetros, duración en ms, métricas de la petición)
+observadores_sentencia: List[Callable] = []
+
+# AsyncEngine de cada engine síncrono instrumentado (para abrir conexiones desde los observadores)
+motores: Dict[Any, AsyncEngine] = {}
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    if metricas_sql.get() is not None:
+        conn.info.setdefault("inicio_sql", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    metricas = metricas_sql.get()
+    if metricas is None or not conn.info.get("inicio_sql"):
+        return
+    duracion_ms = (time.perf_counter() - conn.info["inicio_sql"].pop()) * 1000
+    metricas.consultas += 1
+    metricas.tiempo_db_ms += duracion_ms
+    metricas.sentencias[statement] += 1
+    for observador in observadores_sentencia:
+        observador(conn, statement, parameters, duracion_ms, metricas)
+
+
+def _error_sql(contexto_error):
+    # La sentencia fallida también cuenta, para no dejar la pila de inicios desbalanceada
+    conn = contexto_error.connection
+    if conn is not None and conn.info.get("inicio_sql"):
+        _despues_de_ejecutar(conn, None, contexto_error.statement, contexto_error.parameters, None, False)
+
+
+def _commit(conn):
+    metricas = metricas_sql.get()
+    if metricas is not None:
+        metricas.commits += 1
+
+
+def instalar_instrumentacion(engine: AsyncEngine):
+    """Registra los eventos de SQLAlchemy que alimentan las métricas por petición"""
+    sync_engine = engine.sync_engine
+    motores[sync_engine] = engine
+    event.listen(sync_engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.listen(sync_engine, "after_cursor_execute", _despues_de_ejecutar)
+    event.listen(sync_engine, "handle_error", _error_sql)
+    event.listen(sync_engine, "commit", _commit)
+
+
+def avisar_si_excede(metricas: MetricasSQL, metodo: str, ruta: str):
+    """Avisa cuando un endpoint supera SQL_MAX_CONSULTAS, mostrando la sentencia más repetida"""
+    if SQL_MAX_CONSULTAS <= 0 or metricas.consultas <= SQL_MAX_CONSULTAS:
+        return
+    sentencia, repeticiones = metricas.sentencias.most_common(1)[0]
+    print(
+        f"⚠️ Posible N+1 en {metodo} {ruta}: {metricas.consultas} consultas "
+        f"(máximo {SQL_MAX_CONSULTAS}); la más repetida ({repeticiones} veces): "
+        f"{' '.join(sentencia.split())[:200]}"
+    )
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Script de prueba de la bandeja de salida de emails (email_outbox)
+
+Necesita la base de datos inicializada (init_database.py). El envío SMTP se
+reemplaza por uno simulado que falla para los destinatarios indicados, y se
+verifican las transiciones de estado: envío, reintento con backoff, paso a
+'fallido' con el cuerpo cifrado, el tope de intentos al retomar filas
+'enviando' con el plazo vencido y reintentar_fallidos.
+
+Detener la aplicación (o EMAIL_OUTBOX_HABILITADO=false) mientras se ejecuta:
+su repartidor podría tomar los emails de prueba.
+"""
+
+import sys
+import uuid
+import asyncio
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from email_outbox import (
+    repartidor_emails, reintentar_fallidos, encolar_emails,
+    _cifrar, _descifrar, EMAIL_OUTBOX_MAX_INTENTOS, ERROR_SIN_CUERPO,
+)
+from email_service import email_service
+from database import SessionLocal, engine
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Destinatarios de esta ejecución: se borran al terminar
+DOMINIO = f"prueba-{uuid.uuid4().hex[:8]}.ejemplo.com"
+
+
+class EnvioSimulado:
+    """Reemplaza email_service.send_batch: registra los envíos y falla para `rechazar`"""
+
+    def __init__(self):
+        self.enviados = []
+        self.rechazar = set()
+
+    async def __call__(self, emails):
+        errores = []
+        for destinatario, asunto, cuerpo, es_html in emails:
+            self.enviados.append((destinatario, cuerpo))
+            errores.append("550 Buzón inexistente" if destinatario in self.rechazar else None)
+        return errores
+
+
+envio = EnvioSimulado()
+
+
+def _dir(nombre: str) -> str:
+    return f"{nombre}@{DOMINIO}"
+
+
+async def _encolar(*emails):
+    async with SessionLocal() as session:
+        await encolar_emails(session, [(_dir(nombre), "Prueba", cuerpo, True) for nombre, cuerpo in emails])
+        await session.commit()
+
+
+async def _fila(nombre: str):
+    async with SessionLocal() as session:
+        result = await session.execute(text("""
+            SELECT estado, intentos, cuerpo, cuerpo_cifrado, ultimo_error,
+                   proximo_intento > now() AS en_espera
+            FROM sistema.email_outbox WHERE destinatario = :d
+        """), {"d": _dir(nombre)})
+        return result.one()
+
+
+async def _actualizar(nombre: str, sql: str):
+    async with SessionLocal() as session:
+        await session.execute(text(f"UPDATE sistema.email_outbox SET {sql} WHERE destinatario = :d"), {"d": _dir(nombre)})
+        await session.commit()
+
+
+async def _procesar_todo():
+    while await repartidor_emails.procesar_lote():
+        pass
+
+
+async def probar_envio():
+    await _encolar(("ok", "Tu contraseña temporal es abc123"))
+    await _procesar_todo()
+    fila = await _fila("ok")
+    assert fila.estado == "enviado", fila
+    assert fila.cuerpo == "", "el cuerpo debe borrarse al enviarse"
+    assert (_dir("ok"), "Tu contraseña temporal es abc123") in envio.enviados
+
+
+async def probar_reintento_y_dead_letter():
+    envio.rechazar.add(_dir("rechazado"))
+    await _encolar(("rechazado", "token-secreto"))
+    await _procesar_todo()
+    fila = await _fila("rechazado")
+    assert fila.estado == "pendiente" and fila.intentos == 1, fila
+    assert fila.en_espera and fila.ultimo_error.startswith("550"), fila
+    assert fila.cuerpo == "token-secreto" and not fila.cuerpo_cifrado
+
+    # Último intento: pasa a 'fallido' con el cuerpo cifrado
+    await _actualizar("rechazado", f"intentos = {EMAIL_OUTBOX_MAX_INTENTOS - 1}, proximo_intento = now()")
+    await _procesar_todo()
+    fila = await _fila("rechazado")
+    assert fila.estado == "fallido" and fila.intentos == EMAIL_OUTBOX_MAX_INTENTOS, fila
+    assert fila.cuerpo_cifrado and "token-secreto" not in fila.cuerpo, fila
+    assert _descifrar(fila.cuerpo) == "token-secreto"
+
+
+async def probar_sin_cuerpo():
+    # Como queda una fila restaurada de un backup (el cuerpo no se respalda)
+    await _encolar(("vacio", ""))
+    await _procesar_todo()
+    fila = await _fila("vacio")
+    assert fila.estado == "fallido" and fila.ultimo_error == ERROR_SIN_CUERPO, fila
+    assert _dir("vacio") not in [d for d, _ in envio.enviados], "no debe enviarse un email vacío"
+
+
+async def probar_tope_al_retomar():
+    # Un worker que se cayó (o se colgó) en el último intento: plazo vencido y sin intentos
+    await _encolar(("colgado", "reset-token"), ("caido", "bienvenida"))
+    await _actualizar("colgado", f"estado = 'enviando', intentos = {EMAIL_OUTBOX_MAX_INTENTOS}, proximo_intento = now() - interval '1 minute'")
+    await _actualizar("caido", "estado = 'enviando', intentos = 1, proximo_intento = now() - interval '1 minute'")
+    await _procesar_todo()
+
+    fila = await _fila("colgado")
+    assert fila.estado == "fallido" and fila.intentos == EMAIL_OUTBOX_MAX_INTENTOS, fila
+    assert fila.cuerpo_cifrado and _descifrar(fila.cuerpo) == "reset-token", fila
+    assert _dir("colgado") not in [d for d, _ in envio.enviados], "no debe retomarse sin intentos"
+
+    # Con intentos disponibles se retoma y se envía
+    fila = await _fila("caido")
+    assert fila.estado == "enviado" and fila.intentos == 2, fila
+
+    # Plazo aún vigente: otro worker lo está enviando, no se toca
+    await _encolar(("en_curso", "x"))
+    await _actualizar("en_curso", "estado = 'enviando', intentos = 1, proximo_intento = now() + interval '5 minutes'")
+    await _procesar_todo()
+    fila = await _fila("en_curso")
+    assert fila.estado == "enviando" and fila.intentos == 1, fila
+
+
+async def probar_reintentar_fallidos():
+    await _encolar(("reintento", "clave-nueva"), ("sin_cuerpo", ""), ("otra_clave", "x"))
+    await _actualizar("reintento", f"estado = 'fallido', intentos = {EMAIL_OUTBOX_MAX_INTENTOS}, cuerpo = '{_cifrar('clave-nueva')}', cuerpo_cifrado = true")
+    await _actualizar("sin_cuerpo", "estado = 'fallido'")
+    # Cifrado con otra SECRET_KEY: no se puede recuperar
+    await _actualizar("otra_clave", "estado = 'fallido', cuerpo = 'gAAAAAinvalido', cuerpo_cifrado = true")
+
+    async with SessionLocal() as session:
+        ids = (await session.execute(
+            text("SELECT id FROM sistema.email_outbox WHERE destinatario = ANY(:d)"),
+            {"d": [_dir("reintento"), _dir("sin_cuerpo"), _dir("otra_clave")]}
+        )).scalars().all()
+        assert await reintentar_fallidos(session, list(ids)) == 1
+
+    fila = await _fila("reintento")
+    assert fila.estado == "pendiente" and fila.intentos == 0, fila
+    assert fila.cuerpo == "clave-nueva" and not fila.cuerpo_cifrado, fila
+    assert (await _fila("sin_cuerpo")).estado == "fallido"
+    assert (await _fila("otra_clave")).estado == "fallido"
+
+    await _procesar_todo()
+    assert (await _fila("reintento")).estado == "enviado"
+    assert (_dir("reintento"), "clave-nueva") in envio.enviados
+
+
+async def probar_workers_concurrentes():
+    # Dos workers a la vez (SKIP LOCKED): cada email se envía una sola vez
+    await _encolar(*[(f"lote{i}", f"cuerpo {i}") for i in range(50)])
+    antes = len(envio.enviados)
+    await asyncio.gather(_procesar_todo(), _procesar_todo())
+    lote = [d for d, _ in envio.enviados[antes:] if d.startswith("lote")]
+    assert len(lote) == 50 and len(set(lote)) == 50, f"{len(lote)} envíos, {len(set(lote))} distintos"
+
+
+async def _limpiar():
+    async with SessionLocal() as session:
+        await session.execute(
+            text("DELETE FROM sistema.email_outbox WHERE destinatario LIKE :d"), {"d": f"%@{DOMINIO}"}
+        )
+        await session.commit()
+
+
+PRUEBAS = [
+    probar_envio, probar_reintento_y_dead_letter, probar_sin_cuerpo,
+    probar_tope_al_retomar, probar_reintentar_fallidos, probar_workers_concurrentes,
+]
+
+
+async def main() -> int:
+    print("=== PRUEBA DE LA BANDEJA DE SALIDA DE EMAILS ===")
+    async with SessionLocal() as session:
+        ajenos = (await session.execute(text(
+            "SELECT count(*) FROM sistema.email_outbox WHERE estado IN ('pendiente', 'enviando')"
+        ))).scalar_one()
+    if ajenos:
+        print(f"❌ La bandeja tiene {ajenos} emails pendientes; la prueba los enviaría. Use una base de pruebas.")
+        return 1
+
+    email_service.send_batch = envio
+    fallidas = 0
+    try:
+        for prueba in PRUEBAS:
+            try:
+                await prueba()
+                print(f"✅ {prueba.__name__}")
+            except Exception as e:
+                fallidas += 1
+                print(f"❌ {prueba.__name__}: {type(e).__name__} {e}")
+    finally:
+        await _limpiar()
+        await engine.dispose()
+    print(f"\n{len(PRUEBAS) - fallidas}/{len(PRUEBAS)} pruebas correctas")
+    return 1 if fallidas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,90 @@
+# usuario_actual.py
+# Carga del Usuario autenticado una sola vez por petición, con caché de corta duración
+
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from dotenv import load_dotenv
+
+from models import Usuario
+from security import get_current_user
+from database import get_session
+from repositorio_usuarios import usuario_por_id
+from cache_bus import bus_invalidacion
+
+load_dotenv()
+
+# Segundos que se reutilizan las columnas de un usuario sin volver a consultarlo (0 = sin caché)
+USUARIO_CACHE_TTL_S = float(os.getenv("USUARIO_CACHE_TTL_S", "30"))
+# Usuarios en caché a partir de los que se vacía por completo
+USUARIO_CACHE_MAX = 1000
+
+# id de usuario -> (vence en, columnas)
+_cache: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+_COLUMNAS = [atributo.key for atributo in inspect(Usuario).column_attrs]
+
+
+def invalidar_usuario(user_id: Optional[int] = None):
+    """
+    Descarta de la caché local un usuario (o todos). Las escrituras no la
+    llaman directamente: publican con `bus_invalidacion.publicar(session,
+    "usuarios", id)` para que se invalide en todos los procesos.
+    """
+    if user_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(user_id, None)
+
+
+bus_invalidacion.registrar("usuarios", invalidar_usuario)
+
+
+def _guardar(usuario: Usuario):
+    if USUARIO_CACHE_TTL_S <= 0:
+        return
+    if len(_cache) >= USUARIO_CACHE_MAX:
+        _cache.clear()
+    columnas = {clave: getattr(usuario, clave) for clave in _COLUMNAS}
+    _cache[usuario.id] = (time.monotonic() + USUARIO_CACHE_TTL_S, columnas)
+
+
+async def cargar_usuario(session: AsyncSession, user_id: int) -> Optional[Usuario]:
+    """
+    Usuario por id asociado a `session`. Si sus columnas están en caché se
+    reconstruye sin consultar la base de datos (merge con load=False); si no,
+    se consulta y se guarda en la caché.
+    """
+    entrada = _cache.get(user_id)
+    if entrada and entrada[0] > time.monotonic():
+        usuario = Usuario(**entrada[1])
+        make_transient_to_detached(usuario)
+        return await session.merge(usuario, load=False)
+
+    usuario = await usuario_por_id(session, user_id)
+    if usuario is not None:
+        _guardar(usuario)
+    return usuario
+
+
+async def get_usuario_actual(
+    current_user: dict = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+) -> Usuario:
+    """
+    Proveedor de dependencia con el Usuario del token. FastAPI resuelve cada
+    dependencia una vez por petición, así que los endpoints y las
+    dependencias anidadas que lo usan comparten la misma instancia.
+    """
+    user_id = current_user.get("user_id")
+    usuario = await cargar_usuario(session, user_id) if user_id else None
+    if not usuario:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+    return usuario
@@ -23,7 +23,7 @@ export default function BackupSystem() {
           const downloadUrl = window.URL.createObjectURL(blob);
           const a = document.createElement('a');
           a.href = downloadUrl;
-          a.download = `backup_${tableName}_${new Date().toISOString().split('T')[0]}.${tableName === 'sistema' ? 'zip' : 'json'}`;
+          a.download = `backup_${tableName}_${new Date().toISOString().split('T')[0]}.${tableName === 'sistema' ? 'zip' : 'ndjson'}`;
           document.body.appendChild(a);
           a.click();
           window.URL.revokeObjectURL(downloadUrl);
@@ -92,7 +92,7 @@ export default function BackupSystem() {
                 onClick={() => handleAction(`${API_URL}/backup/${table.name}`, table.name)}
                 disabled={loading}
               >
-                💾 Descargar JSON
+                💾 Descargar NDJSON
               </button>
             </div>
           ))}
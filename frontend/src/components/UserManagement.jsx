@@ -4,6 +4,8 @@ import './UserManagement.css';
 
 const UserManagement = () => {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [search, setSearch] = useState('');
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [showCreateForm, setShowCreateForm] = useState(false);
@@ -26,14 +28,24 @@ const UserManagement = () => {
   const currentUser = JSON.parse(localStorage.getItem('user') || '{}');
   const isAdmin = currentUser && currentUser.rol === 'admin';
 
-  const fetchUsers = async () => {
+  // Sin cursor carga la primera página; con cursor agrega la siguiente
+  const fetchUsers = async (cursor = null) => {
     try {
-      const endpoint = isAdmin ? `/api/auth/users` : `/api/auth/me`;
+      const params = new URLSearchParams();
+      if (search) params.set('busqueda', search);
+      if (cursor) params.set('cursor', cursor);
+      const query = params.toString();
+      const endpoint = isAdmin ? `/api/auth/users${query ? `?${query}` : ''}` : `/api/auth/me`;
       const response = await authFetch(endpoint);
       if (response.ok) {
         const data = await response.json();
-        // /auth/me retorna un objeto simple, /auth/users retorna un array
-        setUsers(isAdmin ? data : [data]);
+        // /auth/me retorna un objeto simple, /auth/users retorna un array (una página)
+        if (isAdmin) {
+          setUsers((prev) => (cursor ? [...prev, ...data] : data));
+          setNextCursor(response.headers.get('X-Next-Cursor'));
+        } else {
+          setUsers([data]);
+        }
       } else {
         setError(isAdmin ? 'No tienes permisos para ver usuarios' : 'No se pudo cargar tu perfil');
       }
@@ -44,7 +56,10 @@ const UserManagement = () => {
     }
   };
 
-  useEffect(() => { fetchUsers(); }, []);
+  useEffect(() => {
+    const timer = setTimeout(() => fetchUsers(), search ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [search]);
 
   const handleEditClick = (user) => {
     setEditUser({ ...user });
@@ -167,6 +182,17 @@ const UserManagement = () => {
         )}
       </div>
 
+      {isAdmin && (
+        <div className="form-group" style={{ maxWidth: '360px' }}>
+          <input
+            type="search"
+            placeholder="Buscar por usuario, email o nombre"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+          />
+        </div>
+      )}
+
       <div className="table-container">
         <table>
           <thead>
@@ -203,6 +229,12 @@ const UserManagement = () => {
         </table>
       </div>
 
+      {isAdmin && nextCursor && (
+        <div style={{ textAlign: 'center', marginTop: '16px' }}>
+          <button className="btn" onClick={() => fetchUsers(nextCursor)}>Cargar más</button>
+        </div>
+      )}
+
       {(showCreateForm || showEditModal) && (
         <div className="modal-overlay">
           <div className="modal fade-in">